@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# Copyright 2011-2015 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark the generation of the data model by the SchemaParser using the
+bundled xnat.xsd. Parsing, writing and compiling the generated code are timed
+separately. The first round includes filling the caches (e.g. the source of the
+base classes), so it is reported separately from the following rounds::
+
+    $ python benchmarks/bench_convert_xsd.py --rounds 20
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+import argparse
+import logging
+import os
+import sys
+import timeit
+
+import six
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from xnat.convert_xsd import SchemaParser
+
+DEFAULT_SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'xnat.xsd')
+
+# The xnat.xsd uses some types of the xdat schema, which is not bundled
+XDAT_STUB = ('<xs:schema targetNamespace="http://nrg.wustl.edu/xdat" xmlns:xdat="http://nrg.wustl.edu/xdat" '
+             'xmlns:xs="http://www.w3.org/2001/XMLSchema">'
+             '<xs:simpleType name="LONGVARCHAR"><xs:restriction base="xs:string"/></xs:simpleType>'
+             '</xs:schema>')
+
+
+def parse(schema_path, logger):
+    parser = SchemaParser(logger=logger)
+    parser.parse_schema_xmlstring(XDAT_STUB, 'xdat.xsd')
+    parser.parse_schema_file(schema_path)
+    return parser
+
+
+def run_round(schema_path, logger):
+    start = timeit.default_timer()
+    parser = parse(schema_path, logger)
+    parsed = timeit.default_timer()
+
+    code_file = six.StringIO()
+    parser.write(code_file)
+    written = timeit.default_timer()
+
+    compile(code_file.getvalue(), '<generated>', 'exec')
+    compiled = timeit.default_timer()
+
+    return parsed - start, written - parsed, compiled - written
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='Benchmark the XNAT data model generation')
+    argument_parser.add_argument('--schema', default=DEFAULT_SCHEMA, help='schema file to parse')
+    argument_parser.add_argument('--rounds', type=int, default=10, help='number of rounds after the first round')
+    args = argument_parser.parse_args()
+
+    logger = logging.getLogger('bench_convert_xsd')
+    logger.setLevel('WARNING')
+
+    first = run_round(args.schema, logger)
+    rounds = [run_round(args.schema, logger) for _ in range(args.rounds)]
+
+    print('{:<12}{:>10}{:>10}{:>10}{:>10}'.format('', 'parse', 'write', 'compile', 'total'))
+    print('{:<12}{:>9.1f}ms{:>8.1f}ms{:>8.1f}ms{:>8.1f}ms'.format('first', *[1000 * x for x in first + (sum(first),)]))
+
+    if rounds:
+        best = [min(x[i] for x in rounds) for i in range(3)]
+        mean = [sum(x[i] for x in rounds) / len(rounds) for i in range(3)]
+        print('{:<12}{:>9.1f}ms{:>8.1f}ms{:>8.1f}ms{:>8.1f}ms'.format('best', *[1000 * x for x in best + [sum(best)]]))
+        print('{:<12}{:>9.1f}ms{:>8.1f}ms{:>8.1f}ms{:>8.1f}ms'.format('mean', *[1000 * x for x in mean + [sum(mean)]]))
+
+
+if __name__ == '__main__':
+    main()
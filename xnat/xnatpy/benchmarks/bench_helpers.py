@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# Copyright 2011-2015 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Microbenchmarks for the hot helper functions in xnat.utils and xnat.core.
+Every benchmark reports the best time per call in microseconds. Results can be
+saved as a baseline and later runs compared against it, the script exits with
+status 1 if a benchmark got slower than the allowed tolerance::
+
+    $ python benchmarks/bench_helpers.py --save baseline.json
+    $ python benchmarks/bench_helpers.py --compare baseline.json --tolerance 0.25
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+import argparse
+import json
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from xnat import core, utils
+from xnat.session import XNATSession
+
+CLASS_NAMES = ['xnat:mrSessionData', 'xnat:subjectData', 'xnat:imageScanData', 'xnat:abstractResource',
+               'xnat:projectData_alias', 'xnat:demographicData', 'prov:processStep', 'xnat:qcAssessmentData']
+ATTRIBUTE_NAMES = ['ID', 'label', 'insert_date', 'scanner/manufacturer', 'parameters/voxelRes',
+                   'fields/field', 'subject_ID', 'dcmAccessionNumber', 'UID', 'xnat_abstractresource_id']
+
+
+class BenchmarkSession(XNATSession):
+    """
+    Session without a connection, sufficient to create objects for the benchmarks
+    """
+    def __init__(self):
+        super(BenchmarkSession, self).__init__(server='https://xnat.example.com',
+                                               logger=logging.getLogger('bench_helpers'),
+                                               interface=object(),
+                                               keepalive=False)
+
+    @property
+    def session_expiration_time(self):
+        return None
+
+    def connect(self, *args, **kwargs):
+        pass
+
+    def disconnect(self):
+        pass
+
+
+class BenchmarkExperiment(core.XNATObject):
+    _XSI_TYPE = 'xnat:mrSessionData'
+
+
+def create_experiment(session, nr_children=50):
+    experiment = BenchmarkExperiment('/data/experiments/BENCH_E01', session)
+    experiment._cache['fulldata'] = {
+        'data_fields': {'ID': 'BENCH_E01', 'label': 'bench'},
+        'meta': {'isHistory': False, 'xsi:type': 'xnat:mrSessionData'},
+        'children': [{'field': 'field_{}/item'.format(x),
+                      'items': [{'data_fields': {'name': 'n{}'.format(x), 'field': str(x)},
+                                 'meta': {'isHistory': False, 'xsi:type': 'xnat:fieldDefinition'}}]}
+                     for x in range(nr_children)],
+    }
+    return experiment
+
+
+def benchmarks():
+    session = BenchmarkSession()
+    experiment = create_experiment(session)
+    listing = core.XNATSimpleListing(parent=experiment, field_name='field_49/item', secondary_lookup_field='name')
+
+    return {
+        'utils.pythonize_class_name': lambda: [utils.pythonize_class_name(x) for x in CLASS_NAMES],
+        'utils.pythonize_attribute_name': lambda: [utils.pythonize_attribute_name(x) for x in ATTRIBUTE_NAMES],
+        'XNATBaseListing.sanitize_name': lambda: [listing.sanitize_name(x) for x in ATTRIBUTE_NAMES],
+        'XNATBaseObject.get_children': lambda: experiment.get_children('field_49/item'),
+        'XNATSimpleListing.fulldata': lambda: listing.fulldata,
+        'XNATBaseObject.data': lambda: experiment.data,
+        'XNATBaseObject.get': lambda: experiment.get('label'),
+    }
+
+
+def run(number, repeat):
+    results = {}
+    for name, function in sorted(benchmarks().items()):
+        timings = timeit.repeat(function, number=number, repeat=repeat)
+        results[name] = 1e6 * min(timings) / number
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmarks of xnatpy helper functions')
+    parser.add_argument('--number', type=int, default=2000, help='calls per timing')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timings, the best is reported')
+    parser.add_argument('--save', help='save the results as baseline to this JSON file')
+    parser.add_argument('--compare', help='compare the results to the baseline in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative slowdown compared to the baseline (default 0.25)')
+    args = parser.parse_args()
+
+    results = run(args.number, args.repeat)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    regressions = []
+    for name, value in sorted(results.items()):
+        if name in baseline:
+            change = value / baseline[name] - 1.0
+            flag = ''
+            if change > args.tolerance:
+                regressions.append(name)
+                flag = '  REGRESSION'
+            print('{:<36}{:>10.2f} us  ({:+.0%} vs {:.2f} us){}'.format(name, value, change, baseline[name], flag))
+        else:
+            print('{:<36}{:>10.2f} us'.format(name, value))
+
+    if args.save:
+        with open(args.save, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+
+    if regressions:
+        print('{} benchmark(s) slower than the baseline: {}'.format(len(regressions), ', '.join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# Copyright 2011-2015 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark typical client workloads against the in-process mock XNAT server
+(see mock_xnat.py): connecting (building the data model), crawling a project
+down to the files, searching, downloading with a sync (a full and an
+incremental run), uploading a directory (per file and as one archive),
+importing a session and copying a project with the copy_project script.
+The latency per request and the bandwidth of the server can be set to
+emulate a remote server. For every workload the best round is reported with
+its time, number of requests and the amount of data transferred.
+As for the helper benchmarks, results can be saved and compared::
+
+    $ python benchmarks/bench_workloads.py --latency 0.02 --bandwidth 50 --save baseline.json
+    $ python benchmarks/bench_workloads.py --latency 0.02 --bandwidth 50 --compare baseline.json
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+import zipfile
+
+import six
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'xnat', 'scripts'))
+
+import xnat
+from copy_project import XNATProjectCopier
+from mock_xnat import MockXNATServer, file_content, generate_fixture
+
+WORKLOADS = ['connect', 'crawl', 'search', 'download', 'download_incremental',
+             'upload_per_file', 'upload_tgz', 'import', 'copy']
+
+
+class Workloads(object):
+    """
+    The workloads, every workload is a method that gets the round number.
+    A workload can have a ``setup_<workload>`` method, which is called once
+    before the timed rounds.
+    """
+    def __init__(self, server, session, work_dir, args):
+        self.server = server
+        self.fixture = server.application.fixture
+        self.session = session
+        self.work_dir = work_dir
+        self.args = args
+        self.project = session.projects['PROJECT1']
+
+        # Data for the uploads and import
+        self.upload_dir = os.path.join(work_dir, 'upload')
+        os.makedirs(self.upload_dir)
+        for index in range(args.files):
+            with open(os.path.join(self.upload_dir, 'file{:04d}.dat'.format(index)), 'wb') as data_file:
+                data_file.write(file_content('upload{}'.format(index), args.file_size))
+
+        self.import_path = os.path.join(work_dir, 'import.zip')
+        with zipfile.ZipFile(self.import_path, 'w') as archive:
+            for index in range(args.files):
+                archive.writestr('session/scans/1/resources/DICOM/files/{:06d}.dcm'.format(index),
+                                 file_content('import{}'.format(index), args.file_size))
+
+    def connect(self, round_):
+        with xnat.connect(self.server.url, user='admin', password='admin', logger=self.session.logger):
+            pass
+
+    def crawl(self, round_):
+        self.session.clearcache()
+        for subject in self.session.projects['PROJECT1'].subjects.values():
+            for experiment in subject.experiments.values():
+                for scan in experiment.scans.values():
+                    for resource in scan.resources.values():
+                        list(resource.files.values())
+
+    def search(self, round_):
+        subjects = self.session.classes.SubjectData
+        list(subjects.query().filter(subjects.label.like('%_S00%')).iterate())
+
+    def download(self, round_):
+        target_dir = os.path.join(self.work_dir, 'download{}'.format(round_))
+        self.session.clearcache()
+        self.project.sync_dir(target_dir, max_workers=self.args.workers)
+        shutil.rmtree(target_dir)
+
+    def setup_download_incremental(self):
+        # The first (full) run is not timed, the rounds only check for changes
+        target_dir = os.path.join(self.work_dir, 'download_incremental')
+        self.project.sync_dir(target_dir, max_workers=self.args.workers)
+
+        # Regression check: the files of resources outside the filter should not be deleted
+        report = self.project.sync_dir(target_dir, dry_run=True, delete_policy='delete', resources=['DICOM'],
+                                       max_workers=self.args.workers)
+        if report.deleted:
+            raise RuntimeError('Sync of the DICOM resources would delete {} other files'.format(len(report.deleted)))
+
+    def download_incremental(self, round_):
+        target_dir = os.path.join(self.work_dir, 'download_incremental')
+        self.session.clearcache()
+        self.project.sync_dir(target_dir, max_workers=self.args.workers)
+
+    def _new_resource(self, label):
+        experiment = self.project.experiments[0]
+        return self.session.classes.ResourceCatalog(parent=experiment, label=label)
+
+    def upload_per_file(self, round_):
+        resource = self._new_resource('UPLOAD_PER_FILE{}'.format(round_))
+        resource.upload_dir(self.upload_dir, method='per_file', max_workers=self.args.workers)
+
+    def upload_tgz(self, round_):
+        resource = self._new_resource('UPLOAD_TGZ{}'.format(round_))
+        resource.upload_dir(self.upload_dir, method='tgz_memory')
+
+    def import_(self, round_):
+        self.session.services.import_(self.import_path, project='EMPTY',
+                                      subject='IMPORT{}'.format(round_), experiment='IMPORT{}_MR1'.format(round_))
+
+    def copy(self, round_):
+        dest_id = 'COPY{}'.format(round_)
+        self.fixture.add_project(dest_id)
+        self.session.projects.clearcache()
+        dest_project = self.session.projects[dest_id]
+
+        # The copier reports every object it copies
+        stdout = sys.stdout
+        sys.stdout = six.StringIO()
+        try:
+            copier = XNATProjectCopier(self.session, self.project, self.session, dest_project,
+                                       workers=self.args.workers)
+            failed = copier.start()
+            del copier
+        finally:
+            sys.stdout = stdout
+
+        if failed:
+            raise RuntimeError('Copy failed for subjects {}'.format(', '.join(failed)))
+
+
+def run(args):
+    fixture = generate_fixture(subjects=args.subjects, experiments=args.experiments, scans=args.scans,
+                               files=args.files, file_size=args.file_size)
+    bandwidth = args.bandwidth * 1e6 if args.bandwidth else None
+    logger = logging.getLogger('bench_workloads')
+    logger.addHandler(logging.NullHandler())
+    work_dir = tempfile.mkdtemp(prefix='bench_workloads')
+
+    results = {}
+    try:
+        with MockXNATServer(fixture, latency=args.latency, bandwidth=bandwidth) as server:
+            application = server.application
+            with xnat.connect(server.url, user='admin', password='admin', logger=logger) as session:
+                workloads = Workloads(server, session, work_dir, args)
+
+                for name in args.workloads:
+                    function = getattr(workloads, 'import_' if name == 'import' else name)
+                    setup = getattr(workloads, 'setup_{}'.format(name), None)
+                    if setup is not None:
+                        setup()
+
+                    best = None
+                    for round_ in range(args.rounds):
+                        requests_before = application.request_count
+                        bytes_before = application.bytes_sent + application.bytes_received
+                        start = timeit.default_timer()
+                        function(round_)
+                        duration = timeit.default_timer() - start
+
+                        if best is None or duration < best['seconds']:
+                            best = {
+                                'seconds': duration,
+                                'requests': application.request_count - requests_before,
+                                'megabytes': (application.bytes_sent + application.bytes_received - bytes_before) / 1e6,
+                            }
+
+                    results[name] = best
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark client workloads against a mock XNAT server')
+    parser.add_argument('--latency', type=float, default=0.0, help='latency per request in seconds')
+    parser.add_argument('--bandwidth', type=float, help='bandwidth of the server in MB/s (default unlimited)')
+    parser.add_argument('--subjects', type=int, default=10, help='number of subjects in the project')
+    parser.add_argument('--experiments', type=int, default=2, help='experiments per subject')
+    parser.add_argument('--scans', type=int, default=4, help='scans per experiment')
+    parser.add_argument('--files', type=int, default=10, help='files per scan (and for the uploads)')
+    parser.add_argument('--file-size', type=int, default=32768, help='size of the files in bytes')
+    parser.add_argument('--workers', type=int, default=4, help='concurrency of the workloads that support it')
+    parser.add_argument('--rounds', type=int, default=3, help='number of timings, the best is reported')
+    parser.add_argument('--workloads', default=','.join(WORKLOADS),
+                        help='comma separated workloads to run (default: {})'.format(','.join(WORKLOADS)))
+    parser.add_argument('--save', help='save the results as baseline to this JSON file')
+    parser.add_argument('--compare', help='compare the results to the baseline in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative slowdown compared to the baseline (default 0.25)')
+    args = parser.parse_args()
+
+    args.workloads = [x.strip() for x in args.workloads.split(',') if x.strip()]
+    unknown = [x for x in args.workloads if x not in WORKLOADS]
+    if unknown:
+        parser.error('unknown workloads: {}'.format(', '.join(unknown)))
+
+    results = run(args)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    regressions = []
+    for name in args.workloads:
+        result = results[name]
+        line = '{:<24}{:>9.3f} s {:>7d} requests {:>9.2f} MB'.format(name, result['seconds'], result['requests'],
+                                                                      result['megabytes'])
+        if name in baseline:
+            change = result['seconds'] / baseline[name]['seconds'] - 1.0
+            line += '  ({:+.0%} vs {:.3f} s)'.format(change, baseline[name]['seconds'])
+            if change > args.tolerance:
+                regressions.append(name)
+                line += '  REGRESSION'
+        print(line)
+
+    if args.save:
+        with open(args.save, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+
+    if regressions:
+        print('{} workload(s) slower than the baseline: {}'.format(len(regressions), ', '.join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,972 @@
+# Copyright 2011-2015 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+In-process stand-in for an XNAT server, so the client can be exercised and
+benchmarked without a live server. A WSGI application serves the parts of the
+REST API used by xnatpy from an in-memory fixture tree: login, version and
+schemas (so ``xnat.connect`` works unchanged), projects, subjects,
+experiments, scans, resources and files (listings, JSON documents, downloads
+as zip/tar archives, ranged reads, uploads with extraction and object
+creation), search, the prearchive and the import and archive services.
+Every request can be slowed down with a fixed latency and the transfer of
+bodies limited to a bandwidth::
+
+    >>> fixture = generate_fixture(subjects=10, experiments=2, scans=4, files=20)
+    >>> with MockXNATServer(fixture, latency=0.02, bandwidth=50e6) as server:
+    ...     with xnat.connect(server.url, user='admin', password='admin') as session:
+    ...         print(session.projects['PROJECT1'].subjects)
+
+The fixture is not a full XNAT: only the fields needed by the client are
+stored, writes to nested objects are stored as flat fields, and imported
+sessions are archived directly unless ``dest`` points at the prearchive.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+from collections import OrderedDict
+import csv
+import datetime
+import fnmatch
+import hashlib
+import io
+import itertools
+import json
+import os
+import re
+import sys
+import tarfile
+import threading
+import time
+import zipfile
+from wsgiref.simple_server import make_server, WSGIRequestHandler, WSGIServer
+from xml.etree import ElementTree
+
+import six
+from six.moves import socketserver
+from six.moves.urllib import parse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_convert_xsd import DEFAULT_SCHEMA, XDAT_STUB
+from xnat.utils import BandwidthLimiter
+
+LOGIN_PAGE = ('<html><body><span id="user_info">Logged in as: &nbsp;<a id="username-link" '
+              'href="/app/template/XDATScreen_UpdateUser.vm">{user}</a></span></body></html>')
+
+FIELD_PATTERN = re.compile(r'fields/field\[name=(?P<name>[^\]]+)\]/field$')
+XDAT_NS = '{http://nrg.wustl.edu/security}'
+
+# Collection name -> kind of the nodes in the collection
+COLLECTIONS = {
+    'projects': 'project',
+    'subjects': 'subject',
+    'experiments': 'experiment',
+    'scans': 'scan',
+    'assessors': 'assessor',
+    'resources': 'resource',
+}
+
+DEFAULT_TYPES = {
+    'project': 'xnat:projectData',
+    'subject': 'xnat:subjectData',
+    'experiment': 'xnat:mrSessionData',
+    'scan': 'xnat:mrScanData',
+    'assessor': 'xnat:qcAssessmentData',
+    'resource': 'xnat:resourceCatalog',
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message=''):
+        super(HTTPError, self).__init__(message)
+        self.status = status
+        self.message = message
+
+
+class FixtureNode(object):
+    """
+    An object in the fixture tree (project, subject, experiment, scan,
+    assessor or resource). Resources contain the files as an ordered mapping
+    of path to content.
+    """
+    def __init__(self, kind, id_, label=None, xsi_type=None, parent=None, data_fields=None):
+        self.kind = kind
+        self.id = id_
+        self.label = label if label is not None else id_
+        self.xsi_type = xsi_type or DEFAULT_TYPES[kind]
+        self.parent = parent
+        self.data_fields = dict(data_fields or {})
+        self.fields = OrderedDict()
+        self.children = OrderedDict((x, OrderedDict()) for x in COLLECTIONS)
+        self.files = OrderedDict()
+
+    def __repr__(self):
+        return '<FixtureNode {} {} ({})>'.format(self.kind, self.id, self.label)
+
+    @property
+    def project(self):
+        node = self
+        while node.kind != 'project':
+            node = node.parent
+        return node
+
+    @property
+    def uri(self):
+        if self.kind == 'project':
+            return '/data/projects/{}'.format(self.id)
+        elif self.kind == 'subject':
+            return '{}/subjects/{}'.format(self.parent.uri, self.id)
+        elif self.kind == 'experiment':
+            return '/data/experiments/{}'.format(self.id)
+        elif self.kind in ('scan', 'assessor'):
+            return '{}/{}s/{}'.format(self.parent.uri, self.kind, self.id)
+        else:
+            return '{}/resources/{}'.format(self.parent.uri, self.id)
+
+    def collection(self, name):
+        """
+        All nodes in a collection of this node, the experiments of a project
+        are the experiments of its subjects
+        """
+        if self.kind == 'project' and name == 'experiments':
+            return [x for subject in self.children['subjects'].values() for x in subject.children['experiments'].values()]
+        return list(self.children[name].values())
+
+    def lookup(self, name, key):
+        if key == 'ALL':
+            return self.collection(name)
+        return [x for x in self.collection(name) if key in (x.id, x.label)][:1]
+
+    def add(self, node):
+        node.parent = self
+        self.children['{}s'.format(node.kind)][node.id] = node
+        return node
+
+    def remove(self, node):
+        collection = self.children['{}s'.format(node.kind)]
+        collection.pop(node.id, None)
+
+    def row(self):
+        """
+        The row of this node in a listing
+        """
+        if self.kind == 'resource':
+            return {
+                'xnat_abstractresource_id': self.id,
+                'label': self.label,
+                'element_name': self.xsi_type,
+                'format': self.data_fields.get('format', ''),
+                'content': self.data_fields.get('content', ''),
+                'file_count': str(len(self.files)),
+                'file_size': str(sum(len(x) for x in self.files.values())),
+            }
+
+        row = dict(self.data_fields)
+        row.update({'ID': self.id, 'URI': self.uri, 'xsiType': self.xsi_type})
+        if self.kind == 'project':
+            row.update({'name': self.label, 'secondary_ID': self.label})
+        else:
+            row['label'] = self.label
+            row['project'] = self.project.id
+        if self.kind == 'experiment':
+            row['subject_ID'] = self.parent.id
+        if self.kind == 'scan':
+            row.setdefault('type', self.label)
+        return row
+
+    def document(self):
+        """
+        The JSON document of this node (as returned for the uri of an object)
+        """
+        data_fields = {k: v for k, v in self.row().items() if k not in ('URI', 'xsiType')}
+        if self.kind == 'resource':
+            data_fields['ID'] = self.id
+
+        children = []
+        if self.fields:
+            children.append({
+                'field': 'fields/field',
+                'items': [{'data_fields': {'name': name, 'field': value},
+                           'meta': {'xsi:type': 'xnat:{}Data_field'.format(self.kind), 'isHistory': False}}
+                          for name, value in self.fields.items()],
+            })
+
+        return {'items': [{'data_fields': data_fields,
+                           'meta': {'xsi:type': self.xsi_type, 'isHistory': False},
+                           'children': children}]}
+
+    def archive_prefix(self):
+        """
+        Directory of the resources of this node in the archives created by the server
+        """
+        if self.kind == 'scan':
+            return '{}/scans/{}'.format(self.parent.label, self.id)
+        elif self.kind == 'assessor':
+            return '{}/assessors/{}'.format(self.parent.label, self.label)
+        return self.label
+
+
+class Fixture(object):
+    """
+    The tree of projects with an index of all subjects and experiments
+    """
+    def __init__(self):
+        self.root = FixtureNode('project', '/', label='root')
+        self.prearchive = OrderedDict()
+        self._counters = {}
+        self.lock = threading.RLock()
+
+    def new_id(self, kind):
+        number = self._counters[kind] = self._counters.get(kind, 0) + 1
+        if kind == 'subject':
+            return 'XNAT_S{:05d}'.format(number)
+        elif kind in ('experiment', 'assessor'):
+            return 'XNAT_E{:05d}'.format(number)
+        return str(number)
+
+    @property
+    def projects(self):
+        return self.root.children['projects']
+
+    def add_project(self, project_id, **data_fields):
+        return self.root.add(FixtureNode('project', project_id, data_fields=data_fields))
+
+    def add_child(self, parent, kind, label=None, xsi_type=None, id_=None, **data_fields):
+        if id_ is None:
+            id_ = label if kind == 'scan' else self.new_id(kind)
+        return parent.add(FixtureNode(kind, id_, label=label, xsi_type=xsi_type, data_fields=data_fields))
+
+    def collection(self, name):
+        """
+        A top-level collection (all projects, subjects or experiments)
+        """
+        projects = list(self.projects.values())
+        if name == 'projects':
+            return projects
+        elif name == 'subjects':
+            return [x for project in projects for x in project.collection('subjects')]
+        elif name == 'experiments':
+            return [x for project in projects for x in project.collection('experiments')]
+        raise HTTPError(404, 'Unknown collection {}'.format(name))
+
+    def lookup(self, name, key):
+        return [x for x in self.collection(name) if key in (x.id, x.label)][:1]
+
+    def nodes_of_type(self, xsi_type):
+        nodes = []
+        stack = list(self.projects.values())
+        while stack:
+            node = stack.pop()
+            if node.xsi_type == xsi_type:
+                nodes.append(node)
+            for name in ('subjects', 'experiments', 'scans', 'assessors'):
+                stack.extend(node.children[name].values())
+        return nodes
+
+
+def _content_pool(size=1048576):
+    # Incompressible data, so archives and transfers are realistic in size
+    return b''.join(hashlib.sha256(str(x).encode('ascii')).digest() for x in range(size // 32))
+
+
+CONTENT_POOL = _content_pool()
+
+
+def file_content(seed, size):
+    """
+    Deterministic (and practically incompressible) content of a generated file
+    """
+    offset = int(hashlib.md5(seed.encode('utf-8')).hexdigest(), 16) % len(CONTENT_POOL)
+    data = CONTENT_POOL[offset:] + CONTENT_POOL
+    while len(data) < size:
+        data += CONTENT_POOL
+    return data[:size]
+
+
+def generate_fixture(projects=1, subjects=10, experiments=2, scans=4, files=10, file_size=32768,
+                     resource='DICOM', experiment_resources=('SNAPSHOTS',)):
+    """
+    Generate a fixture with a regular tree of objects and files
+
+    :param int projects: number of projects (PROJECT1, PROJECT2, ...)
+    :param int subjects: subjects per project
+    :param int experiments: experiments per subject
+    :param int scans: scans per experiment
+    :param int files: files per scan resource
+    :param int file_size: size of every file in bytes
+    :param str resource: label of the scan resources
+    :param tuple experiment_resources: labels of resources of the experiments (with one file each)
+    :rtype: Fixture
+    """
+    fixture = Fixture()
+    for project_index in range(1, projects + 1):
+        project = fixture.add_project('PROJECT{}'.format(project_index), description='Generated project')
+        for subject_index in range(1, subjects + 1):
+            subject = fixture.add_child(project, 'subject', label='{}_S{:04d}'.format(project.id, subject_index))
+            subject.fields['group'] = 'control' if subject_index % 2 else 'patient'
+            for experiment_index in range(1, experiments + 1):
+                experiment = fixture.add_child(subject, 'experiment',
+                                               label='{}_MR{}'.format(subject.label, experiment_index),
+                                               date='2017-01-{:02d}'.format(experiment_index % 28 + 1))
+                for label in experiment_resources:
+                    experiment_resource = fixture.add_child(experiment, 'resource', label=label)
+                    experiment_resource.files['snapshot.txt'] = file_content(experiment.label, 1024)
+
+                for scan_index in range(1, scans + 1):
+                    scan = fixture.add_child(experiment, 'scan', label=str(scan_index), type='T1w',
+                                             series_description='Generated series {}'.format(scan_index))
+                    scan_resource = fixture.add_child(scan, 'resource', label=resource, format='DICOM')
+                    for file_index in range(1, files + 1):
+                        path = '{:06d}.dcm'.format(file_index)
+                        scan_resource.files[path] = file_content('{}/{}/{}'.format(experiment.id, scan.id, path),
+                                                                 file_size)
+
+    # The empty target project for copy workloads
+    fixture.add_project('EMPTY', description='Empty project')
+    return fixture
+
+
+class MockXNATApplication(object):
+    """
+    WSGI application serving a :py:class:`Fixture` as an XNAT REST API
+
+    :param Fixture fixture: the data to serve
+    :param float latency: time in seconds added to every request
+    :param float bandwidth: maximum rate in bytes per second for request and response bodies, None for unlimited
+    :param str version: the XNAT version reported by the server
+    :param float prearchive_delay: time in seconds an imported session stays in RECEIVING state
+    """
+    def __init__(self, fixture, latency=0.0, bandwidth=None, version='1.7.5', prearchive_delay=0.0,
+                 user='admin', chunk_size=65536):
+        self.fixture = fixture
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.version = version
+        self.prearchive_delay = prearchive_delay
+        self.user = user
+        self.chunk_size = chunk_size
+        self.request_count = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.request_count += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        method = environ['REQUEST_METHOD']
+        path = environ.get('PATH_INFO', '/')
+        query = dict(parse.parse_qsl(environ.get('QUERY_STRING', ''), keep_blank_values=True))
+        headers = {'Set-Cookie': 'JSESSIONID=mock; Path=/'}
+
+        try:
+            with self.fixture.lock:
+                status, body, content_type, extra_headers = self.dispatch(method, path, query, environ)
+        except HTTPError as error:
+            status, body, content_type, extra_headers = error.status, error.message, 'text/plain', {}
+
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+            content_type = 'application/json'
+        if isinstance(body, six.text_type):
+            body = body.encode('utf-8')
+
+        headers.update(extra_headers)
+        headers['Content-Type'] = content_type
+        headers['Content-Length'] = str(len(body))
+        start_response(str('{} {}'.format(status, STATUS_MESSAGES.get(status, 'Unknown'))),
+                       [(str(k), str(v)) for k, v in headers.items()])
+
+        if method == 'HEAD':
+            return [b'']
+        return self._send(body)
+
+    def _send(self, body):
+        limiter = BandwidthLimiter(self.bandwidth) if self.bandwidth else None
+        for offset in range(0, len(body), self.chunk_size):
+            chunk = body[offset:offset + self.chunk_size]
+            if limiter is not None:
+                limiter.throttle(len(chunk))
+            with self._lock:
+                self.bytes_sent += len(chunk)
+            yield chunk
+
+    def _read_body(self, environ):
+        stream = environ['wsgi.input']
+        limiter = BandwidthLimiter(self.bandwidth) if self.bandwidth else None
+        data = io.BytesIO()
+
+        if environ.get('HTTP_TRANSFER_ENCODING', '').lower() == 'chunked':
+            # The WSGI server does not decode chunked request bodies
+            while True:
+                size = int(stream.readline().split(b';')[0].strip() or b'0', 16)
+                if size == 0:
+                    stream.readline()
+                    break
+                data.write(stream.read(size))
+                stream.readline()
+                if limiter is not None:
+                    limiter.throttle(size)
+        else:
+            remaining = int(environ.get('CONTENT_LENGTH') or 0)
+            while remaining > 0:
+                chunk = stream.read(min(remaining, self.chunk_size))
+                if not chunk:
+                    break
+                data.write(chunk)
+                remaining -= len(chunk)
+                if limiter is not None:
+                    limiter.throttle(len(chunk))
+
+        body = data.getvalue()
+        with self._lock:
+            self.bytes_received += len(body)
+        return body
+
+    # Routing
+    def dispatch(self, method, path, query, environ):
+        if not path.startswith(('/data', '/xapi', '/REST')):
+            return 200, LOGIN_PAGE.format(user=self.user), 'text/html', {}
+
+        if path.startswith('/xapi'):
+            return self.xapi(path)
+
+        parts = [parse.unquote(x) for x in path.strip('/').split('/')][1:]
+        if parts[:1] == ['archive']:
+            parts = parts[1:]
+
+        if parts == ['JSESSION']:
+            return 200, 'mock', 'text/plain', {}
+        elif parts == ['version']:
+            raise HTTPError(404, 'Not found')
+        elif parts[:1] == ['services']:
+            return self.services(method, parts[1:], query, environ)
+        elif parts[:1] == ['prearchive']:
+            return self.prearchive(method, parts[1:], query)
+        elif parts == ['search']:
+            return self.search(self._read_body(environ), query)
+
+        return self.archive(method, parts, query, environ)
+
+    def xapi(self, path):
+        if path == '/xapi/siteConfig/buildInfo':
+            return 200, {'version': self.version}, 'application/json', {}
+        elif path == '/xapi/schemas':
+            return 200, ['xdat', 'xnat'], 'application/json', {}
+        elif path == '/xapi/schemas/xdat':
+            return 200, XDAT_STUB, 'text/xml', {}
+        elif path == '/xapi/schemas/xnat':
+            with io.open(DEFAULT_SCHEMA, 'rb') as schema_file:
+                return 200, schema_file.read(), 'text/xml', {}
+        raise HTTPError(404, 'Not found')
+
+    def resolve(self, parts):
+        """
+        Resolve the path to nodes, returns (nodes, collection, key, remainder),
+        where collection is set for listings (and key for objects that were
+        not found) and remainder is the file path for file requests
+        """
+        nodes = None
+        index = 0
+        while index < len(parts):
+            name = parts[index]
+            if name == 'files':
+                return nodes or [], 'files', None, '/'.join(parts[index + 1:])
+
+            if name not in COLLECTIONS:
+                raise HTTPError(404, 'Unknown collection {}'.format(name))
+
+            if index + 1 == len(parts):
+                return nodes, name, None, None
+
+            key = parts[index + 1]
+            if nodes is None:
+                found = self.fixture.lookup(name, key)
+            else:
+                found = [x for node in nodes for x in node.lookup(name, key)]
+
+            if not found:
+                if index + 2 == len(parts):
+                    return nodes, name, key, None
+                raise HTTPError(404, 'Could not find {} {}'.format(name, key))
+
+            nodes = found
+            index += 2
+
+        return nodes, None, None, None
+
+    def archive(self, method, parts, query, environ):
+        nodes, collection, key, file_path = self.resolve(parts)
+
+        if collection == 'files':
+            return self.files(method, nodes, file_path, query, environ)
+
+        if collection is not None and key is None:
+            if method != 'GET':
+                raise HTTPError(405, 'Method not allowed')
+            return self.listing(nodes, collection, query)
+
+        if key is not None:
+            # Object that does not exist, it can be created with a PUT
+            if method != 'PUT' or nodes is None or len(nodes) != 1:
+                raise HTTPError(404, 'Could not find {} {}'.format(collection, key))
+
+            kind = COLLECTIONS[collection]
+            node = self.fixture.add_child(nodes[0], kind,
+                                          label=query.get('label', key),
+                                          xsi_type=query.get('xsiType'),
+                                          id_=key if kind in ('scan', 'resource') else None)
+            if kind == 'resource':
+                node.label = query.get('label', key)
+            self.update(node, query)
+            return 201, node.id, 'text/plain', {}
+
+        node = nodes[0]
+        if method in ('GET', 'HEAD'):
+            return 200, node.document(), 'application/json', {}
+        elif method == 'PUT':
+            self.update(node, query)
+            return 200, node.id, 'text/plain', {}
+        elif method == 'DELETE':
+            node.parent.remove(node)
+            return 200, '', 'text/plain', {}
+        raise HTTPError(405, 'Method not allowed')
+
+    @staticmethod
+    def update(node, query):
+        for name, value in query.items():
+            if name in ('xsiType', 'req_format', 'format', 'event_reason', 'overwrite'):
+                continue
+            elif name == 'label':
+                node.label = value
+                continue
+
+            match = FIELD_PATTERN.search(name)
+            if match is not None:
+                node.fields[match.group('name').lower()] = value
+            else:
+                # Nested paths are stored as flat fields
+                node.data_fields[name.rsplit('/', 1)[-1]] = value
+
+    def listing(self, nodes, collection, query):
+        if nodes is None:
+            items = self.fixture.collection(collection)
+        else:
+            items = [x for node in nodes for x in node.collection(collection)]
+
+        rows = [x.row() for x in items]
+
+        # Filters on columns (e.g. label=*MR1)
+        for name, pattern in query.items():
+            if name in ('format', 'columns', 'offset', 'limit', 'xsiType'):
+                continue
+            rows = [x for x in rows if name not in x or fnmatch.fnmatch(six.text_type(x[name]), pattern)]
+
+        return 200, self.result_set(rows, query), 'application/json', {}
+
+    @staticmethod
+    def result_set(rows, query):
+        total = len(rows)
+        if 'offset' in query or 'limit' in query:
+            offset = int(query.get('offset') or 0)
+            limit = int(query.get('limit') or total)
+            rows = rows[offset:offset + limit]
+        return {'ResultSet': {'Result': rows, 'totalRecords': str(total)}}
+
+    # Files
+    @staticmethod
+    def resources_of(nodes):
+        resources = []
+        for node in nodes:
+            if node.kind == 'resource':
+                resources.append(node)
+            else:
+                resources.extend(node.collection('resources'))
+        return resources
+
+    def files(self, method, nodes, file_path, query, environ):
+        resources = self.resources_of(nodes)
+
+        if method == 'PUT' or method == 'POST':
+            if len(nodes) != 1:
+                raise HTTPError(400, 'Can only upload to a single resource')
+            resource = nodes[0] if nodes[0].kind == 'resource' else self._default_resource(nodes[0])
+            return self.upload(resource, file_path, query, self._read_body(environ))
+
+        if not file_path:
+            archive_format = query.get('format')
+            if archive_format in ('zip', 'tar', 'tar.gz', 'tgz'):
+                return self.archive_files(resources, archive_format)
+            if method != 'GET':
+                raise HTTPError(405, 'Method not allowed')
+            return 200, self.result_set(self.file_rows(resources), query), 'application/json', {}
+
+        for resource in resources:
+            content = resource.files.get(file_path)
+            if content is None:
+                continue
+
+            if method == 'DELETE':
+                del resource.files[file_path]
+                return 200, '', 'text/plain', {}
+
+            return self.ranged(content, environ)
+
+        raise HTTPError(404, 'Could not find file {}'.format(file_path))
+
+    def _default_resource(self, node):
+        resources = node.collection('resources')
+        if resources:
+            return resources[0]
+        return self.fixture.add_child(node, 'resource', label='DEFAULT')
+
+    @staticmethod
+    def file_rows(resources):
+        rows = []
+        for resource in resources:
+            for path, content in resource.files.items():
+                rows.append({
+                    'Name': path.rsplit('/', 1)[-1],
+                    'Size': str(len(content)),
+                    'URI': '{}/files/{}'.format(resource.uri, path),
+                    'collection': resource.label,
+                    'file_tags': '',
+                    'file_format': resource.data_fields.get('format', ''),
+                    'file_content': '',
+                    'cat_ID': resource.id,
+                    'digest': hashlib.md5(content).hexdigest(),
+                })
+        return rows
+
+    @staticmethod
+    def ranged(content, environ):
+        match = re.match(r'bytes=(\d+)-(\d*)$', environ.get('HTTP_RANGE', ''))
+        if match is None:
+            return 200, content, 'application/octet-stream', {'Accept-Ranges': 'bytes'}
+
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else len(content) - 1
+        if start >= len(content):
+            raise HTTPError(416, 'Range not satisfiable')
+        end = min(end, len(content) - 1)
+        return 206, content[start:end + 1], 'application/octet-stream', {
+            'Content-Range': 'bytes {}-{}/{}'.format(start, end, len(content)),
+            'Accept-Ranges': 'bytes',
+        }
+
+    @staticmethod
+    def archive_files(resources, archive_format):
+        members = [('{}/resources/{}/files/{}'.format(resource.parent.archive_prefix(), resource.label, path), content)
+                   for resource in resources for path, content in resource.files.items()]
+
+        data = io.BytesIO()
+        if archive_format == 'zip':
+            with zipfile.ZipFile(data, 'w', zipfile.ZIP_STORED) as archive:
+                for name, content in members:
+                    archive.writestr(name, content)
+            content_type = 'application/zip'
+        else:
+            mode = 'w' if archive_format == 'tar' else 'w:gz'
+            with tarfile.open(fileobj=data, mode=mode) as archive:
+                for name, content in members:
+                    info = tarfile.TarInfo(name)
+                    info.size = len(content)
+                    archive.addfile(info, io.BytesIO(content))
+            content_type = 'application/x-tar'
+
+        return 200, data.getvalue(), content_type, {}
+
+    @staticmethod
+    def extract(body, name):
+        """
+        Extract the members of an uploaded archive as (path, content) pairs
+        """
+        if name.endswith('.zip') or body[:2] == b'PK':
+            with zipfile.ZipFile(io.BytesIO(body)) as archive:
+                return [(x.filename, archive.read(x)) for x in archive.infolist() if not x.filename.endswith('/')]
+
+        with tarfile.open(fileobj=io.BytesIO(body), mode='r:*') as archive:
+            return [(x.name, archive.extractfile(x).read()) for x in archive.getmembers() if x.isfile()]
+
+    def upload(self, resource, file_path, query, body):
+        if query.get('extract', '').lower() == 'true':
+            for path, content in self.extract(body, file_path or ''):
+                resource.files[path.split('/files/', 1)[-1].lstrip('./')] = content
+        elif not file_path:
+            raise HTTPError(400, 'No file path given')
+        elif file_path in resource.files and query.get('overwrite', '').lower() != 'true':
+            raise HTTPError(409, 'File {} already exists'.format(file_path))
+        else:
+            resource.files[file_path] = body
+
+        return 200, '', 'text/plain', {}
+
+    # Services
+    def services(self, method, parts, query, environ):
+        if parts == ['import'] and method == 'POST':
+            return self.import_(query, self._read_body(environ))
+        elif parts == ['archive'] and method == 'POST':
+            return self.archive_prearchive_session(query)
+        elif parts[:1] == ['prearchive'] and method == 'POST':
+            session = self._prearchive_session(query.get('src', ''))
+            if parts[1:] == ['delete']:
+                del self.fixture.prearchive[session['uri']]
+            elif parts[1:] == ['move']:
+                session['row']['project'] = query['newProject']
+            return 200, '', 'text/plain', {}
+        raise HTTPError(404, 'Unknown service {}'.format('/'.join(parts)))
+
+    def import_(self, query, body):
+        members = self.extract(body, '')
+        project = query.get('project')
+        subject = query.get('subject')
+        experiment = query.get('session')
+
+        destination = query.get('dest', '')
+        if project and subject and experiment and not destination.startswith('/prearchive'):
+            node = self.store_experiment(project, subject, experiment, members)
+            return 200, '/data/archive/projects/{}/subjects/{}/experiments/{}\r\n'.format(
+                project, node.parent.id, node.id), 'text/plain', {}
+
+        project = project or 'Unassigned'
+        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S%f')
+        name = experiment or 'session_{}'.format(len(self.fixture.prearchive) + 1)
+        uri = '/data/prearchive/projects/{}/{}/{}'.format(project, timestamp, name)
+        now = datetime.datetime.now()
+        self.fixture.prearchive[uri] = {
+            'uri': uri,
+            'members': members,
+            'received': time.time(),
+            'row': {
+                'project': project, 'timestamp': timestamp, 'name': name, 'folderName': name,
+                'subject': subject or '', 'status': 'RECEIVING', 'url': uri[len('/data'):],
+                'lastmod': now.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3], 'uploaded': now.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],
+                'scan_date': '', 'scan_time': '', 'tag': '', 'autoarchive': 'Manual', 'prevent_anon': 'false',
+                'prevent_auto_commit': 'false',
+            },
+        }
+        return 200, uri + '\r\n', 'text/plain', {}
+
+    def store_experiment(self, project_id, subject_label, experiment_label, members):
+        project = self.fixture.projects.get(project_id)
+        if project is None:
+            raise HTTPError(404, 'Could not find project {}'.format(project_id))
+
+        subject = (project.lookup('subjects', subject_label) or
+                   [self.fixture.add_child(project, 'subject', label=subject_label)])[0]
+        experiment = (subject.lookup('experiments', experiment_label) or
+                      [self.fixture.add_child(subject, 'experiment', label=experiment_label)])[0]
+
+        # Archives created by the server contain scans/{scan}/resources/{label}/files/{path}
+        pattern = re.compile(r'(?:^|/)scans/(?P<scan>[^/]+)/resources/(?P<resource>[^/]+)/files/(?P<path>.+)$')
+        for name, content in members:
+            match = pattern.search(name)
+            scan_id, label, path = (match.group('scan'), match.group('resource'), match.group('path')) \
+                if match else ('1', 'DICOM', name.rsplit('/', 1)[-1])
+
+            scan = (experiment.lookup('scans', scan_id) or [self.fixture.add_child(experiment, 'scan', label=scan_id)])[0]
+            resource = (scan.lookup('resources', label) or [self.fixture.add_child(scan, 'resource', label=label)])[0]
+            resource.files[path] = content
+
+        return experiment
+
+    def _prearchive_session(self, uri):
+        if not uri.startswith('/data'):
+            uri = '/data' + uri
+        session = self.fixture.prearchive.get(uri)
+        if session is None:
+            raise HTTPError(404, 'Could not find prearchive session {}'.format(uri))
+
+        if session['row']['status'] == 'RECEIVING' and time.time() - session['received'] >= self.prearchive_delay:
+            session['row']['status'] = 'READY'
+        return session
+
+    def archive_prearchive_session(self, query):
+        session = self._prearchive_session(query.get('src', ''))
+        row = session['row']
+        if row['status'] != 'READY':
+            raise HTTPError(409, 'Session is not ready ({})'.format(row['status']))
+
+        node = self.store_experiment(query.get('project', row['project']),
+                                     query.get('subject', row['subject'] or row['name']),
+                                     query.get('session', row['name']),
+                                     session['members'])
+        del self.fixture.prearchive[session['uri']]
+        return 200, '/data/archive/projects/{}/subjects/{}/experiments/{}'.format(
+            node.project.id, node.parent.id, node.id), 'text/plain', {}
+
+    def prearchive(self, method, parts, query):
+        if method != 'GET' or parts[:1] != ['projects']:
+            raise HTTPError(405, 'Method not allowed')
+
+        uris = list(self.fixture.prearchive)
+        rows = [self._prearchive_session(x)['row'] for x in uris]
+
+        if len(parts) >= 2:
+            rows = [x for x in rows if x['project'] == parts[1]]
+        if len(parts) == 4:
+            rows = [x for x in rows if x['timestamp'] == parts[2] and x['name'] == parts[3]]
+            if not rows:
+                raise HTTPError(404, 'Could not find prearchive session')
+        elif len(parts) > 4:
+            raise HTTPError(404, 'Scans of prearchive sessions are not supported')
+
+        return 200, self.result_set(rows, query), 'application/json', {}
+
+    # Search
+    def search(self, body, query):
+        bundle = ElementTree.fromstring(body)
+        xsi_type = bundle.findtext('{}root_element_name'.format(XDAT_NS))
+        where = bundle.find('{}search_where'.format(XDAT_NS))
+
+        rows = [x.row() for x in self.fixture.nodes_of_type(xsi_type)]
+        if where is not None:
+            rows = [x for x in rows if self._evaluate(where, x)]
+
+        if query.get('format', 'csv') == 'json':
+            return 200, {'ResultSet': {'Result': rows}}, 'application/json', {}
+
+        columns = sorted(set(itertools.chain.from_iterable(rows))) or ['ID']
+        data = six.StringIO()
+        writer = csv.writer(data)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow([row.get(x, '') for x in columns])
+        return 200, data.getvalue(), 'text/csv; charset=utf-8', {}
+
+    @classmethod
+    def _evaluate(cls, element, row):
+        """
+        Evaluate a search_where, child_set or criteria element for a row
+        """
+        if element.tag == '{}criteria'.format(XDAT_NS):
+            field = element.findtext('{}schema_field'.format(XDAT_NS)).rsplit('/', 1)[-1]
+            value = row.get(field, row.get(field.lower()))
+            return cls._match(value,
+                              element.findtext('{}comparison_type'.format(XDAT_NS)).strip(),
+                              element.findtext('{}value'.format(XDAT_NS)))
+
+        results = [cls._evaluate(x, row) for x in element]
+        if element.get('method', 'AND').upper() == 'OR':
+            return any(results)
+        return all(results)
+
+    @staticmethod
+    def _match(value, operator, target):
+        if value is None:
+            return False
+        if operator == 'LIKE':
+            return fnmatch.fnmatch(six.text_type(value), six.text_type(target).replace('%', '*'))
+        if operator == '=':
+            return six.text_type(value) == six.text_type(target)
+
+        try:
+            value, target = float(value), float(target)
+        except ValueError:
+            value, target = six.text_type(value), six.text_type(target)
+        return {'>': value > target, '>=': value >= target, '<': value < target, '<=': value <= target}[operator]
+
+
+STATUS_MESSAGES = {
+    200: 'OK',
+    201: 'Created',
+    206: 'Partial Content',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    409: 'Conflict',
+    416: 'Requested Range Not Satisfiable',
+    500: 'Internal Server Error',
+}
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class _ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class MockXNATServer(object):
+    """
+    Serve a :py:class:`MockXNATApplication` on a local port in a background
+    thread, the arguments are passed to the application
+
+    :param Fixture fixture: the data to serve
+    """
+    def __init__(self, fixture, host='127.0.0.1', port=0, **kwargs):
+        self.application = MockXNATApplication(fixture, **kwargs)
+        self._server = make_server(host, port, self.application,
+                                   server_class=_ThreadingWSGIServer,
+                                   handler_class=_QuietRequestHandler)
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._server.serve_forever)
+            self._thread.daemon = True
+            self._thread.start()
+        return self.url
+
+    def stop(self):
+        if self._thread is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._thread = None
+
+
+def main():
+    import argparse
+
+    argument_parser = argparse.ArgumentParser(description='Serve a generated fixture as a mock XNAT server')
+    argument_parser.add_argument('--port', type=int, default=8080, help='port to listen on')
+    argument_parser.add_argument('--latency', type=float, default=0.0, help='latency per request in seconds')
+    argument_parser.add_argument('--bandwidth', type=float, help='bandwidth limit in MB/s')
+    argument_parser.add_argument('--subjects', type=int, default=10, help='subjects per project')
+    argument_parser.add_argument('--files', type=int, default=10, help='files per scan')
+    args = argument_parser.parse_args()
+
+    fixture = generate_fixture(subjects=args.subjects, files=args.files)
+    server = MockXNATServer(fixture, port=args.port, latency=args.latency,
+                            bandwidth=args.bandwidth * 1e6 if args.bandwidth else None)
+    print('Serving mock XNAT on {} (press Ctrl-C to stop)'.format(server.url))
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -36,9 +36,9 @@ import requests
 from six.moves.urllib import parse
 
 from . import exceptions
-from .session import XNATSession
+from .session import XNATSession, configure_interface
 from .constants import DEFAULT_SCHEMAS
-from .convert_xsd import SchemaParser
+from .convert_xsd import SchemaParser, LazyModelBuilder
 
 GEN_MODULES = {}
 
@@ -218,20 +218,20 @@ def query_netrc(server, netrc_file, logger):
     return user, password
 
 
-def build_model(xnat_session, extension_types, connection_id):
+def parse_schemas(parser, xnat_session, extension_types=True, version=None):
     """
-    Build the XNAT data model for a given connection
+    Retrieve and parse the schemas matching the XNAT version of the server
+
+    :param parser: The parser to use for the parsing
+    :param xnat_session: the session used for the communication
+    :param bool extension_types: flag to enabled/disable scanning for extension types
+    :param str version: XNAT version of the server, None to retrieve it
     """
     logger = xnat_session.logger
-    debug = xnat_session.debug
-
-    # Check XNAT version
-    version = xnat_session.xnat_version
+    if version is None:
+        version = xnat_session.xnat_version
 
-    # Generate module
-    parser = SchemaParser(debug=debug, logger=logger)
-
-    if xnat_session.xnat_version.startswith('1.6'):
+    if version.startswith('1.6'):
         logger.info('Found an 1.6 version ({})'.format(version))
         parse_schemas_16(parser, xnat_session, extension_types=extension_types)
     elif version.startswith('1.7'):
@@ -241,6 +241,41 @@ def build_model(xnat_session, extension_types, connection_id):
         logger.critical('Found an unsupported version ({})'.format(version))
         raise ValueError('Cannot continue on unsupported XNAT version')
 
+
+def build_model(xnat_session, extension_types, connection_id, lazy=False):
+    """
+    Build the XNAT data model for a given connection
+
+    If lazy is True, only the XNAT version is checked and the schemas are
+    retrieved and the classes are generated on demand the first time they
+    are needed (see :py:class:`xnat.convert_xsd.LazyModelBuilder`)
+    """
+    logger = xnat_session.logger
+    debug = xnat_session.debug
+
+    # Check XNAT version
+    version = xnat_session.xnat_version
+    if not version.startswith(('1.6', '1.7')):
+        logger.critical('Found an unsupported version ({})'.format(version))
+        raise ValueError('Cannot continue on unsupported XNAT version')
+
+    if lazy:
+        builder = LazyModelBuilder(parse_func=lambda parser: parse_schemas(parser, xnat_session, extension_types, version),
+                                   module_name='xnat_gen_{}'.format(connection_id),
+                                   logger=logger,
+                                   debug=debug)
+        builder.module.SESSION = xnat_session
+
+        # The session shares the lazy lookup, so create_object triggers the generation
+        xnat_session.XNAT_CLASS_LOOKUP = builder.lookup
+        xnat_session.classes = builder.module
+        logger.debug('Created lazy generated module')
+        return
+
+    # Generate module
+    parser = SchemaParser(debug=debug, logger=logger)
+    parse_schemas(parser, xnat_session, extension_types=extension_types, version=version)
+
     # Write code to temp file
     with tempfile.NamedTemporaryFile(mode='w', suffix='_generated_xnat.py', delete=False) as code_file:
         parser.write(code_file=code_file)
@@ -269,7 +304,7 @@ def build_model(xnat_session, extension_types, connection_id):
 
 def connect(server, user=None, password=None, verify=True, netrc_file=None, debug=False,
             extension_types=True, loglevel=None, logger=None, detect_redirect=True,
-            no_parse_model=False):
+            no_parse_model=False, lazy_model=False, pool_maxsize=10, max_retries=3):
     """
     Connect to a server and generate the correct classed based on the servers xnat.xsd
     This function returns an object that can be used as a context operator. It will call
@@ -299,6 +334,16 @@ def connect(server, user=None, password=None, verify=True, netrc_file=None, debu
                                 model, this create a connection for which the simple
                                 get/head/put/post/delete functions where, but anything
                                 requiring the data model will file (e.g. any wrapped classes)
+    :param bool lazy_model: Only check the XNAT version when connecting and postpone the
+                            parsing of the data model until it is first needed, the classes
+                            are then generated one by one when an object of that type is
+                            first encountered. This makes connecting fast for scripts that
+                            only touch a few types.
+    :param int pool_maxsize: number of connections to keep alive, this should be at least
+                             the number of threads sharing the session
+    :param int max_retries: number of times requests without a body (GET, DELETE, HEAD)
+                            are retried on connection errors and transient server errors,
+                            0 to disable
     :return: XNAT session object
     :rtype: XNATSession
 
@@ -362,6 +407,7 @@ def connect(server, user=None, password=None, verify=True, netrc_file=None, debu
 
     # Create the correct requests session
     requests_session = requests.Session()
+    configure_interface(requests_session, pool_maxsize=pool_maxsize, max_retries=max_retries)
 
     if user is not None:
         requests_session.auth = (user, password)
@@ -388,6 +434,7 @@ def connect(server, user=None, password=None, verify=True, netrc_file=None, debu
 
     # Parse data model and create classes
     if not no_parse_model:
-        build_model(xnat_session, extension_types=extension_types, connection_id=connection_id)
+        build_model(xnat_session, extension_types=extension_types, connection_id=connection_id,
+                    lazy=lazy_model)
 
     return xnat_session
@@ -0,0 +1,421 @@
+# Copyright 2011-2015 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Asynchronous (asyncio) counterpart of the :py:class:`XNATSession <xnat.session.XNATSession>`
+for crawls that need to keep many requests in flight. It requires Python 3
+and the optional `httpx <https://www.python-httpx.org>`_ dependency.
+
+An async session is always derived from an existing (synchronous) session,
+it reuses the credentials and cookies (so also the JSESSION) of that session
+and the data model and object cache, so objects retrieved via either
+session are interchangeable::
+
+    >>> import asyncio
+    >>> import xnat
+    >>> session = xnat.connect('https://central.xnat.org')
+    >>> async def scan_types(experiments):
+    ...     async with session.async_session(max_concurrency=32) as async_session:
+    ...         listings = [experiment.scans for experiment in experiments]
+    ...         await asyncio.gather(*[async_session.data_maps(x) for x in listings])
+    ...     return {x.parent.id: [scan.type for scan in x.values()] for x in listings}
+    >>> asyncio.run(scan_types(session.projects['Sample_DICOM'].experiments.values()))
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import asyncio
+import io
+import os
+import random
+
+import six
+
+from . import exceptions
+from .core import XNATListing, XNATObject
+
+try:
+    HTTPX_LOADED = True
+    import httpx
+except ImportError:
+    HTTPX_LOADED = False
+
+try:
+    FILE_TYPES = (file, io.IOBase)
+except NameError:
+    FILE_TYPES = io.IOBase
+
+
+class AsyncXNATSession(object):
+    """
+    Asynchronous session using the same surface as the synchronous session
+    (``get``, ``get_json``, ``download_stream``, ``upload``, ...). All
+    requests share one pooled ``httpx.AsyncClient`` and the number of
+    requests in flight is bounded by ``max_concurrency``.
+
+    .. warning:: You should NOT create this class directly, use
+                 :py:meth:`XNATSession.async_session <xnat.session.XNATSession.async_session>`
+    """
+
+    def __init__(self, xnat_session, max_concurrency=16, max_connections=None,
+                 timeout=None, http2=False):
+        if not HTTPX_LOADED:
+            raise RuntimeError('Cannot create an asynchronous session, missing required dependency: httpx')
+
+        if max_concurrency < 1:
+            raise exceptions.XNATValueError('The max_concurrency should be at least 1, found {}'.format(max_concurrency))
+
+        self._xnat_session = xnat_session
+        self._max_concurrency = max_concurrency
+        self._semaphore = None
+
+        interface = xnat_session.interface
+        max_connections = max_connections or max_concurrency
+        limits = httpx.Limits(max_connections=max_connections,
+                              max_keepalive_connections=max_connections)
+
+        if timeout is None:
+            timeout = xnat_session.request_timeout
+
+        self._client = httpx.AsyncClient(auth=interface.auth,
+                                         cookies=interface.cookies,
+                                         verify=interface.verify,
+                                         limits=limits,
+                                         timeout=timeout,
+                                         http2=http2)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        """
+        Close the underlying connection pool, the synchronous session
+        stays connected.
+        """
+        await self._client.aclose()
+
+    @property
+    def xnat_session(self):
+        """
+        The synchronous session this session was derived from
+        """
+        return self._xnat_session
+
+    @property
+    def logger(self):
+        return self.xnat_session.logger
+
+    @property
+    def interface(self):
+        """
+        The underlying `httpx <https://www.python-httpx.org>`_ client used.
+        """
+        return self._client
+
+    @property
+    def max_concurrency(self):
+        return self._max_concurrency
+
+    @property
+    def semaphore(self):
+        # Created lazily so it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        return self._semaphore
+
+    @staticmethod
+    def _timeout(timeout):
+        # An explicit None disables all timeouts in httpx, use the timeout of the client instead
+        return httpx.USE_CLIENT_DEFAULT if timeout is None else timeout
+
+    async def _request(self, method, uri, accepted_status, timeout=None, **kwargs):
+        self.logger.debug('{} URI {}'.format(method, uri))
+        kwargs['timeout'] = self._timeout(timeout)
+
+        async with self.semaphore:
+            try:
+                response = await self._client.request(method, uri, **kwargs)
+            except httpx.ConnectError as exception:
+                if 'SSL' in str(exception):
+                    raise exceptions.XNATSSLError('Encountered a problem with the SSL connection, are you sure the server is offering https?')
+                raise
+
+        self.xnat_session._check_response(response, accepted_status=accepted_status, uri=uri)
+        return response
+
+    async def get(self, path, format=None, query=None, accepted_status=None, timeout=None, headers=None):
+        """
+        Retrieve the content of a given REST directory, see
+        :py:meth:`XNATSession.get <xnat.session.XNATSession.get>`
+
+        :returns: the httpx reponse
+        :rtype: httpx.Response
+        """
+        accepted_status = accepted_status or self.xnat_session.accepted_status_get
+        uri = self.xnat_session._format_uri(path, format, query=query)
+        return await self._request('GET', uri, accepted_status, timeout=timeout, headers=headers)
+
+    async def head(self, path, accepted_status=None, allow_redirects=False, timeout=None, headers=None):
+        """
+        Retrieve the header for a http request of a given REST directory, see
+        :py:meth:`XNATSession.head <xnat.session.XNATSession.head>`
+
+        :returns: the httpx reponse
+        :rtype: httpx.Response
+        """
+        accepted_status = accepted_status or self.xnat_session.accepted_status_get
+        uri = self.xnat_session._format_uri(path)
+        return await self._request('HEAD', uri, accepted_status, follow_redirects=allow_redirects,
+                                   timeout=timeout, headers=headers)
+
+    async def post(self, path, data=None, json=None, format=None, query=None, accepted_status=None, timeout=None, headers=None):
+        """
+        Post data to a given REST directory, see
+        :py:meth:`XNATSession.post <xnat.session.XNATSession.post>`
+
+        :returns: the httpx reponse
+        :rtype: httpx.Response
+        """
+        accepted_status = accepted_status or self.xnat_session.accepted_status_post
+        uri = self.xnat_session._format_uri(path, format, query=query)
+        return await self._request('POST', uri, accepted_status, json=json, timeout=timeout,
+                                   headers=headers, **_body_arguments(data))
+
+    async def put(self, path, data=None, json=None, format=None, query=None, accepted_status=None, timeout=None, headers=None):
+        """
+        Put the content of a given REST directory, see
+        :py:meth:`XNATSession.put <xnat.session.XNATSession.put>`
+
+        :returns: the httpx reponse
+        :rtype: httpx.Response
+        """
+        accepted_status = accepted_status or self.xnat_session.accepted_status_put
+        uri = self.xnat_session._format_uri(path, format, query=query)
+        return await self._request('PUT', uri, accepted_status, json=json, timeout=timeout,
+                                   headers=headers, **_body_arguments(data))
+
+    async def delete(self, path, headers=None, accepted_status=None, query=None, timeout=None):
+        """
+        Delete the content of a given REST directory, see
+        :py:meth:`XNATSession.delete <xnat.session.XNATSession.delete>`
+
+        :returns: the httpx reponse
+        :rtype: httpx.Response
+        """
+        accepted_status = accepted_status or self.xnat_session.accepted_status_delete
+        uri = self.xnat_session._format_uri(path, query=query)
+        return await self._request('DELETE', uri, accepted_status, timeout=timeout, headers=headers)
+
+    async def get_json(self, uri, query=None, accepted_status=None):
+        """
+        Helper function that perform a GET, but sets the format to JSON and
+        parses the result as JSON
+
+        :param str uri: the path of the uri to retrieve (e.g. "/data/archive/projects")
+                         the remained for the uri is constructed automatically
+        :param dict query: the values to be added to the query string in the uri
+        """
+        response = await self.get(uri, format='json', query=query, accepted_status=accepted_status)
+        try:
+            return response.json()
+        except ValueError:
+            raise ValueError('Could not decode JSON from [{}] {}'.format(uri, response.text))
+
+    async def download_stream(self, uri, target_stream, format=None, chunk_size=524288, update_func=None, timeout=None):
+        """
+        Download the given ``uri`` to the given ``target_stream``. The
+        ``update_func`` follows the same conventions as for
+        :py:meth:`XNATSession.download_stream <xnat.session.XNATSession.download_stream>`,
+        there is no progress bar as that would garble the output of concurrent
+        downloads.
+
+        :param str uri: Path of the uri to retrieve.
+        :param file target_stream: A writable file-like object to save the stream to.
+        :param str format: Request format
+        :param int chunk_size: Download this many bytes at a time
+        :param func update_func: If provided, will be called every ``chunk_size`` bytes
+        :param timeout: timeout in seconds, float or (connection timeout, read timeout)
+        """
+        uri = self.xnat_session._format_uri(uri, format=format)
+        self.logger.debug('DOWNLOAD STREAM {}'.format(uri))
+
+        if update_func is None:
+            update_func = lambda *args: None
+
+        async with self.semaphore:
+            async with self._client.stream('GET', uri, timeout=self._timeout(timeout)) as response:
+                if response.status_code not in self.xnat_session.accepted_status_get:
+                    await response.aread()
+                    raise exceptions.XNATResponseError('Invalid response from XNATSession for url {} (status {}):\n{}'.format(uri, response.status_code, response.text))
+
+                content_length = response.headers.get('Content-Length', None)
+                if isinstance(content_length, six.string_types):
+                    content_length = int(content_length)
+
+                bytes_read = 0
+                try:
+                    update_func(0, content_length, False)
+                    async for chunk in response.aiter_bytes(chunk_size):
+                        if bytes_read == 0 and chunk.startswith((b'<!DOCTYPE', b'<html>')):
+                            raise ValueError('Invalid response from XNATSession (status {}):\n{}'.format(response.status_code, chunk))
+
+                        bytes_read += len(chunk)
+                        target_stream.write(chunk)
+
+                        update_func(bytes_read, content_length, False)
+                finally:
+                    update_func(bytes_read, content_length, True)
+
+    async def upload(self, uri, file_, retries=1, query=None, content_type=None, method='put', overwrite=False, timeout=None,
+                     backoff_factor=0.5, max_backoff=30.0):
+        """
+        Upload data or a file to XNAT, see
+        :py:meth:`XNATSession.upload <xnat.session.XNATSession.upload>`.
+        Files are read in a worker thread, so the event loop is not blocked
+        by disk IO. Transient failures are retried with the same exponential
+        backoff as for the synchronous session, ``post`` uploads and data that
+        cannot be rewound are not retried.
+
+        :param str uri: uri to upload to
+        :param file_: the file handle, path to a file or a string of data
+                      (which should not be the path to an existing file!)
+        :param int retries: amount of times xnatpy should try the upload
+                            before giving up
+        :param dict query: extra query string content
+        :param content_type: the content type of the file, if not given it will
+                             default to ``application/octet-stream``
+        :param str method: either ``put`` (default) or ``post``
+        :param bool overwrite: indicate if previous data should be overwritten
+        :param timeout: timeout in seconds, float or (connection timeout, read timeout)
+        :param float backoff_factor: base of the exponential backoff between retries in seconds
+        :param float max_backoff: maximum time to wait between retries in seconds
+        :return: the httpx response
+        """
+        if method not in ('put', 'post'):
+            raise ValueError('Invalid upload method "{}" should be either put or post.'.format(method))
+
+        if overwrite:
+            if query is None:
+                query = {}
+            query['overwrite'] = 'true'
+
+        uri = self.xnat_session._format_uri(uri, query=query)
+        self.logger.debug('UPLOAD URI {}'.format(uri))
+
+        rewindable = isinstance(file_, (FILE_TYPES, six.binary_type, six.text_type))
+        if retries > 1 and (method == 'post' or not rewindable):
+            self.logger.debug('Upload is a post or a stream that cannot be rewound, not retrying')
+            retries = 1
+
+        headers = {'Content-Type': content_type or 'application/octet-stream'}
+        loop = asyncio.get_running_loop()
+        response = None
+        error = None
+
+        for attempt in range(1, retries + 1):
+            if attempt > 1:
+                delay = min(max_backoff, backoff_factor * 2 ** (attempt - 2))
+                # Add jitter so concurrent uploads do not retry in lockstep
+                delay *= 0.5 + random.random() / 2
+                self.logger.warning('Upload attempt {} of {} failed ({}), retrying in {:.1f} seconds'.format(
+                    attempt - 1, retries, error, delay
+                ))
+                await asyncio.sleep(delay)
+
+            if isinstance(file_, FILE_TYPES):
+                file_.seek(0)
+                content = _async_file_chunks(loop, file_, close=False)
+            elif isinstance(file_, six.string_types) and '\0' not in file_ and os.path.isfile(file_):
+                content = _async_file_chunks(loop, open(file_, 'rb'), close=True)
+            else:
+                content = file_
+
+            try:
+                async with self.semaphore:
+                    response = await self._client.request(method.upper(), uri, content=content,
+                                                          headers=headers, timeout=self._timeout(timeout))
+            except httpx.TransportError as exception:
+                error = exception
+                continue
+
+            try:
+                self.xnat_session._check_response(response)
+                return response
+            except exceptions.XNATResponseError:
+                if response.status_code not in self.xnat_session.RETRY_STATUS:
+                    raise exceptions.XNATUploadError('Upload failed! Status code {}, response text {}'.format(response.status_code, response.text))
+                error = 'status {}'.format(response.status_code)
+
+        if response is None:
+            raise exceptions.XNATUploadError('Upload failed after {} attempts! Last error: {}'.format(retries, error))
+        raise exceptions.XNATUploadError('Upload failed after {} attempts! Status code {}, response text {}'.format(retries, response.status_code, response.text))
+
+    async def fulldata(self, obj):
+        """
+        Retrieve the fulldata of an object and store it in the cache of the
+        object, so subsequent (synchronous) attribute access on the object
+        does not hit the server anymore.
+
+        :param XNATObject obj: the object to retrieve the data for
+        :return: the fulldata of the object
+        :rtype: dict
+        """
+        if not isinstance(obj, XNATObject):
+            raise exceptions.XNATValueError('Can only retrieve fulldata asynchronously for XNATObjects, found {}'.format(type(obj).__name__))
+
+        fulldata = obj._select_fulldata(await self.get_json(obj.uri))
+        obj._cache['fulldata'] = fulldata
+        return fulldata
+
+    async def data_maps(self, listing):
+        """
+        Retrieve the contents of a listing and store them in the cache of
+        the listing, so subsequent (synchronous) access to the listing does
+        not hit the server anymore.
+
+        :param XNATListing listing: the listing to retrieve
+        :return: the data maps of the listing (id_map, key_map, non_unique, listing)
+        :rtype: tuple
+        """
+        if not isinstance(listing, XNATListing):
+            raise exceptions.XNATValueError('Can only retrieve data maps asynchronously for XNATListings, found {}'.format(type(listing).__name__))
+
+        uri, query = listing._listing_query()
+        data_maps = listing._build_data_maps(await self.get_json(uri, query=query))
+        listing._cache['data_maps'] = data_maps
+        return data_maps
+
+
+def _body_arguments(data):
+    # httpx separates raw content from form data, requests does not
+    if isinstance(data, (six.binary_type, six.text_type)):
+        return {'content': data}
+    return {'data': data}
+
+
+async def _async_file_chunks(loop, file_handle, close, chunk_size=524288):
+    # Read the file in the default executor to avoid blocking the event loop
+    try:
+        while True:
+            chunk = await loop.run_in_executor(None, file_handle.read, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        if close:
+            file_handle.close()
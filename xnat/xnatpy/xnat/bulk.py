@@ -0,0 +1,425 @@
+# Copyright 2011-2015 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Bulk relabelling and sharing of the subjects and experiments in a project.
+The operations are first planned: every entry is validated against a single
+listing of the subjects or experiments of the project (and of the target
+projects for sharing), so unknown objects, invalid or conflicting labels and
+objects that are already shared are found before anything is changed. The
+valid operations are then applied concurrently::
+
+    >>> update = BulkUpdate(session, 'myproject')
+    >>> update.relabel_experiments({'XNAT_E00020': '160125_02_09203281'})
+    >>> update.share_experiments({'160125_02_09203281': 'otherproject'})
+    >>> print(update.apply(dry_run=True))
+    >>> report = update.apply()
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from concurrent.futures import ThreadPoolExecutor
+import re
+import time
+
+import requests
+from requests.packages.urllib3.exceptions import MaxRetryError
+import six
+
+from . import exceptions
+
+LABEL_PATTERN = re.compile(r'^[A-Za-z0-9_\-]+$')
+
+
+class BulkOperation(object):
+    """
+    A single relabel or share operation. The state is ``planned`` after
+    validation and ends as ``done`` or ``failed``, operations that do not
+    change anything are ``skipped`` and operations that did not pass the
+    validation are ``invalid``.
+
+    :ivar str kind: ``relabel`` or ``share``
+    :ivar str level: ``subject`` or ``experiment``
+    :ivar str key: the key as given in the mapping
+    :ivar str id: the ID of the object on the server (None if it was not found)
+    :ivar str label: the current label of the object
+    :ivar str new_label: the new label (the label in the target project for sharing)
+    :ivar str target_project: the project to share with
+    """
+    def __init__(self, kind, level, key, id_=None, label=None, new_label=None, target_project=None, uri=None):
+        self.kind = kind
+        self.level = level
+        self.key = key
+        self.id = id_
+        self.label = label
+        self.new_label = new_label
+        self.target_project = target_project
+        self.uri = uri
+        self.state = 'planned'
+        self.error = None
+        self.attempts = 0
+        self.duration = None
+
+    def __repr__(self):
+        if self.kind == 'relabel':
+            description = '{} -> {}'.format(self.label or self.key, self.new_label)
+        else:
+            description = '{} -> project {}{}'.format(self.label or self.key, self.target_project,
+                                                      ' as {}'.format(self.new_label) if self.new_label else '')
+        return '<BulkOperation {} {} {} ({})>'.format(self.kind, self.level, description, self.state)
+
+    def _invalid(self, error):
+        self.state = 'invalid'
+        self.error = error
+
+    def _skip(self, reason):
+        self.state = 'skipped'
+        self.error = reason
+
+
+class BulkReport(object):
+    """
+    Result of applying a :py:class:`BulkUpdate`
+    """
+    def __init__(self, operations, dry_run, duration):
+        self.operations = operations
+        self.dry_run = dry_run
+        self.duration = duration
+
+    def __repr__(self):
+        return '<BulkReport {}>'.format(', '.join('{}={}'.format(k, v) for k, v in sorted(self.counts().items())))
+
+    def __str__(self):
+        lines = ['{}{} operations in {:.1f} seconds: {}'.format(
+            '[DRY RUN] ' if self.dry_run else '',
+            len(self.operations),
+            self.duration,
+            ', '.join('{} {}'.format(v, k) for k, v in sorted(self.counts().items())))]
+
+        for operation in self.operations:
+            if operation.state in ('invalid', 'failed'):
+                lines.append('  {}: {}'.format(operation, operation.error))
+
+        return '\n'.join(lines)
+
+    def counts(self):
+        """
+        Number of operations per state
+
+        :rtype: dict
+        """
+        counts = {}
+        for operation in self.operations:
+            counts[operation.state] = counts.get(operation.state, 0) + 1
+        return counts
+
+    def by_state(self, state):
+        return [x for x in self.operations if x.state == state]
+
+    @property
+    def success(self):
+        return all(x.state in ('done', 'skipped', 'planned') for x in self.operations)
+
+
+class BulkUpdate(object):
+    """
+    Plan and apply relabel and share operations for the subjects and
+    experiments of a project. The keys of the mappings can be objects, IDs
+    or current labels.
+
+    :param xnat_session: the session to use
+    :param project: the project (or its ID) containing the objects
+    :param int max_workers: number of concurrent requests
+    :param int retries: number of times a request that failed with a transient
+                        error (a status in ``XNATSession.RETRY_STATUS``, a dropped
+                        connection or a read timeout) is retried
+    :param float backoff_factor: base of the exponential backoff between retries in seconds
+    """
+    LEVELS = {
+        'subject': '/data/projects/{project}/subjects',
+        'experiment': '/data/projects/{project}/experiments',
+    }
+
+    def __init__(self, xnat_session, project, max_workers=8, retries=3, backoff_factor=0.5):
+        if not isinstance(project, six.string_types):
+            project = project.id
+
+        self.xnat_session = xnat_session
+        self.project = project
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.operations = []
+
+        self._listings = {}
+
+    def __repr__(self):
+        return '<BulkUpdate {} ({} operations)>'.format(self.project, len(self.operations))
+
+    @property
+    def logger(self):
+        return self.xnat_session.logger
+
+    def relabel_subjects(self, mapping):
+        """
+        Plan the relabelling of subjects
+
+        :param dict mapping: subject (object, ID or label) -> new label
+        :return: the planned operations
+        """
+        return self._plan_relabel('subject', mapping)
+
+    def relabel_experiments(self, mapping):
+        """
+        Plan the relabelling of experiments
+
+        :param dict mapping: experiment (object, ID or label) -> new label
+        :return: the planned operations
+        """
+        return self._plan_relabel('experiment', mapping)
+
+    def share_subjects(self, mapping):
+        """
+        Plan the sharing of subjects with other projects
+
+        :param dict mapping: subject (object, ID or label) -> target project,
+                             (target project, label) or a list of those
+        :return: the planned operations
+        """
+        return self._plan_share('subject', mapping)
+
+    def share_experiments(self, mapping):
+        """
+        Plan the sharing of experiments with other projects
+
+        :param dict mapping: experiment (object, ID or label) -> target project,
+                             (target project, label) or a list of those
+        :return: the planned operations
+        """
+        return self._plan_share('experiment', mapping)
+
+    def _listing(self, level, project):
+        """
+        Listing of the objects in a project, retrieved once, as a tuple of
+        (rows by ID, rows by label)
+        """
+        key = (level, project)
+        if key not in self._listings:
+            uri = self.LEVELS[level].format(project=project)
+            columns = 'ID,label,subject_ID' if level == 'experiment' else 'ID,label'
+            try:
+                rows = self.xnat_session.get_json(uri, query={'columns': columns})['ResultSet']['Result']
+            except exceptions.XNATResponseError:
+                rows = None
+
+            if rows is None:
+                self._listings[key] = None
+            else:
+                self._listings[key] = ({x['ID']: x for x in rows}, {x['label']: x for x in rows})
+
+        return self._listings[key]
+
+    def _resolve(self, level, key):
+        if not isinstance(key, six.string_types):
+            key = key.id
+
+        listing = self._listing(level, self.project)
+        if listing is None:
+            raise exceptions.XNATValueError('Could not list the {}s of project {}'.format(level, self.project))
+
+        by_id, by_label = listing
+        return key, by_id.get(key) or by_label.get(key)
+
+    def _uri(self, level, row):
+        if level == 'subject':
+            return '/data/projects/{}/subjects/{}'.format(self.project, row['ID'])
+        else:
+            return '/data/projects/{}/subjects/{}/experiments/{}'.format(self.project, row['subject_ID'], row['ID'])
+
+    def _plan_relabel(self, level, mapping):
+        _, labels_in_use = self._listing(level, self.project) or ({}, {})
+        new_labels = {}
+
+        operations = []
+        for key, new_label in mapping.items():
+            key, row = self._resolve(level, key)
+            operation = BulkOperation('relabel', level, key, new_label=new_label)
+            operations.append(operation)
+
+            if row is None:
+                operation._invalid('{} {} not found in project {}'.format(level.capitalize(), key, self.project))
+                continue
+
+            operation.id = row['ID']
+            operation.label = row['label']
+            operation.uri = self._uri(level, row)
+
+            if not isinstance(new_label, six.string_types) or not LABEL_PATTERN.match(new_label):
+                operation._invalid('Invalid label {!r}, only letters, digits, _ and - are allowed'.format(new_label))
+            elif new_label == row['label']:
+                operation._skip('Label is already {}'.format(new_label))
+            elif new_label in labels_in_use:
+                # This also rejects chains and swaps, which would depend on the order of the requests
+                operation._invalid('Label {} is already used by {} {}'.format(new_label, level,
+                                                                             labels_in_use[new_label]['ID']))
+            elif new_label in new_labels:
+                operation._invalid('Label {} is also requested for {} {}'.format(new_label, level,
+                                                                                new_labels[new_label]))
+            else:
+                new_labels[new_label] = row['ID']
+
+        self.operations.extend(operations)
+
+        # Shares without an explicit label are done after the relabel and get the new label
+        for operation in self.operations:
+            if operation.kind == 'share' and operation.level == level and operation.id in new_labels.values():
+                self._check_share_label(operation)
+
+        return operations
+
+    def _planned_label(self, level, id_, label):
+        """
+        The label an object will have when it is shared, which is the new
+        label if a relabel of the object is planned
+        """
+        for operation in self.operations:
+            if (operation.kind == 'relabel' and operation.level == level and operation.id == id_ and
+                    operation.state == 'planned'):
+                return operation.new_label
+        return label
+
+    def _check_share_label(self, operation):
+        if operation.state != 'planned' or operation.new_label is not None:
+            return
+
+        target_listing = self._listing(operation.level, operation.target_project)
+        label = self._planned_label(operation.level, operation.id, operation.label)
+        if label in target_listing[1]:
+            operation._invalid('Label {} is already used in project {}'.format(label, operation.target_project))
+
+    def _plan_share(self, level, mapping):
+        operations = []
+        for key, targets in mapping.items():
+            if isinstance(targets, (six.string_types, tuple)):
+                targets = [targets]
+
+            key, row = self._resolve(level, key)
+            for target in targets:
+                target_project, label = (target, None) if isinstance(target, six.string_types) else target
+                operation = BulkOperation('share', level, key, new_label=label, target_project=target_project)
+                operations.append(operation)
+
+                if row is None:
+                    operation._invalid('{} {} not found in project {}'.format(level.capitalize(), key, self.project))
+                    continue
+
+                operation.id = row['ID']
+                operation.label = row['label']
+                operation.uri = '{}/projects/{}'.format(self._uri(level, row), target_project)
+
+                target_listing = self._listing(level, target_project)
+                if target_listing is None:
+                    operation._invalid('Could not list project {}, it might not exist'.format(target_project))
+                elif row['ID'] in target_listing[0]:
+                    operation._skip('Already shared with project {}'.format(target_project))
+                elif label is not None and not LABEL_PATTERN.match(label):
+                    operation._invalid('Invalid label {!r}, only letters, digits, _ and - are allowed'.format(label))
+                elif label is not None and label in target_listing[1]:
+                    operation._invalid('Label {} is already used in project {}'.format(label, target_project))
+                else:
+                    self._check_share_label(operation)
+
+        self.operations.extend(operations)
+        return operations
+
+    def apply(self, dry_run=False):
+        """
+        Apply all planned operations
+
+        :param bool dry_run: only report what would be done
+        :return: the report with all operations (including invalid and skipped ones)
+        :rtype: BulkReport
+        """
+        start = time.time()
+        planned = [x for x in self.operations if x.state == 'planned']
+
+        if not dry_run and planned:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                # Relabel first, so objects shared without an explicit label get their new label
+                relabels = [x for x in planned if x.kind == 'relabel']
+                list(executor.map(self._apply_operation, relabels))
+
+                # The label of a share was only checked for the new label, so do not share with the old one
+                failed = {(x.level, x.id) for x in relabels if x.state == 'failed'}
+                shares = []
+                for operation in planned:
+                    if operation.kind != 'share':
+                        continue
+                    if operation.new_label is None and (operation.level, operation.id) in failed:
+                        operation.state = 'failed'
+                        operation.error = 'Relabel of {} {} failed'.format(operation.level, operation.id)
+                    else:
+                        shares.append(operation)
+                list(executor.map(self._apply_operation, shares))
+
+            # Cached objects might have an outdated label or sharing information
+            self.xnat_session.clearcache()
+            self._listings = {}
+
+        report = BulkReport(list(self.operations), dry_run=dry_run, duration=time.time() - start)
+        self.logger.info(str(report).splitlines()[0])
+        return report
+
+    def _apply_operation(self, operation):
+        query = {}
+        if operation.new_label is not None:
+            query['label'] = operation.new_label
+        uri = self.xnat_session._format_uri(operation.uri, query=query)
+
+        start = time.time()
+        while True:
+            operation.attempts += 1
+            try:
+                response = self.xnat_session._request('PUT', uri)
+            except requests.exceptions.ConnectionError as exception:
+                # Failures to connect were already retried by the connection pool
+                if isinstance(exception.args[0] if exception.args else None, MaxRetryError):
+                    self._fail(operation, exception)
+                    break
+                error = exception
+            except requests.exceptions.Timeout as exception:
+                error = exception
+            else:
+                if response.status_code not in self.xnat_session.RETRY_STATUS:
+                    try:
+                        self.xnat_session._check_response(response, accepted_status=[200, 201], uri=uri)
+                    except exceptions.XNATResponseError as exception:
+                        self._fail(operation, exception)
+                    else:
+                        operation.state = 'done'
+                    break
+                error = 'status {}'.format(response.status_code)
+
+            if operation.attempts > self.retries:
+                self._fail(operation, error)
+                break
+            time.sleep(self.backoff_factor * 2 ** (operation.attempts - 1))
+
+        operation.duration = time.time() - start
+
+    def _fail(self, operation, error):
+        operation.state = 'failed'
+        operation.error = str(error)
+        self.logger.warning('{} failed: {}'.format(operation, error))
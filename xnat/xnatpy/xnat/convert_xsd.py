@@ -23,13 +23,15 @@ import inspect
 import keyword
 import os
 import re
+import threading
+import types
 from xml.etree import ElementTree
 
 from . import core
 from . import xnatbases
 from .datatypes import TYPE_TO_PYTHON
 from .constants import SECONDARY_LOOKUP_FIELDS, FIELD_HINTS, CORE_REST_OBJECTS
-from .utils import pythonize_class_name, pythonize_attribute_name, full_class_name
+from .utils import pythonize_class_name, pythonize_attribute_name, full_class_name, NON_ALPHANUMERIC_PATTERN
 
 
 FILE_HEADER = '''
@@ -50,8 +52,11 @@ FILE_HEADER = '''
 
 from __future__ import absolute_import
 from __future__ import unicode_literals
+from concurrent.futures import ThreadPoolExecutor, as_completed  # Needed by generated code
 import os
 import tempfile  # Needed by generated code
+import threading  # Needed by generated code
+import time  # Needed by generated code
 from gzip import GzipFile  # Needed by generated code
 from tarfile import TarFile  # Needed by generated code
 from zipfile import ZipFile  # Needed by generated code
@@ -59,7 +64,11 @@ from six import BytesIO  # Needed by generated code
 
 from xnat import search
 from xnat.core import XNATObject, XNATNestedObject, XNATSubObject, XNATListing, XNATSimpleListing, XNATSubListing, caching
-from xnat.utils import mixedproperty, RequestsFileLike
+from xnat.exceptions import XNATUploadError  # Needed by generated code
+from xnat.search import SearchField  # Needed by generated code
+from xnat.session import default_update_func  # Needed by generated code
+from xnat.sync import ProjectSync  # Needed by generated code
+from xnat.utils import mixedproperty, ParallelGzipStream, ResponseStream, open_remote_file
 
 try:
     PYDICOM_LOADED = True
@@ -133,10 +142,8 @@ class FileData(XNATObjectMixin):
     def download_stream(self, *args, **kwargs):
         self.xnat_session.download_stream(self.uri, *args, **kwargs)
         
-    def open(self):
-        uri = self.xnat_session._format_uri(self.uri)
-        request = self.xnat_session.interface.get(uri, stream=True)
-        return RequestsFileLike(request)
+    def open(self, block_size=262144, cache_blocks=16):
+        return open_remote_file(self.xnat_session, self.uri, block_size=block_size, cache_blocks=cache_blocks)
 
     @property
     @caching
@@ -175,6 +182,32 @@ XNAT_CLASS_LOOKUP = {{
 # TODO: Move all system function to use a __ prefix
 
 
+# Cache of the (stripped) source code of the classes in xnatbases, retrieving
+# the source with inspect is by far the most expensive step in writing the code
+_BASE_SOURCE_CACHE = {}
+_BASE_SOURCE_LOCK = threading.Lock()
+
+
+def get_base_source(python_name):
+    """
+    Get the source code of the base template in xnatbases for a class
+
+    :param str python_name: python name of the class
+    :return: the source code (stripped) or None if there is no base template
+    """
+    try:
+        return _BASE_SOURCE_CACHE[python_name]
+    except KeyError:
+        pass
+
+    with _BASE_SOURCE_LOCK:
+        if python_name not in _BASE_SOURCE_CACHE:
+            base = getattr(xnatbases, python_name, None)
+            _BASE_SOURCE_CACHE[python_name] = inspect.getsource(base).strip() if base is not None else None
+
+    return _BASE_SOURCE_CACHE[python_name]
+
+
 class ClassPrototype(object):
     def __init__(self, parser, name, logger, field_name=None, parent_class=None, simple=False):
         self.parser = parser
@@ -331,6 +364,27 @@ class AttributePrototype(object):
         return "<AttributePrototype [{}] {}>".format(self.property_type, self.name)
 
 
+CLASS_INFO_TEMPLATE = """    # Abstract: {abstract}
+    # Simple: {simple}
+    # Object class: {object_class}
+    # Source schema: {source_schema}
+"""
+
+CLASS_REGISTER_TEMPLATE = """    _XSI_TYPE = '{name}'
+
+    @classmethod
+    def __register__(cls, target):
+        target['{name}'] = cls
+
+"""
+
+CLASS_DISPLAY_IDENTIFIER_TEMPLATE = """    @property
+    def __display_identifier(self):
+        return self.{display_identifier}
+
+"""
+
+
 class BaseWriter(object):
     __metaclass__ = ABCMeta
 
@@ -349,6 +403,7 @@ class BaseWriter(object):
 class BaseClassWriter(BaseWriter):
     def __init__(self, prototype):
         super(BaseClassWriter, self).__init__(prototype=prototype)
+        self._hasattr_cache = {}
 
     # Give easy access to prototypes attributes
     @property
@@ -426,6 +481,14 @@ class BaseClassWriter(BaseWriter):
         return pythonize_class_name(self.parent_class)
 
     def hasattr(self, name):
+        # Every property is checked against the full chain of base classes, cache the result
+        try:
+            return self._hasattr_cache[name]
+        except KeyError:
+            result = self._hasattr_cache[name] = self._hasattr(name)
+            return result
+
+    def _hasattr(self, name):
         base = self.get_base_template()
 
         if base is not None:
@@ -460,47 +523,43 @@ class BaseClassWriter(BaseWriter):
         return data
 
     def header(self):
-        base = self.get_base_template()
-        if base is not None:
-            base_source = inspect.getsource(base)
-            base_source = re.sub(r'class {}\(XNATBaseObject\):'.format(self.python_name), 'class {}({}):'.format(self.python_name, self.python_base_class), base_source)
-            header = base_source.strip() + '\n\n    # END HEADER\n'
+        python_name = self.python_name
+        base_source = get_base_source(python_name)
+        if base_source is not None:
+            header = [base_source.replace('class {}(XNATBaseObject):'.format(python_name),
+                                          'class {}({}):'.format(python_name, self.python_base_class)),
+                      '\n\n    # END HEADER\n']
         else:
-            header = '# No base template found for {}\n'.format(self.python_name)
-            header += "class {name}({base}):\n".format(name=self.python_name, base=self.python_base_class)
+            header = ['# No base template found for {}\n'.format(python_name),
+                      'class {}({}):\n'.format(python_name, self.python_base_class)]
 
-        header += "    # Abstract: {}\n".format(self.abstract)
-        header += "    # Simple: {}\n".format(self.simple)
-        header += "    # Object class: {}\n".format(self.default_base_class)
-        header += "    # Source schema: {}\n".format(self.source_schema)
+        header.append(CLASS_INFO_TEMPLATE.format(abstract=self.abstract,
+                                                 simple=self.simple,
+                                                 object_class=self.default_base_class,
+                                                 source_schema=self.source_schema))
 
-        if self.display_identifier is not None:
-            header += "    _DISPLAY_IDENTIFIER = '{}'\n".format(self.display_identifier)
+        display_identifier = self.display_identifier
+        if display_identifier is not None:
+            header.append("    _DISPLAY_IDENTIFIER = '{}'\n".format(display_identifier))
 
         if 'fields' in self.attributes:
-            header += "    _HAS_FIELDS = True\n"
+            header.append("    _HAS_FIELDS = True\n")
 
         if self.parent_class is not None:
-            header += "    #_PARENT_CLASS = {}\n".format(self.python_parent_class)
-            header += "    _FIELD_NAME = '{}'\n".format(self.field_name)
+            header.append("    #_PARENT_CLASS = {}\n".format(self.python_parent_class))
+            header.append("    _FIELD_NAME = '{}'\n".format(self.field_name))
         elif self.name in FIELD_HINTS:
-            header += "    _CONTAINED_IN = '{}'\n".format(FIELD_HINTS[self.name])
-
-        header += "    _XSI_TYPE = '{}'\n\n".format(self.name)
+            header.append("    _CONTAINED_IN = '{}'\n".format(FIELD_HINTS[self.name]))
 
-        header += "    @classmethod\n" \
-                  "    def __register__(cls, target):\n" \
-                  "        target['{}'] = cls\n\n".format(self.name)
+        header.append(CLASS_REGISTER_TEMPLATE.format(name=self.name))
 
         if self.name in SECONDARY_LOOKUP_FIELDS:
-            header += self.init
+            header.append(self.init)
 
-        if self.display_identifier is not None:
-            header += ("    @property\n"
-                       "    def __display_identifier(self):\n"
-                       "        return self.{}\n\n".format(self.display_identifier))
+        if display_identifier is not None:
+            header.append(CLASS_DISPLAY_IDENTIFIER_TEMPLATE.format(display_identifier=display_identifier))
 
-        return header
+        return ''.join(header)
 
     # Abstract stuff that needs to be reimplemented by subclasses
     @abstractproperty
@@ -720,7 +779,7 @@ class ConstantWriter(AttributeWriter):
 
     @property
     def clean_name(self):
-        name = re.sub('[^0-9a-zA-Z]+', '_', self.name)
+        name = NON_ALPHANUMERIC_PATTERN.sub('_', self.name)
         name = '_{}'.format(name.upper())
 
         return name
@@ -1410,3 +1469,168 @@ class SchemaParser(object):
                                            file_secondary_lookup=SECONDARY_LOOKUP_FIELDS['xnat:fileData']))
 
         code_file.write('\n\n\n'.join(c.tostring().strip() for c in self if c.name is not None))
+
+
+class LazyClassLookup(dict):
+    """
+    Lookup of xsi type to class that generates the class the first time it
+    is requested, see :py:class:`LazyModelBuilder`.
+    """
+    def __init__(self, builder, *args, **kwargs):
+        super(LazyClassLookup, self).__init__(*args, **kwargs)
+        self._builder = builder
+
+    def __missing__(self, key):
+        cls = self._builder.generate(key)
+        if cls is None:
+            raise KeyError(key)
+        return cls
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or self._builder.generate(key) is not None
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+class LazyModule(types.ModuleType):
+    """
+    Module for the generated classes that generates a class the first time
+    it is accessed as attribute (e.g. ``session.classes.MrSessionData``)
+    """
+    def __getattr__(self, name):
+        # Only called if the attribute is not found normally
+        builder = self.__dict__.get('_LAZY_BUILDER')
+        if builder is None or name.startswith('__'):
+            raise AttributeError(name)
+
+        cls = builder.generate_python_name(name)
+        if cls is None:
+            raise AttributeError("module '{}' has no attribute '{}'".format(self.__name__, name))
+        return cls
+
+
+class LazyModelBuilder(object):
+    """
+    Builds the module with the classes of the data model on demand. The schemas
+    are only retrieved and parsed the first time a class is needed and then
+    only the code for the requested class and its base classes is generated
+    and compiled. The ``parse_func`` is called with the SchemaParser to parse
+    the schemas of the server.
+
+    :param parse_func: function to parse the required schemas
+    :param str module_name: name of the module to create
+    :param logger: logger to use
+    :param bool debug: print extra debug information
+    """
+    def __init__(self, parse_func, module_name, logger, debug=False):
+        self.parse_func = parse_func
+        self.logger = logger
+        self.debug = debug
+        self.parser = None
+        self.prototypes = None
+        self.python_names = None
+
+        self.module = LazyModule(module_name)
+        self.module._LAZY_BUILDER = self
+        self.lookup = LazyClassLookup(self)
+
+        self._lock = threading.RLock()  # Generating a class can require generating its base classes first
+        self._failed = set()
+
+    def _ensure_parsed(self):
+        if self.parser is not None:
+            return
+
+        parser = SchemaParser(debug=self.debug, logger=self.logger)
+        self.parse_func(parser)
+        parser.prune_tree()
+
+        self.prototypes = {x.name: x for x in parser.class_list.values() if x.name is not None}
+        self.python_names = {x.writer.python_name: x.name for x in self.prototypes.values()}
+
+        # Create the module basis (imports, mixins, FileData) and share the class lookup
+        schemas = '\n'.join('# - {}'.format(s) for s in parser.schemas)
+        header = FILE_HEADER.format(schemas=schemas,
+                                    file_secondary_lookup=SECONDARY_LOOKUP_FIELDS['xnat:fileData'])
+        session = self.module.__dict__.get('SESSION')
+        exec(compile(header, '<{}>'.format(self.module.__name__), 'exec'), self.module.__dict__)
+        self.module.SESSION = session
+        self.lookup.update(self.module.XNAT_CLASS_LOOKUP)
+        self.module.XNAT_CLASS_LOOKUP = self.lookup
+
+        self.parser = parser
+        self.logger.info('Parsed {} schemas, classes are generated on demand'.format(len(parser.schemas)))
+
+    def generate(self, xsi_type):
+        """
+        Get the class for an xsi type, generating it if needed
+
+        :param str xsi_type: the xsi type to get the class for
+        :return: the class or None if the type is not known or not an object type
+        """
+        if dict.__contains__(self.lookup, xsi_type):
+            return dict.__getitem__(self.lookup, xsi_type)
+
+        with self._lock:
+            self._ensure_parsed()
+
+            if dict.__contains__(self.lookup, xsi_type):
+                return dict.__getitem__(self.lookup, xsi_type)
+
+            prototype = self.prototypes.get(xsi_type)
+            if prototype is None or (prototype.base_class is not None and prototype.base_class.startswith('xs:')):
+                return None
+
+            cls = self._compile(prototype)
+            if cls is not None:
+                cls.__register__(self.lookup)
+            return cls
+
+    def generate_python_name(self, name):
+        """
+        Get a class by its python name, generating it if needed
+
+        :param str name: python name of the class (e.g. MrSessionData)
+        :return: the class or None if not found
+        """
+        with self._lock:
+            self._ensure_parsed()
+
+            if name in self.module.__dict__:
+                return self.module.__dict__[name]
+
+            xsi_type = self.python_names.get(name)
+            if xsi_type is None:
+                return None
+
+            return self._compile(self.prototypes[xsi_type])
+
+    def _compile(self, prototype):
+        python_name = prototype.writer.python_name
+        if python_name in self.module.__dict__:
+            return self.module.__dict__[python_name]
+
+        if prototype.name in self._failed:
+            return None
+
+        # Base (and parent) classes have to exist before the class can be created
+        for dependency in (prototype.base_class, prototype.parent_class):
+            if dependency is not None and dependency in self.prototypes:
+                self._compile(self.prototypes[dependency])
+
+        if self.debug:
+            self.logger.debug('Generating class {} ({})'.format(python_name, prototype.name))
+
+        code = prototype.tostring().strip()
+        try:
+            exec(compile(code, '<{} {}>'.format(self.module.__name__, python_name), 'exec'), self.module.__dict__)
+        except Exception as exception:
+            self._failed.add(prototype.name)
+            self.logger.warning('Could not generate class {} ({}): {}'.format(python_name, prototype.name, exception))
+            return None
+
+        return self.module.__dict__[python_name]
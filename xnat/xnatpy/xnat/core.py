@@ -16,21 +16,22 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 from abc import ABCMeta, abstractproperty
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 try:
     from collections.abc import MutableMapping, MutableSequence, Mapping, Sequence
 except ImportError:
     from collections import MutableMapping, MutableSequence, Mapping, Sequence
+import contextlib
 import fnmatch
-import keyword
 import re
 import textwrap
 from functools import update_wrapper
 
 from . import exceptions
+from . import tabular
 from .datatypes import convert_from, convert_to
 from .constants import TYPE_HINTS
-from .utils import mixedproperty, pythonize_attribute_name
+from .utils import mixedproperty, pythonize_attribute_name, NON_ALPHANUMERIC_PATTERN
 import six
 
 
@@ -56,6 +57,75 @@ def caching(func):
     return wrapper
 
 
+class WriteBatch(object):
+    """
+    Collects the writes of fields (field values, custom variables, demographics,
+    etc) made in a ``with obj.batch():`` block. When the block ends the writes
+    are sent as one PUT per object and the caches of the changed objects are
+    cleared once. See :py:meth:`XNATBaseObject.batch`.
+    """
+    def __init__(self, xnat_session):
+        self.xnat_session = xnat_session
+        self.writes = OrderedDict()
+        self.stale = []
+
+    def __repr__(self):
+        return '<WriteBatch {} objects, {} values>'.format(len(self.writes),
+                                                           sum(len(x) - 1 for x in self.writes.values()))
+
+    def add(self, uri, query, stale=()):
+        """
+        Add a write to the batch, writes to the same uri and xsi type are merged
+
+        :param str uri: uri of the object to write to
+        :param dict query: the query with the xsiType and the xpaths to set
+        :param stale: objects of which the cache has to be cleared after the write
+        """
+        key = (uri, query.get('xsiType'))
+        if key not in self.writes:
+            self.writes[key] = {}
+        self.writes[key].update(query)
+
+        for obj in stale:
+            if not any(obj is x for x in self.stale):
+                self.stale.append(obj)
+
+    def commit(self, timeout=None):
+        """
+        Send all collected writes and clear the caches of the changed objects
+        """
+        try:
+            while self.writes:
+                (uri, _), query = self.writes.popitem(last=False)
+                self.xnat_session.put(uri, query=query, timeout=timeout)
+        finally:
+            # Also after a failed write part of the values might have changed
+            for obj in self.stale:
+                obj.clearcache()
+            self.stale = []
+
+
+def write_fields(xnat_session, uri, query, stale=(), timeout=None):
+    """
+    Write field values to an object, if a batch is active in this thread the
+    write is added to the batch and sent when the batch is committed
+
+    :param xnat_session: the session to use
+    :param str uri: uri of the object to write to
+    :param dict query: the query with the xsiType and the xpaths to set
+    :param stale: objects of which the cache has to be cleared after the write
+    :param timeout: timeout in seconds, float or (connection timeout, read timeout)
+    """
+    batch = getattr(xnat_session._write_batches, 'current', None)
+    if batch is not None:
+        batch.add(uri, query, stale)
+        return
+
+    xnat_session.put(uri, query=query, timeout=timeout)
+    for obj in stale:
+        obj.clearcache()
+
+
 class VariableMap(MutableMapping):
     def __init__(self, parent, field):
         self._cache = {}
@@ -69,13 +139,8 @@ class VariableMap(MutableMapping):
     @property
     @caching
     def data(self):
-        try:
-            variables = next(x for x in self.parent.fulldata['children'] if x['field'] == self.field)
-            variables_map = {x['data_fields']['name']: x['data_fields']['field'] for x in variables['items'] if 'field' in x['data_fields']}
-        except StopIteration:
-            variables_map = {}
-
-        return variables_map
+        variables = self.parent.get_children(self.field) or []
+        return {x['data_fields']['name']: x['data_fields']['field'] for x in variables if 'field' in x['data_fields']}
 
     def __getitem__(self, item):
         return self.data[item]
@@ -86,11 +151,9 @@ class VariableMap(MutableMapping):
                                                                          field=self.field,
                                                                          type=self.parent.__xsi_type__,
                                                                          key=key): value}
-        self.xnat.put(self.parent.fulluri, query=query)
 
         # Remove cache and make sure the reload the data
-        if 'data' in self._cache:
-            self.clearcache()
+        write_fields(self.xnat, self.parent.fulluri, query, stale=[self] if 'data' in self._cache else [])
 
     def __delitem__(self, key):
         self.parent.logger.warning('Deleting of variables is currently not supported!')
@@ -120,11 +183,9 @@ class CustomVariableMap(VariableMap):
         query = {'xsiType': self.parent.__xsi_type__,
                  '{type_}/fields/field[name={key}]/field'.format(type_=self.parent.__xsi_type__,
                                                                  key=key): value}
-        self.xnat.put(self.parent.fulluri, query=query)
 
         # Remove cache and make sure the reload the data
-        if 'data' in self._cache:
-            self.clearcache()
+        write_fields(self.xnat, self.parent.fulluri, query, stale=[self] if 'data' in self._cache else [])
 
 
 @six.python_2_unicode_compatible
@@ -257,9 +318,47 @@ class XNATBaseObject(six.with_metaclass(ABCMeta, object)):
                 value = type_(value)
         return value
 
+    def get_children(self, field, include_subfields=False):
+        """
+        Get the items of a child field in the fulldata. An index of the children
+        is built once for every retrieval of the fulldata and shared by all
+        lookups (e.g. by the nested objects and listings of this object).
+
+        :param str field: the field of the child (e.g. ``sharing/share``)
+        :param bool include_subfields: also match children of which the field
+                                       starts with ``field/``
+        :return: list of items or None if the field is not found
+        """
+        fulldata = self.fulldata
+        index = self._cache.get('__children_index__')
+
+        if index is None or index[0] is not fulldata:
+            fields = {}
+            subfields = {}
+            for position, child in enumerate(fulldata.get('children', [])):
+                fields.setdefault(child['field'], (position, child['items']))
+
+                parts = child['field'].split('/')
+                for length in range(1, len(parts)):
+                    subfields.setdefault('/'.join(parts[:length]), (position, child['items']))
+
+            index = (fulldata, fields, subfields)
+            self._cache['__children_index__'] = index
+
+        match = index[1].get(field)
+        if include_subfields:
+            # The first child in the data wins, just like a linear search
+            submatch = index[2].get(field)
+            if submatch is not None and (match is None or submatch[0] < match[0]):
+                match = submatch
+
+        return match[1] if match is not None else None
+
     def get_object(self, fieldname, type_=None):
         try:
-            data = next(x for x in self.fulldata.get('children', []) if x['field'] == fieldname)['items']
+            data = self.get_children(fieldname)
+            if data is None:
+                raise StopIteration
             data = next(x for x in data if not x['meta']['isHistory'])  # Filter out the non-history item
             type_ = data['meta']['xsi:type']
         except StopIteration:
@@ -305,10 +404,49 @@ class XNATBaseObject(six.with_metaclass(ABCMeta, object)):
             xpath = '{}/{}'.format(self.xpath, name)
             query[xpath] = value
 
-        self.xnat_session.put(self.fulluri, query=query, timeout=timeout)
-        self.clearcache()
+        stale = [self]
         if hasattr(self.parent, 'clearcache'):
-            self.parent.clearcache()
+            stale.append(self.parent)
+
+        write_fields(self.xnat_session, self.fulluri, query, stale=stale, timeout=timeout)
+
+    @contextlib.contextmanager
+    def batch(self, timeout=None):
+        """
+        Context manager that collects all field writes (e.g. ``set``, ``mset``,
+        setting attributes, ``fields`` and demographics) made in this thread
+        and sends them as one PUT per object when the block ends. The caches
+        are cleared once after all writes are done, so values read inside the
+        block do not reflect the pending writes yet. If the block raises an
+        exception the pending writes are discarded. Nested batches are merged
+        into the outermost batch::
+
+            >>> with subject.batch():
+            ...     subject.fields['group'] = 'control'
+            ...     subject.fields['site'] = 'A'
+            ...     subject.demographics.gender = 'female'
+
+        :param timeout: timeout in seconds for the PUT requests
+        :return: the batch
+        :rtype: WriteBatch
+        """
+        batches = self.xnat_session._write_batches
+        current = getattr(batches, 'current', None)
+        if current is not None:
+            # Nested batch, the outermost batch commits
+            yield current
+            return
+
+        batch = WriteBatch(self.xnat_session)
+        batches.current = batch
+        try:
+            yield batch
+        finally:
+            # Also for KeyboardInterrupt and GeneratorExit, otherwise later writes would be queued forever
+            batches.current = None
+
+        # Only reached if the block ended normally
+        batch.commit(timeout=timeout)
 
     def set(self, name, value, type_=None, timeout=None):
         """
@@ -407,7 +545,15 @@ class XNATObject(XNATBaseObject):
     @property
     @caching
     def fulldata(self):
-        return next(x for x in self.xnat_session.get_json(self.uri)['items'] if not x['meta']['isHistory'])
+        return self._select_fulldata(self.xnat_session.get_json(self.uri))
+
+    @staticmethod
+    def _select_fulldata(result):
+        """
+        Select the current (non-history) item from the JSON returned for
+        the object uri
+        """
+        return next(x for x in result['items'] if not x['meta']['isHistory'])
 
     @property
     def data(self):
@@ -423,7 +569,9 @@ class XNATNestedObject(XNATBaseObject):
     def fulldata(self):
         try:
             if isinstance(self.parent.fulldata, dict):
-                data = next(x for x in self.parent.fulldata['children'] if x['field'] == self.fieldname)['items']
+                data = self.parent.get_children(self.fieldname)
+                if data is None:
+                    raise StopIteration
                 data = next(x for x in data if not x['meta']['isHistory'])
             elif isinstance(self.parent.fulldata, list):
                 if self.parent.secondary_lookup_field is not None:
@@ -522,6 +670,225 @@ class XNATSubObject(XNATBaseObject):
         self.parent.clearcache()
 
 
+class LazyObjectListing(Sequence):
+    """
+    Sequence of the objects in a listing that creates each object only when
+    it is accessed for the first time
+    """
+    def __init__(self, rows, factory):
+        self._rows = rows
+        self._factory = factory
+        self._objects = [None] * len(rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[x] for x in range(*index.indices(len(self)))]
+
+        obj = self._objects[index]
+        if obj is None:
+            obj = self._objects[index] = self._factory(self._rows[index])
+        return obj
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __repr__(self):
+        return repr(list(self))
+
+    @property
+    def rows(self):
+        """
+        The raw data rows of the listing
+        """
+        return self._rows
+
+
+class LazyObjectMap(Mapping):
+    """
+    Mapping from a key to an object in a
+    :py:class:`LazyObjectListing <xnat.core.LazyObjectListing>`
+    """
+    def __init__(self, index, listing):
+        self._index = index
+        self._listing = listing
+
+    def __getitem__(self, key):
+        return self._listing[self._index[key]]
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class ListingTable(Sequence):
+    """
+    Columnar storage of the rows of a listing. Only the given columns are kept
+    and every column is stored as a single list, which takes a fraction of the
+    memory of a dict per row. Indexing the table returns a (new) dict for
+    that row, so it can be used in place of the list of rows.
+
+    :param list rows: the rows (dicts) of the listing
+    :param columns: the columns to keep, columns not present in any row are dropped
+    :param factory: function creating the full object for a row (dict)
+    """
+    __slots__ = ('columns', 'factory', '_length')
+
+    def __init__(self, rows, columns, factory):
+        # A column can be missing from some rows, so check all rows (until all columns are found)
+        wanted = set(columns)
+        present = set()
+        for row in rows:
+            present.update(wanted.intersection(row))
+            if present == wanted:
+                break
+
+        self.columns = OrderedDict((column, [row.get(column) for row in rows])
+                                   for column in columns if column in present)
+        self.factory = factory
+        self._length = len(rows)
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[x] for x in range(*index.indices(len(self)))]
+
+        return {column: values[index] for column, values in self.columns.items()}
+
+    def __repr__(self):
+        return '<ListingTable {} rows, columns {}>'.format(len(self), list(self.columns))
+
+    def value(self, index, column):
+        """
+        Get a single value from the table
+
+        :param int index: index of the row
+        :param str column: name of the column
+        :return: the value or None if the column is not present
+        """
+        values = self.columns.get(column)
+        return values[index] if values is not None else None
+
+
+class ListingRow(object):
+    """
+    Lightweight object for a row of a :py:class:`ListingTable`. The ID, URI,
+    path and size are answered from the table. All other attributes (and
+    setting attributes) are forwarded to the full object, which is created
+    on first use, so a row can be used as the object it represents::
+
+        >>> files = resource.files.lightweight()  # listing of ListingRows
+        >>> files[0].size  # no request needed
+        >>> files[0].download('/tmp/file.dcm')  # creates the FileData object
+    """
+    __slots__ = ('_table', '_index', '_object')
+
+    def __init__(self, table, index):
+        object.__setattr__(self, '_table', table)
+        object.__setattr__(self, '_index', index)
+        object.__setattr__(self, '_object', None)
+
+    def __repr__(self):
+        obj = object.__getattribute__(self, '_object')
+        if obj is not None:
+            return repr(obj)
+        return '<ListingRow {}>'.format(self.id)
+
+    __str__ = __repr__
+
+    def __eq__(self, other):
+        if isinstance(other, ListingRow):
+            return self.uri == other.uri
+        return self.resolve() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.uri)
+
+    def resolve(self):
+        """
+        Get the full object for this row, it is created the first time it is needed
+
+        :rtype: XNATBaseObject
+        """
+        obj = object.__getattribute__(self, '_object')
+        if obj is None:
+            obj = self._table.factory(self._table[self._index])
+            object.__setattr__(self, '_object', obj)
+        return obj
+
+    @property
+    def data_row(self):
+        """
+        The data of the row in the listing
+        """
+        return self._table[self._index]
+
+    @property
+    def id(self):
+        return self._table.value(self._index, 'ID')
+
+    @property
+    def uri(self):
+        return self._table.value(self._index, 'URI')
+
+    @property
+    def path(self):
+        path = self._table.value(self._index, 'path')
+        return path if path is not None else self.resolve().path
+
+    @property
+    def size(self):
+        """
+        Size in bytes as given in the listing (an int), or the size reported
+        by the full object if the listing has no size
+        """
+        size = self._table.value(self._index, 'Size')
+        if size is None or size == '':
+            return self.resolve().size
+        return int(size)
+
+    def __getattr__(self, name):
+        # Only called if the attribute is not found on the row itself
+        return getattr(self.resolve(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.resolve(), name, value)
+
+
+class LightweightObjectListing(LazyObjectListing):
+    """
+    Sequence of the objects in a listing backed by a :py:class:`ListingTable`,
+    returning a :py:class:`ListingRow` for every item. Rows are not stored,
+    only the objects that are resolved are kept by the rows that are in use.
+    """
+    def __init__(self, table):
+        self._rows = table
+        self._factory = table.factory
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[x] for x in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self._rows)
+        if not 0 <= index < len(self._rows):
+            raise IndexError('listing index out of range')
+
+        return ListingRow(self._rows, index)
+
+
 @six.python_2_unicode_compatible
 class XNATBaseListing(Mapping, Sequence):
     def __init__(self, parent, field_name, secondary_lookup_field=None, xsi_type=None, **kwargs):
@@ -554,22 +921,7 @@ class XNATBaseListing(Mapping, Sequence):
         self.secondary_lookup_field = secondary_lookup_field
 
     def sanitize_name(self, name):
-        name = re.sub('[^0-9a-zA-Z]+', '_', name)
-
-        # Change CamelCaseString to camel_case_string
-        # Note that addID would become add_id
-        name = re.sub("[A-Z]+", lambda x: '_' + x.group(0).lower(), name)
-        if name[0] == '_':
-            name = name[1:]
-
-        # Avoid multiple underscores (replace them by single underscore)
-        name = re.sub("__+", '_', name)
-
-        # Avoid overwriting keywords TODO: Do we want this, as a property it is not a huge problem?
-        if keyword.iskeyword(name):
-            name += '_'
-
-        return name
+        return pythonize_attribute_name(name)
 
     @property
     def xnat_session(self):
@@ -669,33 +1021,79 @@ class XNATBaseListing(Mapping, Sequence):
 
 
 class XNATListing(XNATBaseListing):
-    def __init__(self, uri, filter=None, **kwargs):
+    """
+    Listing of objects that have their own REST path. The listing is
+    retrieved with a single request, but the objects are only created
+    when they are accessed. Use :py:meth:`iterate <xnat.core.XNATListing.iterate>`
+    to walk very large listings page by page instead.
+
+    A lightweight listing (see :py:meth:`lightweight <xnat.core.XNATListing.lightweight>`)
+    stores only the essential columns in a
+    :py:class:`ListingTable <xnat.core.ListingTable>` and returns
+    :py:class:`ListingRow <xnat.core.ListingRow>` objects, which saves a lot of
+    memory for large listings such as the files of a resource.
+    """
+    # Columns kept by a lightweight listing (besides the secondary lookup field)
+    LIGHTWEIGHT_COLUMNS = ('ID', 'URI', 'path', 'Size', 'digest', 'xsiType', 'element_name', 'fieldname')
+
+    def __init__(self, uri, filter=None, columns=None, lightweight=False, **kwargs):
         # Important for communication, needed before superclass is called
         self._uri = uri
+        self._lightweight = lightweight
 
         super(XNATListing, self).__init__(**kwargs)
 
         # Manager the filters
         self._used_filters = filter or {}
 
+        # Extra columns to request from the server
+        self._columns = tuple(columns or ())
+
     @property
     @caching
     def data_maps(self):
-        columns = 'ID,URI'
+        uri, query = self._listing_query()
+        result = self.xnat_session.get_json(uri, query=query)
+        return self._build_data_maps(result)
+
+    def _listing_query(self):
+        """
+        The uri and query string used to retrieve the content of the listing
+        """
+        columns = ['ID', 'URI']
         if self.secondary_lookup_field is not None:
-            columns = '{},{}'.format(columns, self.secondary_lookup_field)
+            columns.append(self.secondary_lookup_field)
         if self._xsi_type is None:
-            columns += ',xsiType'
+            columns.append('xsiType')
+
+        # Request the filtered columns, so the server can apply the filters
+        # and the returned values can be checked by the post filter
+        for column in tuple(self.used_filters) + self._columns:
+            if column not in columns:
+                columns.append(column)
 
         query = dict(self.used_filters)
-        query['columns'] = columns
-        result = self.xnat_session.get_json(self.uri, query=query)
+        query['columns'] = ','.join(columns)
+        return self.uri, query
+
+    def _listing_rows(self, result):
+        """
+        Extract and normalise the rows from the JSON returned by the listing
+        query and apply the filters the server could not apply
+        """
+        return self._filter_rows(self._normalise_rows(result))
 
+    def _normalise_rows(self, result):
+        """
+        Extract and normalise the rows from the JSON returned by the listing
+        query, without filtering them
+        """
         try:
             result = result['ResultSet']['Result']
         except KeyError:
             raise exceptions.XNATValueError('Query GET from {} returned invalid data: {}'.format(self.uri, result))
 
+        file_path_pattern = None
         for entry in result:
             if 'URI' not in entry and 'ID' not in entry:
                 # HACK: This is a Resource, that misses the URI and ID field (let's fix that)
@@ -708,41 +1106,106 @@ class XNATListing(XNATBaseListing):
                 if entry['URI'].startswith(self.parent.uri):
                     entry['path'] = entry['URI'].replace(self.parent.uri, '', 1)
                 else:
-                    entry['path'] = re.sub(r'^.*/resources/{}/files/'.format(self.parent.id), '', entry['URI'], 1)
+                    if file_path_pattern is None:
+                        file_path_pattern = re.compile(r'^.*/resources/{}/files/'.format(self.parent.id))
+                    entry['path'] = file_path_pattern.sub('', entry['URI'], 1)
             else:
                 entry['URI'] = '{}/{}'.format(self.uri, entry['ID'])
 
+        return result
+
+    def _filter_rows(self, result):
         # Post filter result if server side query did not work
         if self.used_filters:
             result = [x for x in result if all(fnmatch.fnmatch(x[k], v) for k, v in self.used_filters.items() if k in x)]
 
-        # Create object dictionaries
-        id_map = {}
-        key_map = {}
-        listing = []
+        return result
+
+    def _create_listing_object(self, row):
+        """
+        Create the object for a row of the listing
+        """
+        # HACK: xsi_type of resources is called element_name... yay!
+        kwargs = {}
+        if self.secondary_lookup_field is not None:
+            kwargs[self.secondary_lookup_field] = row.get(self.secondary_lookup_field)
+
+        return self.xnat_session.create_object(row['URI'],
+                                               type_=row.get('xsiType', row.get('element_name', self._xsi_type)),
+                                               id_=row['ID'],
+                                               fieldname=row.get('fieldname'),
+                                               **kwargs)
+
+    def _build_data_maps(self, result):
+        """
+        Create the data maps (see data_maps) from the JSON returned by
+        the listing query
+        """
+        rows = self._listing_rows(result)
+
+        # Create index dictionaries, the objects are created lazily
+        id_index = {}
+        key_index = {}
         non_unique = {None}
-        for x in result:
-            # HACK: xsi_type of resources is called element_name... yay!
+        for index, x in enumerate(rows):
             if self.secondary_lookup_field is not None:
                 secondary_lookup_value = x.get(self.secondary_lookup_field)
-                new_object = self.xnat_session.create_object(x['URI'],
-                                                             type_=x.get('xsiType', x.get('element_name', self._xsi_type)),
-                                                             id_=x['ID'],
-                                                             fieldname=x.get('fieldname'),
-                                                             **{self.secondary_lookup_field: secondary_lookup_value})
-                if secondary_lookup_value in key_map:
+                if secondary_lookup_value in key_index:
                     non_unique.add(secondary_lookup_value)
-                key_map[secondary_lookup_value] = new_object
-            else:
-                new_object = self.xnat_session.create_object(x['URI'],
-                                                             type_=x.get('xsiType', x.get('element_name', self._xsi_type)),
-                                                             id_=x['ID'],
-                                                             fieldname=x.get('fieldname'))
+                key_index[secondary_lookup_value] = index
+
+            id_index[x['ID']] = index
 
-            listing.append(new_object)
-            id_map[x['ID']] = new_object
+        if self._lightweight:
+            columns = self.LIGHTWEIGHT_COLUMNS + self._columns
+            if self.secondary_lookup_field is not None:
+                columns += (self.secondary_lookup_field,)
+            table = ListingTable(rows, columns, factory=self._create_listing_object)
+            listing = LightweightObjectListing(table)
+        else:
+            listing = LazyObjectListing(rows, self._create_listing_object)
+        return LazyObjectMap(id_index, listing), LazyObjectMap(key_index, listing), non_unique, listing
 
-        return id_map, key_map, non_unique, listing
+    def __iter__(self):
+        # Avoid creating the objects just to get their ID
+        for row in self.listing.rows:
+            yield row['ID']
+
+    def iterate(self, page_size=1000):
+        """
+        Iterate over the objects in the listing, retrieving the listing in
+        pages of ``page_size`` rows (using the ``offset`` and ``limit`` query
+        parameters). The result is not cached, so only one page of data is
+        kept in memory. If the server does not support paging the entire
+        listing is retrieved in the first request.
+
+        :param int page_size: number of rows to retrieve per request
+        :return: generator yielding the objects in the listing
+        """
+        uri, query = self._listing_query()
+        offset = 0
+        first_id = None
+
+        while True:
+            query['offset'] = offset
+            query['limit'] = page_size
+            # The paging checks use the rows as returned, before the post filter
+            rows = self._normalise_rows(self.xnat_session.get_json(uri, query=dict(query)))
+
+            # A repeated first row means the server ignored the offset
+            if rows and rows[0]['ID'] == first_id:
+                break
+
+            for row in self._filter_rows(rows):
+                yield self._create_listing_object(row)
+
+            # Short page (or more rows than requested, so the server ignored
+            # the limit) means this was the last page
+            if len(rows) != page_size:
+                break
+
+            first_id = rows[0]['ID']
+            offset += page_size
 
     def tabulate(self, columns=None, filter=None):
         """
@@ -760,14 +1223,7 @@ class XNATListing(XNATBaseListing):
         if columns is None:
             columns = ('DEFAULT',)
 
-        if filter is None:
-            filter = self.used_filters
-        else:
-            filter = self.merge_filters(self.used_filters, filter)
-
-        query = dict(filter)
-        query['columns'] = ','.join(columns)
-
+        query = self._tabulate_query(columns, filter)
         result = self.xnat_session.get_json(self.uri, query=query)
         if len(result['ResultSet']['Result']) > 0:
             result_columns = list(result['ResultSet']['Result'][0].keys())
@@ -777,7 +1233,7 @@ class XNATListing(XNATBaseListing):
                 result_columns = [x for x in columns if x in result_columns]
 
             # Replace all non-alphanumeric characters with an underscore
-            result_columns = {s: re.sub('[^0-9a-zA-Z]+', '_', s) for s in result_columns}
+            result_columns = {s: NON_ALPHANUMERIC_PATTERN.sub('_', s) for s in result_columns}
             rowtype = namedtuple('TableRow', list(result_columns.values()))
 
             # Replace all non-alphanumeric characters in each key of the keyword dictionary
@@ -785,6 +1241,50 @@ class XNATListing(XNATBaseListing):
         else:
             return ()
 
+    def tabulate_pandas(self, columns=None, filter=None, types=None):
+        """
+        Create a pandas DataFrame from this listing (requires pandas). The table
+        is requested as CSV and parsed while it is being received.
+
+        :param tuple columns: names of the variables to use for columns
+        :param dict filter: update filters to use (form of {'variable': 'filter*'})
+        :param dict types: mapping of column name to XSD type (e.g. 'xs:integer')
+                           for columns that should be converted
+        :return: tabulated data
+        :rtype: pandas.DataFrame
+        :raises ValueError: if the new filters conflict with the object filters
+        """
+        query = self._tabulate_query(columns or ('DEFAULT',), filter)
+        response = self.xnat_session.get(self.uri, format='csv', query=query, stream=True)
+        return tabular.csv_response_to_dataframe(response, types=types, columns=columns)
+
+    def tabulate_arrow(self, columns=None, filter=None, types=None):
+        """
+        Create an Arrow Table from this listing (requires pyarrow). The table
+        is requested as CSV and parsed while it is being received.
+
+        :param tuple columns: names of the variables to use for columns
+        :param dict filter: update filters to use (form of {'variable': 'filter*'})
+        :param dict types: mapping of column name to XSD type (e.g. 'xs:integer')
+                           for columns that should be converted
+        :return: tabulated data
+        :rtype: pyarrow.Table
+        :raises ValueError: if the new filters conflict with the object filters
+        """
+        query = self._tabulate_query(columns or ('DEFAULT',), filter)
+        response = self.xnat_session.get(self.uri, format='csv', query=query, stream=True)
+        return tabular.csv_response_to_arrow(response, types=types, columns=columns)
+
+    def _tabulate_query(self, columns, filter):
+        if filter is None:
+            filter = self.used_filters
+        else:
+            filter = self.merge_filters(self.used_filters, filter)
+
+        query = dict(filter)
+        query['columns'] = ','.join(columns)
+        return query
+
     @property
     def used_filters(self):
         return self._used_filters
@@ -803,6 +1303,32 @@ class XNATListing(XNATBaseListing):
 
         return new_filters
 
+    def lightweight(self):
+        """
+        Get a lightweight version of this listing, which returns
+        :py:class:`ListingRow <xnat.core.ListingRow>` proxies instead of the
+        objects themselves. The rows answer the ID, URI, path and size without
+        creating the objects, which saves memory and time for large listings::
+
+            >>> for file_ in resource.files.lightweight().values():
+            ...     print(file_.path, file_.size)
+
+        :return: new lightweight XNATListing
+        :rtype: XNATListing
+        """
+        if self._lightweight:
+            return self
+
+        return XNATListing(uri=self.uri,
+                           xnat_session=self.xnat_session,
+                           parent=self.parent,
+                           field_name=self.field_name,
+                           secondary_lookup_field=self.secondary_lookup_field,
+                           xsi_type=self._xsi_type,
+                           filter=self.used_filters,
+                           columns=self._columns,
+                           lightweight=True)
+
     def filter(self, filters=None, **kwargs):
         """
         Create a new filtered listing based on this listing. There are two way
@@ -830,7 +1356,9 @@ class XNATListing(XNATBaseListing):
                            field_name=self.field_name,
                            secondary_lookup_field=self.secondary_lookup_field,
                            xsi_type=self._xsi_type,
-                           filter=new_filters)
+                           filter=new_filters,
+                           columns=self._columns,
+                           lightweight=self._lightweight)
 
 
 class XNATSimpleListing(XNATBaseListing, MutableMapping, MutableSequence):
@@ -853,10 +1381,7 @@ class XNATSimpleListing(XNATBaseListing, MutableMapping, MutableSequence):
 
     @property
     def fulldata(self):
-        for child in self.parent.fulldata['children']:
-            if child['field'] == self.field_name:
-                return child['items']
-        return []
+        return self.parent.get_children(self.field_name) or []
 
     @property
     @caching
@@ -894,10 +1419,9 @@ class XNATSimpleListing(XNATBaseListing, MutableMapping, MutableSequence):
                                                                           lookup=self.secondary_lookup_field,
                                                                           fieldpart=self.field_name.split('/')[-1],
                                                                           key=key): value}
-        self.xnat_session.put(self.parent.fulluri, query=query)
 
         # Remove cache and make sure the reload the data
-        self.clearcache()
+        write_fields(self.xnat_session, self.parent.fulluri, query, stale=[self])
 
     def __delitem__(self, key):
         query = {
@@ -912,10 +1436,9 @@ class XNATSimpleListing(XNATBaseListing, MutableMapping, MutableSequence):
                                                                   lookup=self.secondary_lookup_field,
                                                                   key=key): 'NULL',
         }
-        self.xnat_session.put(self.parent.fulluri, query=query)
 
         # Remove cache and make sure the reload the data
-        self.clearcache()
+        write_fields(self.xnat_session, self.parent.fulluri, query, stale=[self])
 
     def insert(self, index, value):
         pass
@@ -936,10 +1459,7 @@ class XNATSubListing(XNATBaseListing, MutableMapping, MutableSequence):
 
     @property
     def fulldata(self):
-        for child in self.parent.fulldata['children']:
-            if child['field'] == self.field_name or child['field'].startswith(self.field_name + '/'):
-                return child['items']
-        return []
+        return self.parent.get_children(self.field_name, include_subfields=True) or []
 
     @property
     def uri(self):
@@ -1023,8 +1543,7 @@ class XNATSubListing(XNATBaseListing, MutableMapping, MutableSequence):
             xpath: 'NULL'
         }
 
-        self.xnat_session.put(self.fulluri, query=query)
-        self.clearcache()
+        write_fields(self.xnat_session, self.fulluri, query, stale=[self])
 
     def insert(self, index, value):
         pass
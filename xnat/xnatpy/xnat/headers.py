@@ -0,0 +1,253 @@
+# Copyright 2011-2015 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Bulk retrieval of DICOM header fields for many scans. For every experiment
+the DICOM files of all scans are listed in a single request, one
+representative file per scan is selected and only the header of that file is
+read (using HTTP Range requests where the server supports them). The headers
+are read concurrently and can be kept in a persistent cache, so scans that did
+not change are not read again::
+
+    >>> harvester = DicomHeaderHarvester(session, fields=['ProtocolName', 'EchoTime'],
+    ...                                  cache_path='headers.json')
+    >>> rows = harvester.harvest_project('myproject')
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import re
+import threading
+
+import six
+
+from .utils import atomic_replace, open_remote_file
+
+try:
+    PYDICOM_LOADED = True
+    import pydicom
+    import pydicom.multival
+except ImportError:
+    PYDICOM_LOADED = False
+
+try:
+    PANDAS_LOADED = True
+    import pandas
+except ImportError:
+    PANDAS_LOADED = False
+
+
+DEFAULT_FIELDS = (
+    'Modality',
+    'SeriesDescription',
+    'ProtocolName',
+    'SeriesInstanceUID',
+    'EchoTime',
+    'RepetitionTime',
+    'SliceThickness',
+)
+
+
+class DicomHeaderHarvester(object):
+    """
+    Harvest DICOM header fields of all scans in a collection of experiments.
+
+    :param xnat_session: the session to use
+    :param list fields: DICOM keywords of the fields to retrieve
+    :param int max_workers: number of concurrent requests
+    :param str cache_path: path of a JSON file used as persistent cache, None to disable. The
+                           entries are keyed by the uri, size and digest (if the server
+                           provides it) of the file that was read
+    :param str resource: label of the resources containing the DICOM files
+    :param int block_size: size of the ranged requests used to read the headers
+    """
+    SCAN_URI_PATTERN = re.compile(r'/scans/(?P<scan>[^/]+)/resources/')
+
+    def __init__(self, xnat_session, fields=DEFAULT_FIELDS, max_workers=8, cache_path=None,
+                 resource='DICOM', block_size=65536):
+        self.xnat_session = xnat_session
+        self.fields = list(fields)
+        self.max_workers = max_workers
+        self.cache_path = cache_path
+        self.resource = resource
+        self.block_size = block_size
+        self.files_read = 0
+        self.cache_hits = 0
+
+        self._cache_lock = threading.Lock()
+        self._cache = self._load_cache()
+
+    @property
+    def logger(self):
+        return self.xnat_session.logger
+
+    def harvest_project(self, project):
+        """
+        Harvest the headers of all scans in a project
+
+        :param project: the project (or its ID)
+        :return: list of dicts with one row per scan
+        """
+        if not isinstance(project, six.string_types):
+            project = project.id
+
+        experiments = self.xnat_session.get_json('/data/projects/{}/experiments'.format(project),
+                                                 query={'columns': 'ID'})['ResultSet']['Result']
+        return self.harvest(x['ID'] for x in experiments)
+
+    def harvest(self, experiments):
+        """
+        Harvest the headers of all scans in the given experiments
+
+        :param experiments: iterable of experiments (or experiment IDs)
+        :return: list of dicts with one row per scan, containing the experiment,
+                 scan, uri of the file that was read, the requested fields and
+                 an error message if the header could not be read
+        """
+        if not PYDICOM_LOADED:
+            raise RuntimeError('Cannot read DICOM, missing required dependency: pydicom')
+
+        experiments = [x if isinstance(x, six.string_types) else x.id for x in experiments]
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                file_listings = executor.map(self._representative_files, experiments)
+                scans = [scan for listing in file_listings for scan in listing]
+                rows = list(executor.map(self._harvest_scan, scans))
+        finally:
+            self.save_cache()
+
+        self.logger.info('Harvested headers of {} scans, read {} files ({} cached)'.format(
+            len(rows), self.files_read, self.cache_hits))
+        return rows
+
+    def harvest_pandas(self, experiments):
+        """
+        Harvest the headers of all scans in the given experiments as a pandas DataFrame
+
+        :param experiments: iterable of experiments (or experiment IDs)
+        :rtype: pandas.DataFrame
+        """
+        if not PANDAS_LOADED:
+            raise RuntimeError('Cannot create DataFrame, missing required dependency: pandas')
+
+        columns = ['experiment', 'scan', 'uri'] + self.fields + ['error']
+        return pandas.DataFrame(self.harvest(experiments), columns=columns)
+
+    def _representative_files(self, experiment):
+        """
+        List the DICOM files of all scans of an experiment in one request and
+        select the first file (by name) of every scan
+        """
+        uri = '/data/experiments/{}/scans/ALL/resources/{}/files'.format(experiment, self.resource)
+        try:
+            files = self.xnat_session.get_json(uri)['ResultSet']['Result']
+        except Exception as exception:
+            self.logger.warning('Could not list DICOM files of experiment {}: {}'.format(experiment, exception))
+            return []
+
+        selected = {}
+        for file_ in files:
+            match = self.SCAN_URI_PATTERN.search(file_['URI'])
+            if match is None:
+                continue
+
+            scan = match.group('scan')
+            if scan not in selected or file_['Name'] < selected[scan]['Name']:
+                selected[scan] = file_
+
+        return [(experiment, scan, file_['URI'], file_.get('Size'), file_.get('digest') or None)
+                for scan, file_ in sorted(selected.items())]
+
+    def _harvest_scan(self, scan):
+        experiment, scan_id, uri, size, digest = scan
+        row = {'experiment': experiment, 'scan': scan_id, 'uri': uri, 'error': None}
+
+        # The size alone does not detect a file replaced by one of the same size, use the digest if available
+        if digest is not None:
+            cache_key = '{}|{}|{}'.format(uri, size, digest)
+        else:
+            cache_key = '{}|{}'.format(uri, size)
+        with self._cache_lock:
+            cached = self._cache.get(cache_key)
+
+        if cached is not None and all(x in cached for x in self.fields):
+            with self._cache_lock:
+                self.cache_hits += 1
+        else:
+            try:
+                header = self._read_header(uri)
+            except Exception as exception:
+                self.logger.warning('Could not read DICOM header of {}: {}'.format(uri, exception))
+                row['error'] = str(exception)
+                row.update((x, None) for x in self.fields)
+                return row
+
+            cached = dict(cached or {})
+            cached.update(header)
+            with self._cache_lock:
+                self._cache[cache_key] = cached
+                self.files_read += 1
+
+        row.update((x, cached.get(x)) for x in self.fields)
+        return row
+
+    def _read_header(self, uri):
+        with open_remote_file(self.xnat_session, uri, block_size=self.block_size, cache_blocks=4) as dicom_fh:
+            dicom_data = pydicom.dcmread(dicom_fh, stop_before_pixels=True, force=True)
+
+        return {x: self._json_value(dicom_data.get(x)) for x in self.fields}
+
+    @staticmethod
+    def _json_value(value):
+        # Convert pydicom values to something that can be stored in JSON
+        if value is None or isinstance(value, six.string_types):
+            return value
+        elif isinstance(value, float):
+            return float(value)  # Also converts pydicom DSfloat
+        elif isinstance(value, six.integer_types):
+            return int(value)  # Also converts pydicom IS
+        elif isinstance(value, (list, tuple, pydicom.multival.MultiValue)):
+            return [DicomHeaderHarvester._json_value(x) for x in value]
+        else:
+            return str(value)
+
+    def _load_cache(self):
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return {}
+
+        try:
+            with open(self.cache_path) as cache_file:
+                return json.load(cache_file)
+        except ValueError:
+            self.logger.warning('Ignoring corrupt header cache {}'.format(self.cache_path))
+            return {}
+
+    def save_cache(self):
+        """
+        Write the persistent cache to disk (this is done automatically after harvesting)
+        """
+        if self.cache_path is None:
+            return
+
+        temp_path = self.cache_path + '.tmp'
+        with self._cache_lock:
+            with open(temp_path, 'w') as cache_file:
+                json.dump(self._cache, cache_file)
+
+        atomic_replace(temp_path, self.cache_path)
@@ -15,21 +15,67 @@
 
 from __future__ import absolute_import
 from __future__ import unicode_literals
+from concurrent.futures import ThreadPoolExecutor
+import difflib
 import fnmatch
+import json
+import os
+import threading
+
+from .exceptions import XNATValueError
+from .utils import atomic_replace, pythonize_attribute_name
 
 
 class Inspect(object):
+    """
+    Inspection of the search datatypes and their fields. The datatypes and
+    fields are retrieved once per session and kept in a catalogue, the
+    complete catalogue can be fetched (concurrently) with :py:meth:`catalogue`
+    and persisted to a file, after which :py:meth:`validate_field` and
+    search queries can be checked without any requests::
+
+        >>> session.inspect.catalogue(cache_path='~/.xnatpy/catalogue.json')
+        >>> session.inspect.validate_field('xnat:subjectData/GENDER_TEXT')
+    """
     def __init__(self, xnat_session):
         self._xnat_session = xnat_session
+        self._datatypes = None
+        self._datafields = {}
+        self._catalogue_key = None
+        self._catalogue_files = set()  # Files that contain the current catalogue
+        self._lock = threading.Lock()
 
     @property
     def xnat_session(self):
         return self._xnat_session
 
-    def datatypes(self, pattern='*', fields_pattern=None):
-        elements = self.xnat_session.get_json('/data/search/elements')
+    @property
+    def catalogue_complete(self):
+        """
+        True if the datatypes and the fields of all datatypes are known
+        """
+        return self._datatypes is not None and all(x in self._datafields for x in self._datatypes)
+
+    def _element_names(self):
+        if self._datatypes is None:
+            elements = self.xnat_session.get_json('/data/search/elements')
+            self._datatypes = [x['ELEMENT_NAME'] for x in elements['ResultSet']['Result']]
+        return self._datatypes
+
+    def _field_ids(self, datatype):
+        with self._lock:
+            fields = self._datafields.get(datatype)
 
-        elements = [x['ELEMENT_NAME'] for x in elements['ResultSet']['Result']]
+        if fields is None:
+            search_fields = self.xnat_session.get_json('/data/search/elements/{}'.format(datatype))
+            fields = [x['FIELD_ID'] for x in search_fields['ResultSet']['Result']]
+            with self._lock:
+                self._datafields[datatype] = fields
+
+        return fields
+
+    def datatypes(self, pattern='*', fields_pattern=None):
+        elements = list(self._element_names())
 
         # Filter fields using pattern
         if '*' in pattern or '?' in pattern:
@@ -38,13 +84,11 @@ class Inspect(object):
         if fields_pattern is None:
             return elements
         else:
+            self.fetch_datafields(elements)
             return [field for element in elements for field in self.datafields(datatype=element, pattern=fields_pattern)]
 
     def datafields(self, datatype, pattern='*', prepend_type=True):
-        search_fields = self.xnat_session.get_json('/data/search/elements/{}'.format(datatype))
-
-        # Select data from JSON
-        search_fields = [x['FIELD_ID'] for x in search_fields['ResultSet']['Result']]
+        search_fields = self._field_ids(datatype)
 
         # Filter fields using pattern
         if '*' in pattern or '?' in pattern:
@@ -55,3 +99,161 @@ class Inspect(object):
 
         return ['{}/{}'.format(datatype, field) if prepend_type else field for field in search_fields]
 
+    def fetch_datafields(self, datatypes=None, max_workers=8):
+        """
+        Retrieve the fields of multiple datatypes concurrently, datatypes of
+        which the fields are already known are skipped
+
+        :param list datatypes: the datatypes to retrieve, None for all datatypes
+        :param int max_workers: number of concurrent requests
+        """
+        if datatypes is None:
+            datatypes = self._element_names()
+
+        with self._lock:
+            missing = [x for x in datatypes if x not in self._datafields]
+
+        if not missing:
+            return
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(self._field_ids, missing))
+
+    def catalogue(self, cache_path=None, refresh=False, max_workers=8):
+        """
+        Get the catalogue of all datatypes and their fields. The catalogue is
+        kept for the session, if a ``cache_path`` is given it is also stored
+        in that file and loaded from it for later sessions to the same server
+        and XNAT version.
+
+        :param str cache_path: path of a JSON file to persist the catalogue, None to disable
+        :param bool refresh: retrieve the catalogue from the server even if it is known
+        :param int max_workers: number of concurrent requests
+        :return: dict mapping the datatypes to their field IDs
+        """
+        if cache_path is not None:
+            cache_path = os.path.expanduser(cache_path)
+
+        if refresh:
+            with self._lock:
+                self._datatypes = None
+                self._datafields = {}
+                self._catalogue_files = set()
+        elif not self.catalogue_complete and cache_path is not None:
+            self._load_catalogue(cache_path)
+
+        if not self.catalogue_complete:
+            self.fetch_datafields(max_workers=max_workers)
+
+        if cache_path is not None and cache_path not in self._catalogue_files:
+            self._save_catalogue(cache_path)
+
+        return {x: list(self._datafields[x]) for x in self._datatypes}
+
+    def _cache_key(self):
+        # The catalogue depends on the server and its version (and installed plugins)
+        if self._catalogue_key is None:
+            self._catalogue_key = '{}|{}'.format(self.xnat_session.xnat_version, self.xnat_session._original_uri)
+        return self._catalogue_key
+
+    def _load_catalogue(self, cache_path):
+        if not os.path.exists(cache_path):
+            return
+
+        try:
+            with open(cache_path) as cache_file:
+                data = json.load(cache_file)
+        except ValueError:
+            self.xnat_session.logger.warning('Ignoring corrupt catalogue cache {}'.format(cache_path))
+            return
+
+        catalogue = data.get(self._cache_key())
+        if catalogue is not None:
+            with self._lock:
+                self._datatypes = list(catalogue)
+                self._datafields.update(catalogue)
+                self._catalogue_files.add(cache_path)
+
+    def _save_catalogue(self, cache_path):
+        # The file can contain the catalogues of multiple servers
+        data = {}
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path) as cache_file:
+                    data = json.load(cache_file)
+            except ValueError:
+                pass
+
+        with self._lock:
+            data[self._cache_key()] = {x: self._datafields[x] for x in self._datatypes}
+
+        directory = os.path.dirname(cache_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        temp_path = cache_path + '.tmp'
+        with open(temp_path, 'w') as cache_file:
+            json.dump(data, cache_file)
+
+        atomic_replace(temp_path, cache_path)
+
+        self._catalogue_files.add(cache_path)
+
+    def validate_field(self, identifier):
+        """
+        Check a search field identifier (``datatype/field``) against the
+        catalogue, this does not make any requests for the catalogue. Fields
+        that are not in the catalogue can be schema paths (e.g.
+        ``xnat:subjectData/demographics/gender``), these are matched against the
+        elements of the class for the datatype. Unknown schema paths are only
+        reported as a warning, as the generated classes do not cover all paths
+        the server accepts.
+
+        :param str identifier: the identifier to check
+        :return: True if the field could be checked, False if the catalogue is not complete
+        :raises XNATValueError: if the datatype or a search field ID is unknown
+        """
+        if not self.catalogue_complete:
+            return False
+
+        datatype, _, field = identifier.partition('/')
+        if datatype not in self._datafields:
+            matches = difflib.get_close_matches(datatype, self._datatypes, n=3)
+            raise XNATValueError('Unknown search datatype {}{}'.format(
+                datatype, ', did you mean: {}'.format(', '.join(matches)) if matches else ''))
+
+        fields = self._datafields[datatype]
+        if field.upper() in (x.upper() for x in fields):
+            return True
+
+        if self._is_schema_element(datatype, field):
+            return True
+
+        matches = difflib.get_close_matches(field.upper(), fields, n=3)
+        message = 'Unknown search field {} for datatype {}{}'.format(
+            field, datatype, ', did you mean: {}'.format(', '.join(matches)) if matches else '')
+
+        # Search field IDs are upper case (e.g. GENDER_TEXT), anything else is a schema path
+        if '/' not in field and field == field.upper():
+            raise XNATValueError(message)
+
+        self.xnat_session.logger.warning(message)
+        return True
+
+    def _is_schema_element(self, datatype, field):
+        """
+        Check if the first element of a schema path is an element of the
+        class for the datatype (case-insensitive)
+        """
+        try:
+            cls = self.xnat_session.XNAT_CLASS_LOOKUP.get(datatype)
+        except Exception:
+            # Generating the class (for a lazy model) can fail, the field cannot be checked then
+            cls = None
+
+        if cls is None:
+            return False
+
+        element = field.split('/')[0]
+        candidates = {element.lower(), pythonize_attribute_name(element).lower()}
+        return any(x.lower() in candidates for x in dir(cls))
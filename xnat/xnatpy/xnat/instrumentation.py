@@ -0,0 +1,284 @@
+# Copyright 2011-2015 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Instrumentation of the requests made by an XNATSession. Every request
+(and every query answered from the :py:class:`xnat.search.QueryCache`)
+results in a :py:class:`RequestEvent` that is passed to the hooks registered
+on the session. The :py:class:`RequestStatistics` hook aggregates the events
+per endpoint, the endpoints are identified by their URI template, so all
+requests for different subjects end up in the same row::
+
+    >>> statistics = RequestStatistics()
+    >>> session.add_request_hook(statistics)
+    >>> crawl(session)
+    >>> print(statistics.report(top=10))
+    >>> spans = statistics.export_spans()
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import binascii
+from collections import deque
+import os
+import re
+import threading
+
+from six.moves.urllib import parse
+
+# Collections in the REST API of which the next element in the path is an identifier
+URI_COLLECTIONS = {
+    'projects': '{project}',
+    'subjects': '{subject}',
+    'experiments': '{experiment}',
+    'scans': '{scan}',
+    'reconstructions': '{reconstruction}',
+    'assessors': '{assessor}',
+    'resources': '{resource}',
+    'out': '{resource}',
+    'in': '{resource}',
+    'users': '{user}',
+    'prearchive': None,
+}
+
+PREARCHIVE_PATTERN = re.compile(r'^(/data/prearchive/projects)/[^/]+/[^/]+/[^/]+')
+
+
+def uri_template(uri):
+    """
+    Reduce a uri to a template identifying the endpoint, the query string,
+    identifiers and file paths are replaced by placeholders, e.g.
+    ``/data/projects/{project}/subjects/{subject}``
+
+    :param str uri: the uri or path of the request
+    :return: the template
+    :rtype: str
+    """
+    path = parse.urlparse(uri).path
+
+    # The prearchive uses project/timestamp/session instead of collection/identifier pairs
+    path = PREARCHIVE_PATTERN.sub(r'\1/{project}/{timestamp}/{session}', path)
+
+    parts = path.split('/')
+    template = []
+    previous = None
+    for part in parts:
+        if previous == 'files':
+            # The remainder of the path is the path of the file
+            template.append('{path}')
+            break
+
+        if URI_COLLECTIONS.get(previous) is not None and not part.startswith('{'):
+            template.append(URI_COLLECTIONS[previous])
+        else:
+            template.append(part)
+        previous = part
+
+    return '/'.join(template)
+
+
+class RequestEvent(object):
+    """
+    Information about a single request made by the session
+
+    :param str method: the HTTP method (GET, PUT, ...)
+    :param str uri: the full uri of the request
+    :param int status: the status code of the response, None if no response was received
+    :param int nbytes: number of bytes in the response body (or downloaded), None if unknown
+    :param float start_time: wall clock time of the start of the request (as time.time())
+    :param float latency: duration of the request in seconds
+    :param str cache: None for a normal request, 'hit' if it was answered from a cache
+                      and 'revalidated' if the server confirmed the cached copy (304)
+    :param str error: description of the error if the request failed without response
+    """
+    __slots__ = ('method', 'uri', 'template', 'status', 'nbytes', 'start_time', 'latency', 'cache', 'error')
+
+    def __init__(self, method, uri, status=None, nbytes=None, start_time=None, latency=0.0, cache=None, error=None):
+        self.method = method
+        self.uri = uri
+        self.template = uri_template(uri)
+        self.status = status
+        self.nbytes = nbytes
+        self.start_time = start_time
+        self.latency = latency
+        self.cache = cache
+        self.error = error
+
+    def __repr__(self):
+        return '<RequestEvent {} {} status={} bytes={} latency={:.3f}s cache={}>'.format(
+            self.method, self.template, self.status, self.nbytes, self.latency, self.cache)
+
+    @property
+    def endpoint(self):
+        return '{} {}'.format(self.method, self.template)
+
+    def to_span(self):
+        """
+        Convert the event to a span following the OpenTelemetry data model and
+        the HTTP semantic conventions. The span is a plain dict, so it can be
+        serialized as JSON or converted to spans of an OpenTelemetry SDK.
+
+        :rtype: dict
+        """
+        start = int((self.start_time or 0.0) * 1e9)
+        attributes = {
+            'http.method': self.method,
+            'http.url': self.uri,
+            'http.route': self.template,
+        }
+        if self.status is not None:
+            attributes['http.status_code'] = self.status
+        if self.nbytes is not None:
+            attributes['http.response_content_length'] = self.nbytes
+        if self.cache is not None:
+            attributes['xnat.cache'] = self.cache
+
+        failed = self.error is not None or (self.status is not None and self.status >= 400)
+
+        return {
+            'trace_id': binascii.hexlify(os.urandom(16)).decode('ascii'),
+            'span_id': binascii.hexlify(os.urandom(8)).decode('ascii'),
+            'name': self.endpoint,
+            'kind': 'CLIENT',
+            'start_time_unix_nano': start,
+            'end_time_unix_nano': start + int(self.latency * 1e9),
+            'attributes': attributes,
+            'status': {'code': 'ERROR' if failed else 'UNSET', 'message': self.error or ''},
+        }
+
+
+class EndpointStatistics(object):
+    """
+    Aggregated statistics of the requests to a single endpoint
+    """
+    __slots__ = ('endpoint', 'count', 'errors', 'cache_hits', 'total_latency', 'max_latency', 'nbytes')
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.count = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.nbytes = 0
+
+    def __repr__(self):
+        return '<EndpointStatistics {} count={} total={:.3f}s>'.format(self.endpoint, self.count, self.total_latency)
+
+    @property
+    def mean_latency(self):
+        return self.total_latency / self.count if self.count else 0.0
+
+    def add(self, event):
+        self.count += 1
+        self.total_latency += event.latency
+        self.max_latency = max(self.max_latency, event.latency)
+        if event.nbytes:
+            self.nbytes += event.nbytes
+        if event.cache == 'hit':
+            self.cache_hits += 1
+        if event.error is not None or (event.status is not None and event.status >= 400):
+            self.errors += 1
+
+
+class RequestStatistics(object):
+    """
+    Request hook that aggregates the events per endpoint (method and URI
+    template) and keeps the most recent events for exporting as spans.
+    It can be shared by multiple sessions and threads.
+
+    :param int max_events: number of recent events to keep for the span export
+    """
+    SORT_KEYS = {
+        'total': lambda x: x.total_latency,
+        'mean': lambda x: x.mean_latency,
+        'max': lambda x: x.max_latency,
+        'count': lambda x: x.count,
+        'bytes': lambda x: x.nbytes,
+    }
+
+    def __init__(self, max_events=10000):
+        self.endpoints = {}
+        self.events = deque(maxlen=max_events)
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            statistics = self.endpoints.get(event.endpoint)
+            if statistics is None:
+                statistics = self.endpoints[event.endpoint] = EndpointStatistics(event.endpoint)
+            statistics.add(event)
+            self.events.append(event)
+
+    def __repr__(self):
+        return '<RequestStatistics {} endpoints, {} requests>'.format(len(self.endpoints), self.count)
+
+    @property
+    def count(self):
+        return sum(x.count for x in self.endpoints.values())
+
+    def reset(self):
+        """
+        Remove all collected statistics and events
+        """
+        with self._lock:
+            self.endpoints.clear()
+            self.events.clear()
+
+    def top(self, n=10, sort='total'):
+        """
+        Get the endpoints that took the most time
+
+        :param int n: number of endpoints to return
+        :param str sort: sort by total, mean or max latency, count or bytes
+        :return: list of EndpointStatistics
+        """
+        if sort not in self.SORT_KEYS:
+            raise ValueError('Invalid sort key {}, should be one of {}'.format(sort, sorted(self.SORT_KEYS)))
+
+        with self._lock:
+            endpoints = list(self.endpoints.values())
+
+        return sorted(endpoints, key=self.SORT_KEYS[sort], reverse=True)[:n]
+
+    def report(self, top=10, sort='total'):
+        """
+        Create a table with the slowest endpoints
+
+        :param int top: number of endpoints to show
+        :param str sort: sort by total, mean or max latency, count or bytes
+        :return: the report
+        :rtype: str
+        """
+        lines = ['{:>7} {:>6} {:>6} {:>10} {:>9} {:>9} {:>12}  {}'.format(
+            'count', 'errors', 'cached', 'total (s)', 'mean (s)', 'max (s)', 'bytes', 'endpoint')]
+
+        for statistics in self.top(top, sort=sort):
+            lines.append('{:>7} {:>6} {:>6} {:>10.3f} {:>9.3f} {:>9.3f} {:>12}  {}'.format(
+                statistics.count, statistics.errors, statistics.cache_hits, statistics.total_latency,
+                statistics.mean_latency, statistics.max_latency, statistics.nbytes, statistics.endpoint))
+
+        return '\n'.join(lines)
+
+    def export_spans(self):
+        """
+        Export the recent events as OpenTelemetry-style spans, see :py:meth:`RequestEvent.to_span`
+
+        :return: list of spans (dicts)
+        """
+        with self._lock:
+            events = list(self.events)
+
+        return [x.to_span() for x in events]
@@ -15,14 +15,19 @@
 
 from __future__ import absolute_import
 from __future__ import unicode_literals
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 import re
+import threading
+import time
 
 import isodate
 
+from . import exceptions
 from .core import XNATBaseObject
 from .datatypes import to_date, to_time
-from .utils import RequestsFileLike
+from .utils import open_remote_file
 
 try:
     PYDICOM_LOADED = True
@@ -32,6 +37,18 @@ except ImportError:
 
 
 class PrearchiveSession(XNATBaseObject):
+    def __init__(self, uri, xnat_session, id_=None, datafields=None, parent=None, fieldname=None):
+        super(PrearchiveSession, self).__init__(uri=uri,
+                                                xnat_session=xnat_session,
+                                                id_=id_,
+                                                datafields=datafields,
+                                                parent=parent,
+                                                fieldname=fieldname)
+
+        # A row of a prearchive listing contains the same fields as the fulldata,
+        # it is used for all fields except the status, which changes over time
+        self._listing_data = datafields
+
     @property
     def id(self):
         """
@@ -65,8 +82,14 @@ class PrearchiveSession(XNATBaseObject):
 
     @property
     def data(self):
+        if self._listing_data is not None:
+            return self._listing_data
         return self.fulldata
 
+    def clearcache(self):
+        self._listing_data = None
+        super(PrearchiveSession, self).clearcache()
+
     @property
     def autoarchive(self):
         return self.data['autoarchive']
@@ -116,7 +139,8 @@ class PrearchiveSession(XNATBaseObject):
 
     @property
     def status(self):
-        return self.data['status']
+        # The status changes while the server processes the session, always retrieve it
+        return self.fulldata['status']
 
     @property
     def subject(self):
@@ -390,10 +414,8 @@ class PrearchiveFile(XNATBaseObject):
 
         self._fulldata = datafields
 
-    def open(self):
-        uri = self.xnat_session.url_for(self)
-        request = self.xnat_session.interface.get(uri, stream=True)
-        return RequestsFileLike(request)
+    def open(self, block_size=262144, cache_blocks=16):
+        return open_remote_file(self.xnat_session, self.fulluri, block_size=block_size, cache_blocks=cache_blocks)
 
     @property
     def data(self):
@@ -457,4 +479,337 @@ class Prearchive(object):
 
         data = self.xnat_session.get_json(uri)
         # We need to prepend /data to our url (seems to be a bug?)
-        return [PrearchiveSession('/data{}'.format(x['url']), self.xnat_session) for x in data['ResultSet']['Result']]
+        return [PrearchiveSession('/data{}'.format(x['url']), self.xnat_session, datafields=x) for x in data['ResultSet']['Result']]
+
+    def watch(self, handler, project=None, **kwargs):
+        """
+        Create a :py:class:`PrearchiveWatcher` that calls handler for every
+        session that arrives in the prearchive, e.g. to archive all sessions::
+
+            >>> watcher = session.prearchive.watch(lambda x: x.archive())
+            >>> watcher.start()
+
+        :param handler: function that is called with each new PrearchiveSession
+        :param str project: only watch the prearchive of this project
+        :param kwargs: extra arguments for the :py:class:`PrearchiveWatcher`
+        :rtype: PrearchiveWatcher
+        """
+        return PrearchiveWatcher(self.xnat_session, handler, project=project, **kwargs)
+
+
+class PrearchiveOperation(object):
+    """
+    Tracks the handling of a single prearchive session by a
+    :py:class:`PrearchiveWatcher`. The state goes from ``queued`` to
+    ``running`` (handler is called) to ``waiting`` (handler returned, but the
+    server still reports the session as being processed, e.g. for
+    asynchronous operations) and ends as ``done``, ``skipped`` or ``failed``.
+    """
+    def __init__(self, session, lastmod):
+        self.session = session
+        self.lastmod = lastmod
+        self.state = 'queued'
+        self.error = None
+        self.queued = time.time()
+        self.started = None
+        self.finished = None
+
+    def __repr__(self):
+        return '<PrearchiveOperation {} ({})>'.format(self.session.uri, self.state)
+
+    @property
+    def latency(self):
+        """
+        Time in seconds from detection of the session until the operation finished
+        """
+        if self.finished is None:
+            return None
+        return self.finished - self.queued
+
+
+class PrearchiveWatcher(object):
+    """
+    Watches the prearchive and calls a handler for every session that is new
+    or changed (based on the lastmod field) and has a status in ``statuses``.
+    The handler should perform the operation for the session (e.g. archive or
+    move it), it can return False to skip a session.
+
+    Every poll the prearchive listing is retrieved once, new sessions are
+    queued and dispatched in batches of at most ``batch_size`` to a pool of
+    ``max_workers`` threads. Operations that leave the session in a queued or
+    busy state on the server (e.g. ``move(..., asynchronous=True)``) are
+    tracked in the following polls until the session is gone or idle.
+    When an operation finishes the next queued operation is dispatched
+    immediately. A failed handler is retried in the following polls (if the
+    session still has a status in ``statuses``) up to ``retries`` times.
+
+    :param xnat_session: the session to use
+    :param handler: function called with each new PrearchiveSession
+    :param str project: only watch the prearchive of this project
+    :param float interval: time in seconds between polls
+    :param int max_workers: number of concurrent operations
+    :param int batch_size: maximum number of operations in flight
+    :param float settle_time: only handle sessions that were not modified for this time (in seconds)
+    :param tuple statuses: statuses of sessions to handle
+    :param int retries: number of times a failed handler is retried for a session
+    """
+    def __init__(self, xnat_session, handler, project=None, interval=60.0, max_workers=4,
+                 batch_size=32, settle_time=0.0, statuses=('READY',), retries=3):
+        self.xnat_session = xnat_session
+        self.handler = handler
+        self.project = project
+        self.interval = interval
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.settle_time = settle_time
+        self.statuses = statuses
+        self.retries = retries
+
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.latencies = deque(maxlen=1000)
+        self.last_poll = None
+
+        self._seen = {}
+        self._attempts = {}
+        self._queue = deque()
+        self._active = {}
+        self._lock = threading.RLock()  # Done callbacks can run in the dispatching thread
+        self._executor = None
+        self._dispatching = False
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def __repr__(self):
+        return '<PrearchiveWatcher queue: {}, in flight: {}, completed: {}, failed: {}>'.format(
+            self.queue_depth, self.in_flight, self.completed, self.failed)
+
+    @property
+    def logger(self):
+        return self.xnat_session.logger
+
+    @property
+    def queue_depth(self):
+        """
+        Number of sessions waiting to be handled
+        """
+        return len(self._queue)
+
+    @property
+    def in_flight(self):
+        """
+        Number of operations that are running or waiting for the server to finish
+        """
+        return len(self._active) - len(self._queue)
+
+    def metrics(self):
+        """
+        Get the queue depth, counts and latency statistics (in seconds) of the operations
+
+        :rtype: dict
+        """
+        latencies = sorted(self.latencies)
+        if latencies:
+            latency = {
+                'mean': sum(latencies) / len(latencies),
+                'p50': latencies[len(latencies) // 2],
+                'p95': latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)],
+                'max': latencies[-1],
+            }
+        else:
+            latency = {'mean': None, 'p50': None, 'p95': None, 'max': None}
+
+        return {
+            'queue_depth': self.queue_depth,
+            'in_flight': self.in_flight,
+            'completed': self.completed,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'latency': latency,
+            'last_poll': self.last_poll,
+        }
+
+    @staticmethod
+    def _is_busy(status):
+        # Statuses such as QUEUED_MOVING, ARCHIVING or _BUILDING indicate the server is working on it
+        return status.startswith(('QUEUED_', '_')) or status.endswith('ING')
+
+    def poll(self):
+        """
+        Retrieve the prearchive listing once, update the tracked operations,
+        queue new sessions and dispatch queued operations
+        """
+        if self.project is None:
+            uri = '/data/prearchive/projects'
+        else:
+            uri = '/data/prearchive/projects/{}'.format(self.project)
+
+        rows = self.xnat_session.get_json(uri)['ResultSet']['Result']
+        self.last_poll = time.time()
+        listing = {'/data{}'.format(x['url']): x for x in rows}
+
+        with self._lock:
+            # Check completion of operations the server was still processing
+            for session_uri, operation in list(self._active.items()):
+                if operation.state != 'waiting':
+                    continue
+
+                row = listing.get(session_uri)
+                if row is None or not self._is_busy(row['status']):
+                    failed = row is not None and row['status'] in ('ERROR', 'CONFLICT')
+                    self._finish(operation, 'failed' if failed else 'done',
+                                 error='Session has status {}'.format(row['status']) if failed else None)
+
+            # Queue new and changed sessions
+            now = datetime.datetime.now()
+            for session_uri, row in listing.items():
+                if session_uri in self._active or row['status'] not in self.statuses:
+                    continue
+
+                lastmod = row.get('lastmod')
+                if self._seen.get(session_uri) == lastmod:
+                    continue
+
+                if self.settle_time > 0 and lastmod:
+                    try:
+                        modified = datetime.datetime.strptime(lastmod, '%Y-%m-%d %H:%M:%S.%f')
+                    except ValueError:
+                        modified = None
+                    if modified is not None and (now - modified).total_seconds() < self.settle_time:
+                        continue  # Still receiving data, check again next poll
+
+                self._seen[session_uri] = lastmod
+                operation = PrearchiveOperation(PrearchiveSession(session_uri, self.xnat_session, datafields=row), lastmod)
+                self._active[session_uri] = operation
+                self._queue.append(operation)
+
+            # Forget sessions that left the prearchive
+            for session_uri in list(self._seen):
+                if session_uri not in listing:
+                    del self._seen[session_uri]
+                    self._attempts.pop(session_uri, None)
+
+            self._dispatch()
+
+    def _dispatch(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+
+        # Handlers that finish immediately call back into this loop, which already continues dispatching
+        if self._dispatching:
+            return
+
+        self._dispatching = True
+        try:
+            while self._queue and self.in_flight < self.batch_size:
+                operation = self._queue.popleft()
+                operation.state = 'running'
+                operation.started = time.time()
+                future = self._executor.submit(self.handler, operation.session)
+                future.add_done_callback(lambda x, operation=operation: self._handler_done(operation, x))
+        finally:
+            self._dispatching = False
+
+    def _session_state(self, operation):
+        """
+        State of an operation of which the handler returned, based on the
+        current status of the session on the server
+        """
+        try:
+            status = operation.session.status
+        except (exceptions.XNATResponseError, IndexError):
+            return 'done', None  # The session left the prearchive
+
+        if status in ('ERROR', 'CONFLICT'):
+            return 'failed', 'Session has status {}'.format(status)
+        elif self._is_busy(status):
+            return 'waiting', None
+        return 'done', None
+
+    def _handler_done(self, operation, future):
+        exception = future.exception()
+        if exception is None and future.result() is not False:
+            # Check the session directly, so the slot is freed without waiting for the next poll
+            try:
+                state, error = self._session_state(operation)
+            except Exception:
+                state, error = 'waiting', None
+
+        with self._lock:
+            if exception is not None:
+                session_uri = operation.session.uri
+                attempts = self._attempts[session_uri] = self._attempts.get(session_uri, 0) + 1
+                if attempts <= self.retries:
+                    # Forget the session, so the next poll queues it again
+                    self.logger.warning('Handling prearchive session {} failed (attempt {}), retrying: {}'.format(
+                        session_uri, attempts, exception))
+                    self._seen.pop(session_uri, None)
+                    operation.error = str(exception)
+                    self._active.pop(session_uri, None)
+                else:
+                    self.logger.warning('Handling prearchive session {} failed: {}'.format(session_uri, exception))
+                    self._finish(operation, 'failed', error=str(exception))
+            elif future.result() is False:
+                self._finish(operation, 'skipped')
+            elif state == 'waiting':
+                # Completion is confirmed by a following poll
+                operation.state = 'waiting'
+            else:
+                self._finish(operation, state, error=error)
+
+            # A slot is free, start the next queued operation without waiting for a poll
+            if self._executor is not None and not self._stop_event.is_set():
+                self._dispatch()
+
+    def _finish(self, operation, state, error=None):
+        operation.state = state
+        operation.error = error
+        operation.finished = time.time()
+        self._active.pop(operation.session.uri, None)
+
+        if state == 'done':
+            self.completed += 1
+            self.latencies.append(operation.latency)
+        elif state == 'failed':
+            self.failed += 1
+        else:
+            self.skipped += 1
+
+    def run(self):
+        """
+        Poll the prearchive until :py:meth:`stop` is called
+        """
+        while not self._stop_event.is_set():
+            try:
+                self.poll()
+            except Exception as exception:
+                self.logger.warning('Polling the prearchive failed: {}'.format(exception))
+            self._stop_event.wait(self.interval)
+
+    def start(self):
+        """
+        Start watching in a background thread
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True  # Make sure thread stops if program stops
+        self._thread.start()
+
+    def stop(self, wait=True):
+        """
+        Stop watching
+
+        :param bool wait: wait for the running operations to finish
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
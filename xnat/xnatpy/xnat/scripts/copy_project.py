@@ -1,35 +1,142 @@
 #!/usr/bin/env python
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import datetime
+import hashlib
+import json
 import os
 import tempfile
+import threading
+import time
 import shutil
 
 import six
 from six.moves import html_parser
 
+try:
+    from html import unescape
+except ImportError:
+    # Python 2, HTMLParser.unescape was removed in Python 3.9
+    unescape = html_parser.HTMLParser().unescape
+
 import xnat
 
 
+class CopyJournal(object):
+    """
+    Durable journal of the objects that have been copied completely, stored
+    as JSON lines (one record per object) so an interrupted copy can resume.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.records = {}
+        self._lock = threading.Lock()
+
+        if path is not None and os.path.exists(path):
+            with open(path) as journal_file:
+                for line in journal_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # Incomplete last line of an interrupted run
+                    self.records[record['object']] = record
+
+    def __contains__(self, key):
+        return key in self.records
+
+    def get(self, key):
+        return self.records.get(key)
+
+    def add(self, key, **kwargs):
+        record = dict(kwargs, object=key, finished=datetime.datetime.now().isoformat())
+
+        with self._lock:
+            self.records[key] = record
+            if self.path is not None:
+                with open(self.path, 'a') as journal_file:
+                    journal_file.write(json.dumps(record) + '\n')
+                    journal_file.flush()
+                    os.fsync(journal_file.fileno())
+
+
 class XNATProjectCopier:
-    def __init__(self, source_xnat, source_project, dest_xnat, dest_project):
+    def __init__(self, source_xnat, source_project, dest_xnat, dest_project,
+                 workers=4, source_concurrency=None, dest_concurrency=None,
+                 journal_path=None, verify=True, stream=True):
         self.source_xnat = source_xnat
         self.source_project = source_project
         self.dest_xnat = dest_xnat
         self.dest_project = dest_project
+        self.workers = workers
+        self.verify = verify
+        self.stream = stream
         self.temp_dir = tempfile.mkdtemp()
         print('Using tmpdir: {}'.format(self.temp_dir))
 
+        # Bound the number of concurrent transfers per server independent of the number of workers
+        self.source_slots = threading.BoundedSemaphore(source_concurrency or workers)
+        self.dest_slots = threading.BoundedSemaphore(dest_concurrency or workers)
+
+        self.journal = CopyJournal(journal_path)
+        if len(self.journal.records) > 0:
+            print('Resuming, journal contains {} copied objects'.format(len(self.journal.records)))
+
+        self._stats_lock = threading.Lock()
+        self.bytes_copied = 0
+        self.objects_copied = 0
+        self.start_time = None
+
     def __del__(self):
         shutil.rmtree(self.temp_dir)
         pass
 
+    def worker_temp_dir(self):
+        """
+        Create a private temporary directory, so concurrent workers do not
+        see each other's downloads
+        """
+        return tempfile.mkdtemp(dir=self.temp_dir)
+
+    def add_stats(self, nbytes):
+        with self._stats_lock:
+            self.bytes_copied += nbytes
+            self.objects_copied += 1
+
+    def report(self):
+        duration = time.time() - self.start_time
+        print('Copied {} objects, {:.1f} MiB in {:.0f} seconds ({:.2f} MiB/s)'.format(
+            self.objects_copied,
+            self.bytes_copied / 1048576.0,
+            duration,
+            self.bytes_copied / 1048576.0 / max(duration, 1e-6)
+        ))
+
+    @staticmethod
+    def resource_manifest(resource):
+        """
+        Get a checksum over the file listing (path, size and digest if the
+        server provides it) of a resource, the total size and the number of
+        the files
+        """
+        result = resource.xnat_session.get_json(resource.uri + '/files')['ResultSet']['Result']
+        entries = sorted((x['URI'].split('/files/', 1)[-1], x.get('Size', ''), x.get('digest', '')) for x in result)
+
+        hasher = hashlib.sha1()
+        for entry in entries:
+            hasher.update('\t'.join(six.text_type(x) for x in entry).encode('utf-8'))
+            hasher.update(b'\n')
+
+        return hasher.hexdigest(), sum(int(x[1] or 0) for x in entries), len(entries)
+
     def copy_fields(self, source, destination, prefix=''):
-        for field_id, value in source.fields.items():
-            # Avoid double escaping of html chars
-            destination.fields[field_id] = html_parser.HTMLParser().unescape(value)
-            print('{prefix}copying field: {}'.format(
-                field_id, prefix=prefix
-            ))
+        # Send all fields in a single request
+        with destination.batch():
+            for field_id, value in source.fields.items():
+                # Avoid double escaping of html chars
+                destination.fields[field_id] = unescape(value)
+                print('{prefix}copying field: {}'.format(
+                    field_id, prefix=prefix
+                ))
 
     def copy_demographics(self, source_subject, dest_subject):
         """
@@ -50,49 +157,112 @@ class XNATProjectCopier:
 
         dest_subject.demographics.mset(demographics_data)
 
-    def copy_resource(self, source_resource, dest_resource, prefix=''):
-        # Download resource content, and upload it again
+    def copy_resource(self, source_resource, dest_resource, prefix='', overwrite=False):
         print('{prefix}copying resource {}'.format(source_resource.label, prefix=prefix))
 
-        source_resource.download_dir(self.temp_dir, verbose=False)
-        for path, dirnames, filenames in os.walk(self.temp_dir):
-            if source_resource.label in dirnames and os.path.split(path)[-1] == 'resources':
-                resource_path = os.path.join(path, source_resource.label, 'files')
-                if os.path.exists(resource_path):
-                    break
-        else:
-            raise ValueError('Could not find directory for downloaded resource!')
+        if self.stream:
+            # Pipe the archive of the source straight into the upload, nothing is stored locally
+            with self.source_slots, self.dest_slots:
+                source_resource.copy_to(dest_resource, overwrite=overwrite)
+            return
+
+        # Download resource content, and upload it again
+        temp_dir = self.worker_temp_dir()
+        try:
+            with self.source_slots:
+                source_resource.download_dir(temp_dir, verbose=False)
+
+            for path, dirnames, filenames in os.walk(temp_dir):
+                if source_resource.label in dirnames and os.path.split(path)[-1] == 'resources':
+                    resource_path = os.path.join(path, source_resource.label, 'files')
+                    if os.path.exists(resource_path):
+                        break
+            else:
+                raise ValueError('Could not find directory for downloaded resource!')
 
-        # Upload entire resource directory
-        dest_resource.upload_dir(resource_path, method='tgz_memory')
+            # Upload entire resource directory
+            with self.dest_slots:
+                dest_resource.upload_dir(resource_path, method='tgz_memory', overwrite=overwrite)
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
 
-    def copy_resources(self, source_object, dest_object, prefix=''):
+    def copy_resources(self, source_object, dest_object, prefix='', imported=False):
+        """
+        Copy the resources of an object. If ``imported`` is set the existing
+        resources on the destination were created by the import of the session,
+        which can change the files (e.g. anonymization of DICOM), so these are
+        only verified by their number of files instead of their checksums.
+        """
         for source_resource in source_object.resources.values():
             resource_id = source_resource.label
-            if resource_id in dest_object.resources:
-                print('{}Skipping resource {}'.format(prefix, resource_id))
-                # Already there, do not copy
+            journal_key = source_resource.uri
+
+            if journal_key in self.journal:
+                print('{}Skipping resource {} (copied before)'.format(prefix, resource_id))
                 continue
 
-            # Create a resources of the same xsitype
-            print('{}Copying resource {}'.format(prefix, resource_id))
-            dest_class = self.dest_xnat.XNAT_CLASS_LOOKUP[source_resource.__xsi_type__]
-            dest_resource = dest_class(
-                parent=dest_object,
-                label=source_resource.label,
-                content=source_resource.content
-            )
+            source_checksum, source_size, source_count = self.resource_manifest(source_resource)
+            verify_count = False
+
+            if resource_id in dest_object.resources:
+                dest_resource = dest_object.resources[resource_id]
+                dest_checksum, _, dest_count = self.resource_manifest(dest_resource)
+
+                if dest_checksum == source_checksum or (imported and dest_count == source_count):
+                    print('{}Skipping resource {} (verified)'.format(prefix, resource_id))
+                    self.journal.add(journal_key, checksum=dest_checksum, bytes=source_size)
+                    continue
+
+                # Partially copied or changed since the last copy, upload again
+                print('{}Resource {} incomplete on destination, copying again'.format(prefix, resource_id))
+                overwrite = True
+                verify_count = imported
+            else:
+                # Create a resources of the same xsitype
+                print('{}Copying resource {}'.format(prefix, resource_id))
+                dest_class = self.dest_xnat.XNAT_CLASS_LOOKUP[source_resource.__xsi_type__]
+                dest_resource = dest_class(
+                    parent=dest_object,
+                    label=source_resource.label,
+                    content=source_resource.content
+                )
+                overwrite = False
 
             # Copy resource file contents
-            if len(source_resource.files) > 0:
-                self.copy_resource(source_resource, dest_resource, prefix=prefix)
+            if source_size > 0 or len(source_resource.files) > 0:
+                self.copy_resource(source_resource, dest_resource, prefix=prefix, overwrite=overwrite)
+                dest_resource.clearcache()
+
+            dest_checksum = source_checksum
+            if self.verify:
+                dest_checksum, _, dest_count = self.resource_manifest(dest_resource)
+                if verify_count:
+                    # Files of the import that were not replaced keep their changed content
+                    if dest_count < source_count:
+                        raise ValueError('Verification of resource {} failed, destination has {} of {} files'.format(
+                            journal_key, dest_count, source_count))
+                elif dest_checksum != source_checksum:
+                    raise ValueError('Verification of resource {} failed, file listing of source and destination differ'.format(journal_key))
+
+            self.journal.add(journal_key, checksum=dest_checksum, bytes=source_size)
+            self.add_stats(source_size)
+
+    @staticmethod
+    def import_key(source_experiment):
+        """
+        Journal key of the import of an experiment, the record lists the
+        scans that were created by the import
+        """
+        return '{}#import'.format(source_experiment.uri)
 
-    def copy_experiment(self, source_experiment, dest_experiment):
+    def copy_experiment(self, source_experiment, dest_experiment, imported_scans=()):
         self.copy_fields(source_experiment, dest_experiment, prefix='    ')
         self.copy_resources(source_experiment, dest_experiment, prefix='    ')
 
         for scan in source_experiment.scans.values():
             print('    copying scan {} / {}'.format(scan.id, scan.type))
+            # Only scans of the import can have changed files, scans created by a previous run are verified by checksum
+            imported = scan.id in imported_scans
             if scan.id not in dest_experiment.scans:
                 dest_class = self.dest_xnat.XNAT_CLASS_LOOKUP.get(scan.__xsi_type__)
                 if dest_class is None:
@@ -104,7 +274,7 @@ class XNATProjectCopier:
             else:
                 dest_scan = dest_experiment.scans[scan.id]
 
-            self.copy_resources(scan, dest_scan, prefix='     ')
+            self.copy_resources(scan, dest_scan, prefix='     ', imported=imported)
 
         for assessor_id, source_assessor in source_experiment.assessors.items():
             # Create an assessor of the same xsitype
@@ -124,20 +294,33 @@ class XNATProjectCopier:
         self.copy_resources(source_subject, dest_subject, prefix='  ')
 
         for source_experiment in source_subject.experiments.values():
+            if source_experiment.uri in self.journal:
+                print('  skipping experiment {} (copied before)'.format(source_experiment.label))
+                continue
+
             print('  copying experiment  {}'.format(source_experiment.label))
 
-            if hasattr(source_experiment, 'scans') and len(source_experiment.scans) > 0:
+            if source_experiment.label in dest_subject.experiments:
+                # Imported by an interrupted run, only complete the missing parts
+                print('    experiment exists, resuming')
+                dest_experiment = dest_subject.experiments[source_experiment.label]
+            elif hasattr(source_experiment, 'scans') and len(source_experiment.scans) > 0:
                 print('    copying data')
-                temp_file = os.path.join(self.temp_dir, source_experiment.label + '.zip')
+                temp_dir = self.worker_temp_dir()
+                temp_file = os.path.join(temp_dir, source_experiment.label + '.zip')
                 try:
-                    source_experiment.download(temp_file, verbose=False)
+                    with self.source_slots:
+                        source_experiment.download(temp_file, verbose=False)
                     try:
-                        dest_experiment = self.dest_xnat.services.import_(
-                            temp_file,
-                            project=self.dest_project.id,
-                            subject=source_experiment.subject.label,
-                            experiment=source_experiment.label
-                        )
+                        with self.dest_slots:
+                            dest_experiment = self.dest_xnat.services.import_(
+                                temp_file,
+                                project=self.dest_project.id,
+                                subject=source_experiment.subject.label,
+                                experiment=source_experiment.label
+                            )
+                        self.journal.add(self.import_key(source_experiment),
+                                         scans=[x.id for x in dest_experiment.scans.values()])
                     except xnat.exceptions.XNATUploadError as exception:
                         print('    [ WARNING] Experiment did not include parsable dicom files, creating empty experiment')
                         if 'not include parseable files' in exception.args[0]:
@@ -150,10 +333,7 @@ class XNATProjectCopier:
                         else:
                             raise
                 finally:
-                    try:
-                        os.remove(temp_file)
-                    except:
-                        pass  # Allowed
+                    shutil.rmtree(temp_dir, ignore_errors=True)
 
             else:
                 print('    creating empty experiment')
@@ -163,24 +343,58 @@ class XNATProjectCopier:
                     continue
 
                 dest_experiment = dest_class(parent=dest_subject, label=source_experiment.label)
-            self.copy_experiment(source_experiment, dest_experiment)
+
+            import_record = self.journal.get(self.import_key(source_experiment))
+            self.copy_experiment(source_experiment, dest_experiment,
+                                 imported_scans=import_record['scans'] if import_record else ())
+            self.journal.add(source_experiment.uri)
+
+    def copy_subject_job(self, source_subject):
+        if source_subject.uri in self.journal:
+            print('skipping subject {} (copied before)'.format(source_subject.label))
+            return
+
+        print('copying subject {}'.format(source_subject.label))
+        if source_subject.label in self.dest_project.subjects:
+            dest_subject = self.dest_project.subjects[source_subject.label]
+        else:
+            dest_subject = self.dest_xnat.classes.SubjectData(parent=self.dest_project, label=source_subject.label)
+        self.copy_subject(source_subject, dest_subject)
+        self.journal.add(source_subject.uri)
+        print('finished subject {}'.format(source_subject.label))
 
     def copy_project(self):
         source_project = self.source_project
         dest_project = self.dest_project
+        self.start_time = time.time()
 
         print('Copying fields')
         self.copy_fields(source_project, dest_project)
         print('Copying resources')
         self.copy_resources(source_project, dest_project, prefix='  ')
 
-        for subject_id, source_subject in self.source_project.subjects.items():
-            print('copying subject {}'.format(source_subject.label))
-            dest_subject = self.dest_xnat.classes.SubjectData(parent=self.dest_project, label=source_subject.label)
-            self.copy_subject(source_subject, dest_subject)
+        # Subjects are independent, so copy them concurrently
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.copy_subject_job, source_subject): source_subject.label
+                       for source_subject in self.source_project.subjects.values()}
+
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as exception:
+                    print('[ERROR] copying subject {} failed: {}'.format(futures[future], exception))
+                    failed.append(futures[future])
+
+        self.report()
+        if failed:
+            print('[ERROR] {} subjects failed, run again with the same journal to resume: {}'.format(
+                len(failed), ', '.join(sorted(failed))))
+
+        return failed
 
     def start(self):
-        self.copy_project()
+        return self.copy_project()
 
 
 def main():
@@ -189,6 +403,12 @@ def main():
     parser.add_argument('--source-project', type=six.text_type, required=True, help='source XNAT project')
     parser.add_argument('--dest-host', type=six.text_type, required=True, help='destination XNAT url')
     parser.add_argument('--dest-project', type=six.text_type, required=True, help='destination XNAT project')
+    parser.add_argument('--workers', type=int, default=4, help='number of subjects to copy concurrently')
+    parser.add_argument('--source-concurrency', type=int, help='maximum concurrent downloads from the source')
+    parser.add_argument('--dest-concurrency', type=int, help='maximum concurrent uploads to the destination')
+    parser.add_argument('--journal', type=six.text_type, help='journal file of copied objects, used to resume')
+    parser.add_argument('--no-verify', action='store_true', help='do not verify the copied resources')
+    parser.add_argument('--no-stream', action='store_true', help='copy resources via a local temporary directory')
     args = parser.parse_args()
 
     with xnat.connect(args.source_host) as source_xnat, xnat.connect(args.dest_host) as dest_xnat:
@@ -200,7 +420,13 @@ def main():
             print(error.message)
         else:
             # Create and start copier
-            copier = XNATProjectCopier(source_xnat, source_project, dest_xnat, dest_project)
+            copier = XNATProjectCopier(source_xnat, source_project, dest_xnat, dest_project,
+                                       workers=args.workers,
+                                       source_concurrency=args.source_concurrency,
+                                       dest_concurrency=args.dest_concurrency,
+                                       journal_path=args.journal,
+                                       verify=not args.no_verify,
+                                       stream=not args.no_stream)
             copier.start()
 
 
@@ -1,10 +1,16 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
 from xml.etree import ElementTree
-import csv
+import threading
+import time
+
 import six
 
+from . import tabular
+from .instrumentation import RequestEvent
+
 xdat_ns = "http://nrg.wustl.edu/security"
 ElementTree.register_namespace("xdat", xdat_ns)
 
@@ -55,6 +61,7 @@ class Query(object):
         self.queried_class = queried_class
         self.xnat_session = xnat_session
         self.constraints = constraints
+        self._query_string = None
 
     @property
     def xsi_type(self):
@@ -68,6 +75,12 @@ class Query(object):
         else:
             constraints = CompoundConstraint(constraints, 'AND')
 
+        # Check the fields against the datatype catalogue if it was loaded (no requests are made)
+        inspect = getattr(self.xnat_session, 'inspect', None)
+        if inspect is not None and inspect.catalogue_complete:
+            for identifier in constraints.identifiers():
+                inspect.validate_field(identifier)
+
         if self.constraints is not None:
             constraints = CompoundConstraint((self.constraints, constraints), 'AND')
 
@@ -102,20 +115,257 @@ class Query(object):
         return bundle
 
     def to_string(self):
-        return ElementTree.tostring(self.to_xml())
-
-    def all(self):
-        result = self.xnat_session.post('/data/search', format='csv', data=self.to_string())
+        # A Query is not changed after creation (filter creates a new Query), so the XML can be reused
+        if self._query_string is None:
+            self._query_string = ElementTree.tostring(self.to_xml())
+        return self._query_string
+
+    def _search(self):
+        return self.xnat_session.post('/data/search', format='csv', data=self.to_string(), stream=True)
+
+    def iterate(self, types=None):
+        """
+        Iterate over the results of the query, the table is parsed while it
+        is being received instead of loading it in memory first.
+
+        :param dict types: mapping of column name to XSD type (e.g. 'xs:integer')
+                           for columns that should be converted, all other
+                           columns are returned as strings
+        :return: generator of dicts (one per result row)
+        """
+        return tabular.iter_csv_response(self._search(), types=types)
+
+    def all(self, types=None, cache=None, state=None):
+        """
+        Get all results of the query
+
+        :param dict types: mapping of column name to XSD type for columns that should be converted
+        :param cache: the :py:class:`QueryCache` to use, by default the query_cache
+                      of the session is used (if set), False to bypass the cache
+        :param state: extra (hashable) part of the cache key, e.g. the last
+                      modification time of the project, to invalidate cached
+                      results when the state changes
+        :return: list of dicts (one per result row)
+        :rtype: list
+        """
+        if cache is None or cache is True:
+            cache = self.xnat_session.query_cache
+
+        if cache is None or cache is False:
+            return list(self.iterate(types=types))
+
+        result = cache.get(self, state=state)
+        if types:
+            return [tabular.convert_row(row, types) for row in result]
+        else:
+            return [dict(row) for row in result]
+
+    def tabulate_pandas(self, types=None):
+        """
+        Get the results of the query as a pandas DataFrame (requires pandas)
+
+        :param dict types: mapping of column name to XSD type for columns that should be converted
+        :rtype: pandas.DataFrame
+        """
+        return tabular.csv_response_to_dataframe(self._search(), types=types)
+
+    def tabulate_arrow(self, types=None):
+        """
+        Get the results of the query as an Arrow Table (requires pyarrow)
+
+        :param dict types: mapping of column name to XSD type for columns that should be converted
+        :rtype: pyarrow.Table
+        """
+        return tabular.csv_response_to_arrow(self._search(), types=types)
+
+
+class QueryCacheEntry(object):
+    __slots__ = ('query_string', 'rows', 'etag', 'last_modified', 'fetched', 'last_used')
+
+    def __init__(self, query_string, rows, etag, last_modified):
+        self.query_string = query_string
+        self.rows = rows
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched = self.last_used = time.time()
+
+
+class QueryCache(object):
+    """
+    Client-side cache for the results of :py:class:`Query` searches, results
+    are keyed by the XML of the query (and an optional state given by the caller).
+    After the ttl expires a result is revalidated: if the server sent an ETag or
+    Last-Modified header, a conditional request is made and the cached rows are
+    reused when the server answers 304 Not Modified, otherwise the search is
+    executed again.
+
+    With background_refresh enabled a thread revalidates the results that have
+    been used recently before they expire, so repeated queries (e.g. for a
+    dashboard) are answered from memory. To use a cache for all queries of a session::
+
+        >>> session.query_cache = QueryCache(session, ttl=300, background_refresh=True)
+
+    :param xnat_session: the session to execute the searches with
+    :param float ttl: time in seconds for which a result is considered valid
+    :param bool background_refresh: refresh results in a background thread
+    :param int max_entries: maximum number of results to keep (least recently used are dropped)
+    :param float max_idle: results not used for this time (in seconds) are not
+                           refreshed in the background anymore, defaults to 10 * ttl
+    """
+    def __init__(self, xnat_session, ttl=300.0, background_refresh=False, max_entries=256, max_idle=None):
+        self.xnat_session = xnat_session
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_idle = max_idle if max_idle is not None else 10 * ttl
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
 
-        # Parse returned table
-        csv_text = str(result.text)
-        csv_dialect = csv.Sniffer().sniff(csv_text)
-        data = list(csv.reader(csv_text.splitlines(), dialect=csv_dialect))
-        header = data[0]
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._stop_event = threading.Event()
+        self._refresh_thread = None
 
-        data = [dict(zip(header, x)) for x in data[1:]]
+        if background_refresh:
+            self.start_background_refresh()
 
-        return data
+    def __repr__(self):
+        return '<QueryCache {} entries (hits: {}, misses: {}, revalidated: {})>'.format(
+            len(self._entries), self.hits, self.misses, self.revalidated)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, query, state=None):
+        """
+        Get the (unconverted) rows for a query, from the cache if still valid
+
+        :param Query query: the query to get the results for
+        :param state: extra (hashable) part of the cache key
+        :return: list of dicts with the result rows, these should not be modified
+        """
+        query_string = query.to_string()
+        key = (query_string, state)
+
+        hit = False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.last_used = time.time()
+                self._entries[key] = self._entries.pop(key)  # Mark as most recently used
+
+                if entry.last_used - entry.fetched < self.ttl:
+                    self.hits += 1
+                    hit = True
+
+        if hit:
+            if self.xnat_session.request_hooks:
+                self.xnat_session._emit_request_event(RequestEvent('POST', '/data/search',
+                                                                   start_time=entry.last_used,
+                                                                   cache='hit'))
+            return entry.rows
+
+        return self._fetch(key, query_string, entry).rows
+
+    def invalidate(self, query=None, state=None):
+        """
+        Remove a query from the cache, or all queries if no query is given
+
+        :param Query query: the query to remove
+        :param state: the state that was used for the query
+        """
+        with self._lock:
+            if query is None:
+                self._entries.clear()
+            else:
+                self._entries.pop((query.to_string(), state), None)
+
+    clear = invalidate
+
+    def _fetch(self, key, query_string, entry=None):
+        headers = {}
+        if entry is not None:
+            if entry.etag is not None:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified is not None:
+                headers['If-Modified-Since'] = entry.last_modified
+
+        response = self.xnat_session.post('/data/search',
+                                          format='csv',
+                                          data=query_string,
+                                          headers=headers or None,
+                                          accepted_status=[200, 201, 304],
+                                          stream=True)
+
+        if response.status_code == 304 and entry is not None:
+            response.close()
+            with self._lock:
+                self.revalidated += 1
+                entry.fetched = time.time()
+            return entry
+
+        new_entry = QueryCacheEntry(query_string=query_string,
+                                    rows=list(tabular.iter_csv_response(response)),
+                                    etag=response.headers.get('ETag'),
+                                    last_modified=response.headers.get('Last-Modified'))
+
+        with self._lock:
+            self.misses += 1
+            if entry is not None:
+                new_entry.last_used = entry.last_used
+            self._entries[key] = new_entry
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        return new_entry
+
+    def start_background_refresh(self):
+        """
+        Start the thread that refreshes recently used results before they expire
+        """
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return
+
+        self._stop_event.clear()
+        self._refresh_thread = threading.Thread(target=self._refresh_thread_run)
+        self._refresh_thread.daemon = True  # Make sure thread stops if program stops
+        self._refresh_thread.start()
+
+    def stop_background_refresh(self):
+        """
+        Stop the background refresh thread
+        """
+        self._stop_event.set()
+
+        if self._refresh_thread is not None:
+            if self._refresh_thread.is_alive() and self._refresh_thread is not threading.current_thread():
+                self._refresh_thread.join(3.0)
+            self._refresh_thread = None
+
+    def _refresh_thread_run(self):
+        # Refresh twice per ttl, so an entry is refreshed before it expires
+        while not self._stop_event.wait(max(self.ttl / 2.0, 1.0)):
+            now = time.time()
+
+            with self._lock:
+                entries = list(self._entries.items())
+
+            for key, entry in entries:
+                if self._stop_event.is_set():
+                    break
+
+                if now - entry.last_used > self.max_idle:
+                    with self._lock:
+                        if self._entries.get(key) is entry:
+                            del self._entries[key]
+                    continue
+
+                if now - entry.fetched >= self.ttl / 2.0:
+                    try:
+                        self._fetch(key, entry.query_string, entry)
+                    except Exception as exception:
+                        self.xnat_session.logger.warning('Could not refresh cached query: {}'.format(exception))
 
 
 class BaseConstraint(six.with_metaclass(ABCMeta, object)):
@@ -123,6 +373,12 @@ class BaseConstraint(six.with_metaclass(ABCMeta, object)):
     def to_xml(self):
         pass
 
+    @abstractmethod
+    def identifiers(self):
+        """
+        Iterate over the identifiers of the search fields used in the constraint
+        """
+
     def to_string(self):
         return ElementTree.tostring(self.to_xml())
 
@@ -145,6 +401,11 @@ class CompoundConstraint(BaseConstraint):
 
         return elem
 
+    def identifiers(self):
+        for constraint in self.constraints:
+            for identifier in constraint.identifiers():
+                yield identifier
+
 
 class Constraint(BaseConstraint):
     def __init__(self, identifier, operator, right_hand):
@@ -157,6 +418,9 @@ class Constraint(BaseConstraint):
                                               self.operator,
                                               self.right_hand)
 
+    def identifiers(self):
+        yield self.identifier
+
     def to_xml(self):
         elem = ElementTree.Element(ElementTree.QName(xdat_ns, "criteria"))
         schema_loc = ElementTree.SubElement(elem, ElementTree.QName(xdat_ns, "schema_field"))
@@ -15,15 +15,94 @@
 
 from __future__ import absolute_import
 from __future__ import unicode_literals
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import mimetypes
 import collections
+import os
+import time
 
-from .prearchive import PrearchiveSession
+import six
+from six.moves.urllib import parse
+
+from .prearchive import PrearchiveSession, PrearchiveWatcher
 from .exceptions import XNATResponseError, XNATValueError
 
 TokenResult = collections.namedtuple('TokenResult', ('alias', 'secret'))
 
 
+class ImportResult(object):
+    """
+    Status and timing of a single archive in a :py:meth:`Services.bulk_import`.
+    The state goes from ``queued`` to ``uploading``, ``processing`` (the
+    session is being built in the prearchive) and ``archiving`` (if
+    auto-archive is enabled) and ends as ``done`` or ``failed``.
+
+    :ivar str path: local path of the archive
+    :ivar dict arguments: the arguments passed to :py:meth:`Services.import_`
+    :ivar prearchive_session: the PrearchiveSession created by the import (if any)
+    :ivar result: the final object, the experiment if it was archived or the
+                  PrearchiveSession otherwise
+    :ivar str error: description of the error if the import failed
+    """
+    def __init__(self, path, arguments):
+        self.path = path
+        self.arguments = arguments
+        self.state = 'queued'
+        self.prearchive_session = None
+        self.result = None
+        self.error = None
+        self.timestamps = {}
+
+    def __repr__(self):
+        return '<ImportResult {} ({})>'.format(self.path, self.state)
+
+    def _mark(self, state):
+        self.state = state
+        self.timestamps[state] = time.time()
+
+    def _duration(self, start, end):
+        if start not in self.timestamps:
+            return None
+
+        # A phase ends when the next phase starts or when the import is done/failed
+        for state in end:
+            if state in self.timestamps:
+                return self.timestamps[state] - self.timestamps[start]
+        return None
+
+    @property
+    def upload_time(self):
+        """
+        Time in seconds it took to upload the archive (and for the import service to respond)
+        """
+        return self._duration('uploading', ('processing', 'done', 'failed'))
+
+    @property
+    def processing_time(self):
+        """
+        Time in seconds it took for the session to become ready in the prearchive
+        """
+        return self._duration('processing', ('archiving', 'done', 'failed'))
+
+    @property
+    def archive_time(self):
+        """
+        Time in seconds it took to archive the session
+        """
+        return self._duration('archiving', ('done', 'failed'))
+
+    @property
+    def total_time(self):
+        """
+        Time in seconds from the start of the upload until the import was done or failed
+        """
+        return self._duration('uploading', ('done', 'failed'))
+
+    @property
+    def success(self):
+        return self.state == 'done'
+
+
 class Services(object):
     """
     The class representing all service functions in XNAT found in the
@@ -120,6 +199,174 @@ class Services(object):
 
         return self.xnat_session.create_object(response_text)
 
+    def bulk_import(self, items, max_workers=4, archive=False, archive_arguments=None,
+                    poll_interval=5.0, timeout=3600.0, **kwargs):
+        """
+        Import many archives into XNAT, the archives are uploaded concurrently
+        and the resulting prearchive sessions are tracked (with a single
+        listing of the prearchive per poll) until they are ready. Optionally
+        the sessions are archived as soon as they are ready.
+
+        The items can be paths or dicts with a ``path`` and the arguments for
+        :py:meth:`import_` for that archive (e.g. ``subject`` and
+        ``experiment``), other keyword arguments are used as defaults for all
+        items::
+
+            >>> results = session.services.bulk_import(
+            ...     [{'path': x, 'subject': subject_label(x)} for x in glob.glob('/incoming/*.zip')],
+            ...     project='myproject', archive=True)
+            >>> failed = [x for x in results if not x.success]
+
+        :param items: iterable with paths or dicts describing the archives
+        :param int max_workers: number of concurrent uploads and archive operations
+        :param bool archive: archive the sessions when they are ready in the prearchive
+        :param dict archive_arguments: arguments for :py:meth:`PrearchiveSession.archive`
+        :param float poll_interval: time in seconds between polls of the prearchive
+        :param float timeout: time in seconds to wait for a session to be ready in the prearchive
+        :param kwargs: default arguments for :py:meth:`import_`
+        :return: the status and timing of every item (in the order of the items)
+        :rtype: list of ImportResult
+        """
+        results = []
+        for item in items:
+            arguments = dict(kwargs)
+            if isinstance(item, six.string_types):
+                path = item
+            else:
+                arguments.update(item)
+                path = arguments.pop('path')
+
+            if not os.path.isfile(path):
+                raise XNATValueError('Cannot import {}, the file does not exist'.format(path))
+
+            results.append(ImportResult(path, arguments))
+
+        archive_arguments = archive_arguments or {}
+        logger = self.xnat_session.logger
+
+        def upload(result):
+            result._mark('uploading')
+            return self.import_(result.path, **result.arguments)
+
+        def archive_session(result):
+            return result.prearchive_session.archive(**archive_arguments)
+
+        def fail(result, error):
+            logger.warning('Import of {} failed: {}'.format(result.path, error))
+            result.error = error
+            result._mark('failed')
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(upload, x): x for x in results}
+            processing = {}
+            last_poll = None
+
+            while futures or processing:
+                if processing:
+                    wait_time = max(0.0, poll_interval - (time.time() - (last_poll or 0.0)))
+                else:
+                    wait_time = None
+
+                if futures:
+                    done, _ = wait(list(futures), timeout=wait_time, return_when=FIRST_COMPLETED)
+                else:
+                    done = ()
+                    time.sleep(wait_time)
+
+                for future in done:
+                    result = futures.pop(future)
+                    exception = future.exception()
+                    if exception is not None:
+                        fail(result, str(exception))
+                    elif result.state == 'uploading':
+                        value = future.result()
+                        if isinstance(value, PrearchiveSession):
+                            result.prearchive_session = value
+                            result._mark('processing')
+                            processing[value.uri] = result
+                        else:
+                            # The import service archived the session directly
+                            result.result = value
+                            result._mark('done')
+                    else:
+                        result.result = future.result()
+                        result._mark('done')
+
+                if not processing or time.time() - (last_poll or 0.0) < poll_interval:
+                    continue
+
+                # Check all sessions that are being processed with a single listing
+                rows = self.xnat_session.get_json('/data/prearchive/projects')['ResultSet']['Result']
+                listing = {self._prearchive_key(x['url']): x for x in rows}
+                last_poll = time.time()
+
+                for uri, result in list(processing.items()):
+                    row = listing.get(self._prearchive_key(uri))
+                    if row is None:
+                        # Not in the listing, make sure the session really left the prearchive
+                        row = self._prearchive_row(uri)
+
+                    if row is None:
+                        # The server moved the session out of the prearchive (e.g. auto-archive)
+                        del processing[uri]
+                        experiment = self._find_archived_experiment(result)
+                        if experiment is None:
+                            fail(result, 'Prearchive session {} disappeared, but was not found in the archive'.format(uri))
+                        else:
+                            result.result = experiment
+                            result._mark('done')
+                    elif row['status'] in ('ERROR', 'CONFLICT'):
+                        del processing[uri]
+                        fail(result, 'Prearchive session {} has status {}'.format(uri, row['status']))
+                    elif not PrearchiveWatcher._is_busy(row['status']):
+                        del processing[uri]
+                        result.prearchive_session = PrearchiveSession(uri, self.xnat_session, datafields=row)
+                        if archive:
+                            result._mark('archiving')
+                            futures[executor.submit(archive_session, result)] = result
+                        else:
+                            result.result = result.prearchive_session
+                            result._mark('done')
+                    elif last_poll - result.timestamps['processing'] > timeout:
+                        del processing[uri]
+                        fail(result, 'Timed out waiting for prearchive session {} (status {})'.format(uri, row['status']))
+
+        logger.info('Imported {} of {} archives'.format(sum(x.success for x in results), len(results)))
+        return results
+
+    @staticmethod
+    def _prearchive_key(url):
+        # The url can be relative or absolute and with or without /data, so use the project, timestamp and name
+        path = parse.urlparse(url).path
+        return tuple(path.split('/prearchive/projects/', 1)[-1].strip('/').split('/')[:3])
+
+    def _prearchive_row(self, uri):
+        try:
+            return self.xnat_session.get_json(uri)['ResultSet']['Result'][0]
+        except (XNATResponseError, KeyError, IndexError):
+            return None
+
+    def _find_archived_experiment(self, result):
+        """
+        Find the experiment of an imported session that left the prearchive,
+        based on the project and experiment label of the import (or the
+        project and name of the prearchive session)
+        """
+        project, _, name = self._prearchive_key(result.prearchive_session.uri)
+        project = result.arguments.get('project') or project
+        label = result.arguments.get('experiment') or name
+
+        try:
+            rows = self.xnat_session.get_json('/data/projects/{}/experiments'.format(project),
+                                              query={'label': label, 'columns': 'ID,label'})['ResultSet']['Result']
+        except (XNATResponseError, KeyError):
+            return None
+
+        for row in rows:
+            if row.get('label') == label:
+                return self.xnat_session.create_object('/data/experiments/{}'.format(row['ID']))
+        return None
+
     def issue_token(self, user=None):
         """
         Issue a login token, by default for the current logged in user. If
@@ -19,21 +19,28 @@ import datetime
 import io
 import netrc
 import os
+import random
 import re
 import threading
+import time
+import timeit
 
 from progressbar import AdaptiveETA, AdaptiveTransferSpeed, Bar, BouncingBar, \
     DataSize, Percentage, ProgressBar, Timer, UnknownLength
 import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 import six
 from six.moves.urllib import parse
 
 from . import exceptions
 from .core import XNATListing, caching
 from .inspect import Inspect
+from .instrumentation import RequestEvent
 from .prearchive import Prearchive
 from .users import Users
 from .services import Services
+from .utils import AdaptiveChunkSize, BandwidthLimiter, ThrottledCallback
 from .exceptions import XNATValueError
 
 try:
@@ -42,6 +49,55 @@ except NameError:
     FILE_TYPES = io.IOBase
 
 
+# Methods that can safely be repeated by the connection pool after a transient failure. PUT is
+# idempotent, but its body might be a stream that cannot be rewound, uploads are retried by
+# XNATSession.upload instead
+RETRY_METHODS = frozenset(['HEAD', 'GET', 'DELETE', 'OPTIONS', 'TRACE'])
+
+# Status codes for which the connection pool retries idempotent requests
+TRANSIENT_STATUS = (429, 502, 503, 504)
+
+
+def configure_interface(interface, pool_connections=10, pool_maxsize=10, max_retries=3, backoff_factor=0.5):
+    """
+    Configure the connection pooling and retries of a requests session. The
+    pool is shared by all threads using the session, so the ``pool_maxsize``
+    should be at least the number of threads that use the session
+    concurrently, otherwise extra connections are opened and discarded
+    for every request.
+
+    Requests without a body (GET, HEAD, DELETE) are retried with an exponential
+    backoff on connection errors and on transient server errors (429, 502,
+    503, 504). PUT and POST requests are only retried when the connection
+    could not be established, retrying uploads is left to
+    :py:meth:`XNATSession.upload <xnat.session.XNATSession.upload>`.
+
+    :param requests.Session interface: the session to configure
+    :param int pool_connections: number of hosts to keep a connection pool for
+    :param int pool_maxsize: maximum number of connections kept alive per host
+    :param int max_retries: maximum number of retries, 0 to disable retrying
+    :param float backoff_factor: the n-th retry waits backoff_factor * 2 ** (n - 1) seconds
+    """
+    retry_options = dict(total=max_retries,
+                         connect=max_retries,
+                         read=max_retries,
+                         status=max_retries,
+                         backoff_factor=backoff_factor,
+                         status_forcelist=TRANSIENT_STATUS,
+                         raise_on_status=False)  # The final response is checked by the XNATSession
+    try:
+        retries = Retry(allowed_methods=RETRY_METHODS, **retry_options)
+    except TypeError:
+        # urllib3 < 1.26
+        retries = Retry(method_whitelist=RETRY_METHODS, **retry_options)
+
+    adapter = HTTPAdapter(pool_connections=pool_connections,
+                          pool_maxsize=pool_maxsize,
+                          max_retries=retries)
+    interface.mount('https://', adapter)
+    interface.mount('http://', adapter)
+
+
 class XNATSession(object):
     """
     The main XNATSession session class. It keeps a connection to XNATSession alive and
@@ -77,10 +133,17 @@ class XNATSession(object):
               Turning off caching complete can be done by setting
               :py:attr:`XNATSession.caching <xnat.session.XNATSession.caching>`.
 
+    .. note:: The session can be shared by multiple threads, the connection pool size can
+              be configured using :py:func:`xnat.connect <xnat.connect>` or
+              :py:func:`configure_interface <xnat.session.configure_interface>`.
+
     .. warning:: You should NOT try use this class directly, it should only
                  be created by :py:func:`xnat.connect <xnat.connect>`.
     """
 
+    # Status codes for which a failed upload is considered transient
+    RETRY_STATUS = (408, 429, 500, 502, 503, 504)
+
     def __init__(self, server, logger, interface=None, user=None,
                  password=None, keepalive=None, debug=False,
                  original_uri=None, logged_in_user=None):
@@ -107,6 +170,9 @@ class XNATSession(object):
         self.logger = logger
         self.inspect = Inspect(self)
         self.request_timeout = None
+        self.query_cache = None  # Optional search.QueryCache used for all queries
+        self.request_hooks = []  # Callables receiving an instrumentation.RequestEvent for every request
+        self._write_batches = threading.local()  # The active core.WriteBatch per thread
 
         # Accepted status
         self.accepted_status_get = [200]
@@ -173,6 +239,7 @@ class XNATSession(object):
                     raise ValueError('Could not retrieve login info for "{}" from the .netrc file!'.format(server))
 
             self._interface = requests.Session()
+            configure_interface(self._interface)
             if (user is not None) or (password is not None):
                 self._interface.auth = (user, password)
 
@@ -193,6 +260,9 @@ class XNATSession(object):
                 self._keepalive_thread.join(3.0)
             self._keepalive_thread = None
 
+        if self.query_cache is not None:
+            self.query_cache.stop_background_refresh()
+
         # Kill the session
         if self._server is not None and self._interface is not None:
             self.delete('/data/JSESSION', headers={'Connection': 'close'})
@@ -302,17 +372,84 @@ class XNATSession(object):
         expiration_interval = int(match.group('interval')) / 1000
         return session_timestamp, expiration_interval
 
-    def _check_response(self, response, accepted_status=None, uri=None):
+    def _check_response(self, response, accepted_status=None, uri=None, check_content=True):
         if self.debug:
             self.logger.debug('Received response with status code: {}'.format(response.status_code))
 
         if not self.skip_response_check:
             if accepted_status is None:
                 accepted_status = [200, 201, 202, 203, 204, 205, 206]  # All successful responses of HTML
-            if response.status_code not in accepted_status or (not self.skip_response_content_check and response.text.startswith(('<!DOCTYPE', '<html>'))):
+            # The content of streamed responses is not read here, the consumer should check it
+            check_content = check_content and not self.skip_response_content_check
+            if response.status_code not in accepted_status or (check_content and response.text.startswith(('<!DOCTYPE', '<html>'))):
                 raise exceptions.XNATResponseError('Invalid response from XNATSession for url {} (status {}):\n{}'.format(uri, response.status_code, response.text))
 
-    def get(self, path, format=None, query=None, accepted_status=None, timeout=None, headers=None):
+    def add_request_hook(self, hook):
+        """
+        Add a hook that is called with a :py:class:`RequestEvent <xnat.instrumentation.RequestEvent>`
+        after every request made by this session, for example a
+        :py:class:`RequestStatistics <xnat.instrumentation.RequestStatistics>` object.
+        Hooks can be called from multiple threads and should be fast, as they
+        are called in the thread making the request.
+
+        :param hook: callable accepting a RequestEvent
+        """
+        if hook not in self.request_hooks:
+            self.request_hooks.append(hook)
+
+    def remove_request_hook(self, hook):
+        """
+        Remove a hook added by :py:meth:`add_request_hook`
+
+        :param hook: the hook to remove
+        """
+        if hook in self.request_hooks:
+            self.request_hooks.remove(hook)
+
+    def _emit_request_event(self, event):
+        for hook in list(self.request_hooks):
+            try:
+                hook(event)
+            except Exception as exception:
+                self.logger.warning('Request hook {} failed: {}'.format(hook, exception))
+
+    def _request(self, method, uri, stream=False, instrument=True, **kwargs):
+        """
+        Perform a request using the interface and report it to the request hooks
+        """
+        start_time = time.time()
+        start = timeit.default_timer()
+        try:
+            response = self.interface.request(method, uri, stream=stream, **kwargs)
+        except requests.exceptions.RequestException as exception:
+            if instrument and self.request_hooks:
+                self._emit_request_event(RequestEvent(method, uri,
+                                                      start_time=start_time,
+                                                      latency=timeit.default_timer() - start,
+                                                      error='{}: {}'.format(type(exception).__name__, exception)))
+
+            if isinstance(exception, requests.exceptions.SSLError):
+                raise exceptions.XNATSSLError('Encountered a problem with the SSL connection, are you sure the server is offering https?')
+            raise
+
+        if instrument and self.request_hooks:
+            if stream:
+                # The body is not read yet, use the announced size
+                nbytes = response.headers.get('Content-Length')
+                nbytes = int(nbytes) if nbytes is not None and nbytes.isdigit() else None
+            else:
+                nbytes = len(response.content)
+
+            self._emit_request_event(RequestEvent(method, uri,
+                                                  status=response.status_code,
+                                                  nbytes=nbytes,
+                                                  start_time=start_time,
+                                                  latency=timeit.default_timer() - start,
+                                                  cache='revalidated' if response.status_code == 304 else None))
+
+        return response
+
+    def get(self, path, format=None, query=None, accepted_status=None, timeout=None, headers=None, stream=False):
         """
         Retrieve the content of a given REST directory.
 
@@ -324,6 +461,7 @@ class XNATSession(object):
         :param timeout: timeout in seconds, float or (connection timeout, read timeout)
         :type timeout: float or tuple
         :param dict headers: the HTTP headers to include
+        :param bool stream: do not download the response content immediately
         :returns: the requests reponse
         :rtype: requests.Response
         """
@@ -333,11 +471,8 @@ class XNATSession(object):
 
         self.logger.debug('GET URI {}'.format(uri))
 
-        try:
-            response = self.interface.get(uri, timeout=timeout, headers=headers)
-        except requests.exceptions.SSLError:
-            raise exceptions.XNATSSLError('Encountered a problem with the SSL connection, are you sure the server is offering https?')
-        self._check_response(response, accepted_status=accepted_status, uri=uri)  # Allow OK, as we want to get data
+        response = self._request('GET', uri, timeout=timeout, headers=headers, stream=stream)
+        self._check_response(response, accepted_status=accepted_status, uri=uri, check_content=not stream)  # Allow OK, as we want to get data
         return response
 
     def head(self, path, accepted_status=None, allow_redirects=False, timeout=None, headers=None):
@@ -360,14 +495,12 @@ class XNATSession(object):
 
         self.logger.debug('GET URI {}'.format(uri))
 
-        try:
-            response = self.interface.head(uri, allow_redirects=allow_redirects, timeout=timeout, headers=headers)
-        except requests.exceptions.SSLError:
-            raise exceptions.XNATSSLError('Encountered a problem with the SSL connection, are you sure the server is offering https?')
+        response = self._request('HEAD', uri, allow_redirects=allow_redirects, timeout=timeout, headers=headers)
         self._check_response(response, accepted_status=accepted_status, uri=uri)  # Allow OK, as we want to get data
         return response
 
-    def post(self, path, data=None, json=None, format=None, query=None, accepted_status=None, timeout=None, headers=None):
+    def post(self, path, data=None, json=None, format=None, query=None, accepted_status=None, timeout=None, headers=None,
+             stream=False):
         """
         Post data to a given REST directory.
 
@@ -381,6 +514,7 @@ class XNATSession(object):
         :param timeout: timeout in seconds, float or (connection timeout, read timeout)
         :type timeout: float or tuple
         :param dict headers: the HTTP headers to include
+        :param bool stream: do not download the response content immediately
         :returns: the requests reponse
         :rtype: requests.Response
         """
@@ -392,11 +526,8 @@ class XNATSession(object):
         if self.debug:
             self.logger.debug('POST DATA {}'.format(data))
 
-        try:
-            response = self._interface.post(uri, data=data, json=json, timeout=timeout, headers=headers)
-        except requests.exceptions.SSLError:
-            raise exceptions.XNATSSLError('Encountered a problem with the SSL connection, are you sure the server is offering https?')
-        self._check_response(response, accepted_status=accepted_status, uri=uri)
+        response = self._request('POST', uri, data=data, json=json, timeout=timeout, headers=headers, stream=stream)
+        self._check_response(response, accepted_status=accepted_status, uri=uri, check_content=not stream)
         return response
 
     def put(self, path, data=None, files=None, json=None, format=None, query=None, accepted_status=None, timeout=None, headers=None):
@@ -430,10 +561,7 @@ class XNATSession(object):
             self.logger.debug('PUT DATA {}'.format(data))
             self.logger.debug('PUT FILES {}'.format(data))
 
-        try:
-            response = self._interface.put(uri, data=data, files=files, json=json, timeout=timeout, headers=headers)
-        except requests.exceptions.SSLError:
-            raise exceptions.XNATSSLError('Encountered a problem with the SSL connection, are you sure the server is offering https?')
+        response = self._request('PUT', uri, data=data, files=files, json=json, timeout=timeout, headers=headers)
         self._check_response(response, accepted_status=accepted_status, uri=uri)  # Allow created OK or Create status (OK if already exists)
         return response
 
@@ -459,10 +587,7 @@ class XNATSession(object):
         if self.debug:
             self.logger.debug('DELETE HEADERS {}'.format(headers))
 
-        try:
-            response = self.interface.delete(uri, headers=headers, timeout=timeout)
-        except requests.exceptions.SSLError:
-            raise exceptions.XNATSSLError('Encountered a problem with the SSL connection, are you sure the server is offering https?')
+        response = self._request('DELETE', uri, headers=headers, timeout=timeout)
         self._check_response(response, accepted_status=accepted_status, uri=uri)
         return response
 
@@ -525,7 +650,8 @@ class XNATSession(object):
         except ValueError:
             raise ValueError('Could not decode JSON from [{}] {}'.format(uri, response.text))
 
-    def download_stream(self, uri, target_stream, format=None, verbose=False, chunk_size=524288, update_func=None, timeout=None):
+    def download_stream(self, uri, target_stream, format=None, verbose=False, chunk_size=524288, update_func=None,
+                        timeout=None, adaptive_chunk_size=True, progress_interval=0.1, max_bandwidth=None):
         """
         Download the given ``uri`` to the given ``target_stream``.
 
@@ -536,10 +662,11 @@ class XNATSession(object):
         :param bool verbose:       If ``True``, and an ``update_func`` is not
                                    specified, a progress bar is shown on
                                    stdout.
-        :param int chunk_size:     Download this many bytes at a time
-        :param func update_func:   If provided, will be called every
-                                   ``chunk_size`` bytes. Must accept three
-                                   parameters:
+        :param int chunk_size:     Download this many bytes at a time (the
+                                   initial size if ``adaptive_chunk_size`` is set)
+        :param func update_func:   If provided, will be called at most every
+                                   ``progress_interval`` seconds. Must accept
+                                   three parameters:
 
                                      - the number of bytes downloaded so far
                                      - the total number of bytse to be
@@ -549,15 +676,56 @@ class XNATSession(object):
                                        download has completed (or failed)
         :param timeout: timeout in seconds, float or (connection timeout, read timeout)
         :type timeout: float or tuple
+        :param bool adaptive_chunk_size: adapt the chunk size to the measured
+                                         throughput, see :py:class:`xnat.utils.AdaptiveChunkSize`
+        :param float progress_interval: minimum time in seconds between calls of
+                                        the ``update_func``, 0 to call it for every chunk
+        :param float max_bandwidth: limit the download rate to this many bytes per second
+        """
+        def write(chunk):
+            target_stream.write(chunk)
+            return len(chunk)
+
+        self._download(uri, write, format=format, verbose=verbose, chunk_size=chunk_size, update_func=update_func,
+                       timeout=timeout, adaptive_chunk_size=adaptive_chunk_size,
+                       progress_interval=progress_interval, max_bandwidth=max_bandwidth)
+
+    def download_into(self, uri, buffer, format=None, verbose=False, chunk_size=524288, update_func=None,
+                      timeout=None, adaptive_chunk_size=True, progress_interval=0.1, max_bandwidth=None):
+        """
+        Download the given ``uri`` directly into a preallocated writable
+        buffer (e.g. a ``bytearray``, ``mmap.mmap`` or numpy array). The data
+        is read into the buffer with ``readinto``, so no intermediate chunks
+        are created. The arguments are the same as for :py:meth:`download_stream`.
+
+        :param str uri: Path of the uri to retrieve.
+        :param buffer: writable object supporting the buffer protocol
+        :return: number of bytes written to the buffer
+        :rtype: int
+        :raises XNATIOError: if the buffer is too small for the data
         """
+        view = memoryview(buffer)
+        if view.format != 'B' or view.ndim != 1:
+            view = view.cast('B')
 
+        return self._download(uri, None, buffer=view, format=format, verbose=verbose, chunk_size=chunk_size,
+                              update_func=update_func, timeout=timeout, adaptive_chunk_size=adaptive_chunk_size,
+                              progress_interval=progress_interval, max_bandwidth=max_bandwidth)
+
+    def _download(self, uri, write, buffer=None, format=None, verbose=False, chunk_size=524288, update_func=None,
+                  timeout=None, adaptive_chunk_size=True, progress_interval=0.1, max_bandwidth=None):
         uri = self._format_uri(uri, format=format)
         self.logger.debug('DOWNLOAD STREAM {}'.format(uri))
 
-        # Stream the get and write to file
-        response = self.interface.get(uri, stream=True, timeout=timeout)
+        # Stream the get and write to file, the request is reported when the download is finished
+        start_time = time.time()
+        start = timeit.default_timer()
+        response = self._request('GET', uri, stream=True, timeout=timeout, instrument=False)
 
         if response.status_code not in self.accepted_status_get:
+            if self.request_hooks:
+                self._emit_request_event(RequestEvent('GET', uri, status=response.status_code, start_time=start_time,
+                                                      latency=timeit.default_timer() - start))
             raise exceptions.XNATResponseError('Invalid response from XNATSession for url {} (status {}):\n{}'.format(uri, response.status_code, response.text))
 
         # Get the content length if available
@@ -566,28 +734,81 @@ class XNATSession(object):
         if isinstance(content_length, six.string_types):
             content_length = int(content_length)
 
+        if buffer is not None and content_length is not None and content_length > len(buffer):
+            response.close()
+            raise exceptions.XNATIOError('Buffer of {} bytes is too small for {} ({} bytes)'.format(len(buffer), uri, content_length))
+
         if verbose and update_func is None:
             update_func = default_update_func(content_length)
         if update_func is None:
             update_func = lambda *args: None
+        elif progress_interval:
+            # Progress bars write to the terminal on every call, which is costly on fast links
+            update_func = ThrottledCallback(update_func, interval=progress_interval)
 
         if verbose:
             self.logger.info('Downloading {}:'.format(uri))
 
+        if adaptive_chunk_size:
+            chunk_size = AdaptiveChunkSize(initial=chunk_size)
+        limiter = BandwidthLimiter(max_bandwidth) if max_bandwidth else None
+
+        # Read from the raw stream, this allows changing the chunk size during the download
+        raw = response.raw
+        raw.decode_content = True
+
         bytes_read = 0
         try:
             update_func(0, content_length, False)
-            for chunk in response.iter_content(chunk_size):
-                if bytes_read == 0 and chunk[0] == '<' and chunk.startswith(('<!DOCTYPE', '<html>')):
-                    raise ValueError('Invalid response from XNATSession (status {}):\n{}'.format(response.status_code, chunk))
+            while True:
+                size = int(chunk_size)
+                read_start = timeit.default_timer()
+                if buffer is not None:
+                    if bytes_read == len(buffer):
+                        if raw.read(1):
+                            raise exceptions.XNATIOError('Buffer of {} bytes is too small for {}'.format(len(buffer), uri))
+                        break
+                    nbytes = raw.readinto(buffer[bytes_read:bytes_read + size])
+                    chunk = buffer[bytes_read:bytes_read + nbytes]
+                else:
+                    chunk = raw.read(size)
+                    nbytes = len(chunk)
+
+                if not nbytes:
+                    break
+
+                # Only the start of the response can reveal an error page instead of the data
+                if bytes_read == 0 and bytes(chunk[:9]).startswith((b'<!DOCTYPE', b'<html>')):
+                    raise exceptions.XNATResponseError('Invalid response from XNATSession (status {}):\n{}'.format(
+                        response.status_code, bytes(chunk[:1024]).decode('utf-8', 'replace')))
 
-                bytes_read += len(chunk)
-                target_stream.write(chunk)
+                if adaptive_chunk_size:
+                    chunk_size.update(nbytes, timeit.default_timer() - read_start)
+
+                if write is not None:
+                    write(chunk)
+                bytes_read += nbytes
+
+                if limiter is not None:
+                    limiter.throttle(nbytes)
 
                 update_func(bytes_read, content_length, False)
+        except BaseException:
+            # A completely read response releases its connection to the pool, otherwise it cannot be reused
+            response.close()
+            raise
         finally:
             update_func(bytes_read, content_length, True)
 
+            if self.request_hooks:
+                self._emit_request_event(RequestEvent('GET', uri,
+                                                      status=response.status_code,
+                                                      nbytes=bytes_read,
+                                                      start_time=start_time,
+                                                      latency=timeit.default_timer() - start))
+
+        return bytes_read
+
     def download(self, uri, target, format=None, verbose=True, timeout=None):
         """
         Download uri to a target file
@@ -604,15 +825,27 @@ class XNATSession(object):
         """
         self.download(uri, target, format='zip', verbose=verbose, timeout=timeout)
 
-    def upload(self, uri, file_, retries=1, query=None, content_type=None, method='put', overwrite=False, timeout=None):
+    def upload(self, uri, file_, retries=1, query=None, content_type=None, method='put', overwrite=False, timeout=None,
+               backoff_factor=0.5, max_backoff=30.0):
         """
         Upload data or a file to XNAT
 
+        Transient failures (connection errors, time-outs and the status codes
+        in ``RETRY_STATUS``) are retried with an exponential backoff of
+        ``backoff_factor * 2 ** (attempt - 1)`` seconds (capped at
+        ``max_backoff``). Other failures are raised immediately. A ``post``
+        is never retried, as it is not idempotent. A failed attempt might
+        still have stored (part of) the data on the server, without
+        ``overwrite`` a retry then fails with a conflict instead of replacing
+        the existing data.
+
         :param str uri: uri to upload to
-        :param file_: the file handle, path to a file or a string of data
-                      (which should not be the path to an existing file!)
-        :param int retries: amount of times xnatpy should retry in case of
-                            failure
+        :param file_: the file handle, path to a file, a string of data
+                      (which should not be the path to an existing file!) or
+                      an iterable yielding the data (which is sent using chunked
+                      transfer encoding and cannot be retried)
+        :param int retries: amount of times xnatpy should try the upload
+                            before giving up
         :param dict query: extra query string content
         :param content_type: the content type of the file, if not given it will
                              default to ``application/octet-stream``
@@ -620,60 +853,113 @@ class XNATSession(object):
         :param bool overwrite: indicate if previous data should be overwritten
         :param timeout: timeout in seconds, float or (connection timeout, read timeout)
         :type timeout: float or tuple
-        :return:
+        :param float backoff_factor: base of the exponential backoff between retries in seconds
+        :param float max_backoff: maximum time to wait between retries in seconds
+        :return: the requests response
+        :raises XNATUploadError: if the upload failed
         """
+        if method not in ('put', 'post'):
+            raise ValueError('Invalid upload method "{}" should be either put or post.'.format(method))
+
+        query = dict(query or {})
         if overwrite:
-            if query is None:
-                query = {}
             query['overwrite'] = 'true'
 
-        uri = self._format_uri(uri, query=query)
-        self.logger.debug('UPLOAD URI {}'.format(uri))
-        attempt = 0
+        # Set the content type header
+        if content_type is None:
+            headers = {'Content-Type': 'application/octet-stream'}
+        else:
+            headers = {'Content-Type': content_type}
+
         file_handle = None
         opened_file = False
+        response = None
+        error = None
 
         try:
-            while attempt < retries:
-                if isinstance(file_, FILE_TYPES):
-                    # File is open file handle, seek to 0
-                    file_handle = file_
-                    file_.seek(0)
-                # Make sure conditions are valid for os.path.isfile to function
-                elif isinstance(file_, six.string_types) and '\0' not in file_ and os.path.isfile(file_):
-                    # File is str path to file
-                    file_handle = open(file_, 'rb')
-                    opened_file = True
+            if isinstance(file_, FILE_TYPES):
+                # File is open file handle, rewind it for every attempt
+                file_handle = file_
+            # Make sure conditions are valid for os.path.isfile to function
+            elif isinstance(file_, six.string_types) and '\0' not in file_ and os.path.isfile(file_):
+                # File is str path to file, open it only once
+                file_handle = open(file_, 'rb')
+                opened_file = True
+            elif not isinstance(file_, (six.binary_type, six.text_type)) and retries > 1:
+                # Data from a generator/iterable can only be sent once
+                self.logger.debug('Upload data is a stream that cannot be rewound, not retrying')
+                retries = 1
+
+            if method == 'post' and retries > 1:
+                self.logger.debug('Upload is a post, which is not idempotent, not retrying')
+                retries = 1
+
+            for attempt in range(1, retries + 1):
+                if attempt > 1:
+                    delay = min(max_backoff, backoff_factor * 2 ** (attempt - 2))
+                    # Add jitter so concurrent uploads do not retry in lockstep
+                    delay *= 0.5 + random.random() / 2
+                    self.logger.warning('Upload attempt {} of {} failed ({}), retrying in {:.1f} seconds'.format(
+                        attempt - 1, retries, error, delay
+                    ))
+                    time.sleep(delay)
+
+                request_uri = self._format_uri(uri, query=query)
+                self.logger.debug('UPLOAD URI {}'.format(request_uri))
+
+                if file_handle is not None:
+                    file_handle.seek(0)
+                    data = file_handle
                 else:
                     # File is data to upload
-                    file_handle = file_
+                    data = file_
 
-                attempt += 1
+                try:
+                    response = self._request(method.upper(), request_uri, data=data, headers=headers, timeout=timeout)
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as exception:
+                    error = exception
+                    continue
 
                 try:
-                    # Set the content type header
-                    if content_type is None:
-                        headers = {'Content-Type': 'application/octet-stream'}
-                    else:
-                        headers = {'Content-Type': content_type}
-
-                    if method == 'put':
-                        response = self.interface.put(uri, data=file_handle, headers=headers, timeout=timeout)
-                    elif method == 'post':
-                        response = self.interface.post(uri, data=file_handle, headers=headers, timeout=timeout)
-                    else:
-                        raise ValueError('Invalid upload method "{}" should be either put or post.'.format(method))
-                    self._check_response(response)
+                    self._check_response(response, uri=request_uri)
                     return response
                 except exceptions.XNATResponseError:
-                    pass
+                    if response.status_code == 409 and attempt > 1:
+                        raise exceptions.XNATUploadError('Upload failed with a conflict after a failed attempt, the data '
+                                                         'might have been stored by that attempt (use overwrite=True to '
+                                                         'replace it)! Response text {}'.format(response.text))
+                    if response.status_code not in self.RETRY_STATUS:
+                        raise exceptions.XNATUploadError('Upload failed! Status code {}, response text {}'.format(response.status_code, response.text))
+                    error = 'status {}'.format(response.status_code)
         finally:
             if opened_file:
                 file_handle.close()
 
         # We didn't return correctly, so we have an error
+        if response is None:
+            raise exceptions.XNATUploadError('Upload failed after {} attempts! Last error: {}'.format(retries, error))
         raise exceptions.XNATUploadError('Upload failed after {} attempts! Status code {}, response text {}'.format(retries, response.status_code, response.text))
 
+    def async_session(self, max_concurrency=16, max_connections=None, timeout=None, http2=False):
+        """
+        Create an asynchronous (asyncio) session that shares the credentials,
+        data model and object cache of this session. This requires Python 3
+        and the optional httpx package, see :py:mod:`xnat.asyncsession`.
+
+        :param int max_concurrency: maximum number of requests in flight
+        :param int max_connections: size of the connection pool, defaults to max_concurrency
+        :param timeout: timeout in seconds, defaults to the request_timeout of this session
+        :param bool http2: use HTTP/2 if the server supports it (requires httpx[http2])
+        :return: the asynchronous session, to be used as an async context manager
+        :rtype: xnat.asyncsession.AsyncXNATSession
+        """
+        from .asyncsession import AsyncXNATSession
+        return AsyncXNATSession(self,
+                                max_concurrency=max_concurrency,
+                                max_connections=max_connections,
+                                timeout=timeout,
+                                http2=http2)
+
     @property
     def scanners(self):
         """
@@ -702,7 +988,9 @@ class XNATSession(object):
             return self.get_json('/xapi/siteConfig/buildInfo')['version']
 
     def create_object(self, uri, type_=None, fieldname=None, **kwargs):
-        if (uri, fieldname) not in self._cache['__objects__']:
+        objects = self._cache['__objects__']
+        obj = objects.get((uri, fieldname))
+        if obj is None:
             if type_ is None:
                 if self.xnat_session.debug:
                     self.logger.debug('Type unknown, fetching data to get type')
@@ -734,11 +1022,12 @@ class XNATSession(object):
 
             obj = cls(uri, self, datafields=datafields, fieldname=fieldname, overwrites=overwrites, **kwargs)
 
-            self._cache['__objects__'][uri, fieldname] = obj
+            # If another thread created the same object in the meantime, use that one
+            obj = objects.setdefault((uri, fieldname), obj)
         elif self.debug:
             self.logger.debug('Fetching object {} from cache'.format(uri))
 
-        return self._cache['__objects__'][uri, fieldname]
+        return obj
 
     @property
     @caching
@@ -812,8 +1101,11 @@ class XNATSession(object):
         """
         Clear the cache of the listings in the Session object
         """
-        self._cache.clear()
-        self._cache['__objects__'] = {}
+        # Replace the cache in one step, so other threads never see it without '__objects__'
+        self._cache = {'__objects__': {}}
+
+        if self.query_cache is not None:
+            self.query_cache.clear()
 
 
 def default_update_func(total):
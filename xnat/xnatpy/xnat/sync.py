@@ -0,0 +1,429 @@
+# Copyright 2011-2015 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Incremental mirror of an XNAT project on local disk. The files that were
+downloaded are recorded in a SQLite manifest (uri, size, digest and
+last-modified), on the next sync the server listings are compared with the
+manifest and only new or changed files are downloaded. The local files are
+laid out as::
+
+    {target_dir}/{subject}/{experiment}/resources/{resource}/{path}
+    {target_dir}/{subject}/{experiment}/scans/{scan}/resources/{resource}/{path}
+
+A sync of a project::
+
+    >>> sync = ProjectSync(session, 'myproject', '/data/mirror/myproject', delete_policy='trash')
+    >>> report = sync.sync()
+    >>> print(report)
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import datetime
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+import requests
+import six
+
+from . import exceptions
+from .utils import atomic_replace
+
+DELETE_POLICIES = ('keep', 'delete', 'trash')
+
+
+class RemoteFile(object):
+    """
+    A file on the server, as found in the listing of its resource
+    """
+    __slots__ = ('uri', 'local_path', 'size', 'digest')
+
+    def __init__(self, uri, local_path, size, digest):
+        self.uri = uri
+        self.local_path = local_path
+        self.size = size
+        self.digest = digest
+
+    def __repr__(self):
+        return '<RemoteFile {} ({} bytes)>'.format(self.uri, self.size)
+
+
+class SyncManifest(object):
+    """
+    SQLite manifest of the files mirrored by a :py:class:`ProjectSync`. The
+    manifest should only be used from the thread that created it.
+
+    :param str path: path of the SQLite database, created if it does not exist
+    """
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            ' uri TEXT PRIMARY KEY,'
+            ' local_path TEXT NOT NULL,'
+            ' size INTEGER,'
+            ' digest TEXT,'
+            ' last_modified TEXT,'
+            ' synced_at REAL'
+            ')'
+        )
+        self._connection.commit()
+
+    def __repr__(self):
+        return '<SyncManifest {} ({} files)>'.format(self.path, len(self))
+
+    def __len__(self):
+        return self._connection.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def entries(self):
+        """
+        Get all entries in the manifest
+
+        :return: dict mapping the uri to a dict with the stored information
+        """
+        cursor = self._connection.execute('SELECT uri, local_path, size, digest, last_modified, synced_at FROM files')
+        return {row[0]: {'local_path': row[1], 'size': row[2], 'digest': row[3],
+                         'last_modified': row[4], 'synced_at': row[5]} for row in cursor}
+
+    def update(self, uri, local_path, size, digest, last_modified):
+        self._connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)',
+                                 (uri, local_path, size, digest, last_modified, time.time()))
+
+    def remove(self, uri):
+        self._connection.execute('DELETE FROM files WHERE uri = ?', (uri,))
+
+    def commit(self):
+        self._connection.commit()
+
+    def close(self):
+        self._connection.commit()
+        self._connection.close()
+
+
+class SyncReport(object):
+    """
+    Summary of a sync: the uris of the new, changed, unchanged, deleted and
+    failed files, the number of bytes downloaded and the duration
+    """
+    def __init__(self):
+        self.new = []
+        self.changed = []
+        self.unchanged = 0
+        self.deleted = []
+        self.failed = {}
+        self.bytes_downloaded = 0
+        self.duration = 0.0
+        self.dry_run = False
+
+    def __repr__(self):
+        return '<SyncReport new={} changed={} unchanged={} deleted={} failed={}>'.format(
+            len(self.new), len(self.changed), self.unchanged, len(self.deleted), len(self.failed))
+
+    def __str__(self):
+        return ('{}Synced in {:.1f} seconds: {} new, {} changed, {} unchanged, {} deleted, '
+                '{} failed, {:.1f} MB downloaded').format('[DRY RUN] ' if self.dry_run else '',
+                                                           self.duration,
+                                                           len(self.new),
+                                                           len(self.changed),
+                                                           self.unchanged,
+                                                           len(self.deleted),
+                                                           len(self.failed),
+                                                           self.bytes_downloaded / 1e6)
+
+
+class ProjectSync(object):
+    """
+    Mirror the files of all resources (of experiments and scans) in a project
+    to a local directory.
+
+    :param xnat_session: the session to use
+    :param project: the project (or its ID) to mirror
+    :param str target_dir: the directory to mirror the project to
+    :param str manifest_path: path of the SQLite manifest, defaults to
+                              ``.xnatsync.sqlite`` in the target_dir
+    :param int max_workers: number of concurrent listings and downloads
+    :param str delete_policy: what to do with local files that were removed from
+                              the server: 'keep' them (but forget them in the
+                              manifest), 'delete' them or move them to a 'trash'
+                              directory (``.trash/{timestamp}`` in the target_dir)
+    :param list resources: only mirror resources with these labels, None for all. Local
+                           files of other resources are never deleted by the sync
+    :param int chunk_size: size of the chunks used to write the downloads
+    """
+    def __init__(self, xnat_session, project, target_dir, manifest_path=None, max_workers=4,
+                 delete_policy='keep', resources=None, chunk_size=524288):
+        if delete_policy not in DELETE_POLICIES:
+            raise exceptions.XNATValueError('Invalid delete_policy {}, should be one of {}'.format(delete_policy,
+                                                                                                 DELETE_POLICIES))
+
+        if not isinstance(project, six.string_types):
+            project = project.id
+
+        self.xnat_session = xnat_session
+        self.project = project
+        self.target_dir = os.path.abspath(target_dir)
+        self.manifest_path = manifest_path or os.path.join(self.target_dir, '.xnatsync.sqlite')
+        self.max_workers = max_workers
+        self.delete_policy = delete_policy
+        self.resources = set(resources) if resources is not None else None
+        self.chunk_size = chunk_size
+
+        self._trash_dir = None
+        self._lock = threading.Lock()
+
+    @property
+    def logger(self):
+        return self.xnat_session.logger
+
+    def sync(self, dry_run=False):
+        """
+        Synchronize the local directory with the project on the server
+
+        :param bool dry_run: only determine what would be done, do not change any files
+        :return: the report of the sync
+        :rtype: SyncReport
+        """
+        start = time.time()
+        report = SyncReport()
+        report.dry_run = dry_run
+        self._trash_dir = None
+
+        if not os.path.isdir(self.target_dir):
+            os.makedirs(self.target_dir)
+
+        manifest = SyncManifest(self.manifest_path)
+        try:
+            remote = self.list_remote()
+            local = manifest.entries()
+
+            to_download = []
+            known = []
+            for uri, remote_file in sorted(remote.items()):
+                if uri in local:
+                    known.append((remote_file, local[uri]))
+                else:
+                    report.new.append(uri)
+                    to_download.append(remote_file)
+
+            # Checking a file can require a request for its Last-Modified header
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                changed = list(executor.map(lambda x: self.is_changed(*x), known))
+
+            for (remote_file, _), is_changed in zip(known, changed):
+                if is_changed:
+                    report.changed.append(remote_file.uri)
+                    to_download.append(remote_file)
+                else:
+                    report.unchanged += 1
+
+            # Files of resources that are not mirrored in this sync are not deleted
+            report.deleted = sorted(uri for uri in set(local) - set(remote)
+                                    if self._is_mirrored(local[uri]['local_path']))
+
+            if not dry_run:
+                self._download_all(to_download, manifest, report)
+                for uri in report.deleted:
+                    self._remove_local(local[uri]['local_path'])
+                    manifest.remove(uri)
+                manifest.commit()
+        finally:
+            manifest.close()
+
+        report.duration = time.time() - start
+        self.logger.info(str(report))
+        return report
+
+    def is_changed(self, remote_file, entry):
+        """
+        Check if a file changed on the server or locally since the last sync.
+        The size and digest in the listing are compared with the manifest, if
+        the listing has no digest the Last-Modified header of the file on the
+        server is compared instead (this requires a HEAD request per file).
+
+        :param RemoteFile remote_file: the file on the server
+        :param dict entry: the manifest entry of the file
+        :return: True if the file has to be downloaded
+        """
+        if remote_file.size is not None and entry['size'] != remote_file.size:
+            return True
+
+        if remote_file.digest and entry['digest'] and remote_file.digest != entry['digest']:
+            return True
+
+        local_path = os.path.join(self.target_dir, entry['local_path'])
+        if not os.path.isfile(local_path) or (entry['size'] is not None and os.path.getsize(local_path) != entry['size']):
+            return True
+
+        if not (remote_file.digest and entry['digest']) and entry['last_modified']:
+            try:
+                last_modified = self.xnat_session.head(remote_file.uri).headers.get('Last-Modified')
+            except (exceptions.XNATResponseError, requests.exceptions.RequestException) as exception:
+                self.logger.warning('Could not check {}: {}'.format(remote_file.uri, exception))
+                return False
+
+            if last_modified and last_modified != entry['last_modified']:
+                return True
+
+        return False
+
+    def _is_mirrored(self, local_path):
+        """
+        Check if a file in the manifest belongs to a resource that is mirrored,
+        the resource label is taken from the local layout
+        (``{subject}/{experiment}[/scans/{scan}]/resources/{resource}/{path}``)
+        """
+        if self.resources is None:
+            return True
+
+        parts = os.path.normpath(local_path).split(os.sep)
+        index = 5 if len(parts) > 2 and parts[2] == 'scans' else 3
+        return len(parts) > index and parts[index] in self.resources
+
+    def list_remote(self):
+        """
+        List all files in the project on the server, the experiments are
+        listed concurrently
+
+        :return: dict mapping the uri of a file to a RemoteFile
+        """
+        project = self.xnat_session.projects[self.project]
+        experiments = [(subject.label, experiment)
+                       for subject in project.subjects.values()
+                       for experiment in subject.experiments.values()]
+
+        remote = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for files in executor.map(lambda x: self._list_experiment(*x), experiments):
+                for remote_file in files:
+                    remote[remote_file.uri] = remote_file
+
+        self.logger.info('Found {} files in {} experiments of project {}'.format(len(remote), len(experiments),
+                                                                              self.project))
+        return remote
+
+    def _list_experiment(self, subject_label, experiment):
+        base_dir = os.path.join(subject_label, experiment.label)
+
+        containers = [(os.path.join(base_dir, 'resources'), experiment)]
+        scans = getattr(experiment, 'scans', None)
+        if scans is not None:
+            containers.extend((os.path.join(base_dir, 'scans', scan.id, 'resources'), scan) for scan in scans.values())
+
+        files = []
+        for directory, container in containers:
+            for resource in container.resources.values():
+                label = resource.label or resource.id
+                if self.resources is not None and label not in self.resources:
+                    continue
+
+                # Use the rows of the listing, these contain the size and digest without creating the objects
+                for row in resource.files.listing.rows:
+                    files.append(self._remote_file(row, os.path.join(directory, label)))
+
+        return files
+
+    @staticmethod
+    def _remote_file(row, directory):
+        uri = row['URI']
+        path = uri.split('/files/', 1)[-1]
+
+        size = row.get('Size')
+        size = int(size) if size not in (None, '') else None
+        digest = row.get('digest') or None
+
+        return RemoteFile(uri=uri,
+                          local_path=os.path.join(directory, *path.split('/')),
+                          size=size,
+                          digest=digest)
+
+    def _download_all(self, to_download, manifest, report):
+        if not to_download:
+            return
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self._download, remote_file): remote_file for remote_file in to_download}
+
+            # The manifest is only updated from this thread
+            for future in as_completed(futures):
+                remote_file = futures[future]
+                try:
+                    size, last_modified = future.result()
+                except Exception as exception:
+                    self.logger.warning('Could not download {}: {}'.format(remote_file.uri, exception))
+                    report.failed[remote_file.uri] = str(exception)
+                    continue
+
+                report.bytes_downloaded += size
+                manifest.update(remote_file.uri, remote_file.local_path, size, remote_file.digest, last_modified)
+
+        # Failed files should not be counted as new or changed
+        report.new = [x for x in report.new if x not in report.failed]
+        report.changed = [x for x in report.changed if x not in report.failed]
+
+    def _download(self, remote_file):
+        target = os.path.join(self.target_dir, remote_file.local_path)
+        directory = os.path.dirname(target)
+        with self._lock:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+
+        # Download to a temporary file first, so an interrupted sync never leaves partial files
+        temp_target = '{}.part'.format(target)
+        response = self.xnat_session.get(remote_file.uri, stream=True)
+        size = 0
+        try:
+            with open(temp_target, 'wb') as output:
+                for chunk in response.iter_content(self.chunk_size):
+                    output.write(chunk)
+                    size += len(chunk)
+        except Exception:
+            if os.path.exists(temp_target):
+                os.remove(temp_target)
+            raise
+        finally:
+            response.close()
+
+        if remote_file.size is not None and size != remote_file.size:
+            os.remove(temp_target)
+            raise exceptions.XNATIOError('Downloaded {} bytes, expected {}'.format(size, remote_file.size))
+
+        atomic_replace(temp_target, target)
+
+        return size, response.headers.get('Last-Modified')
+
+    def _remove_local(self, local_path):
+        path = os.path.join(self.target_dir, local_path)
+        if self.delete_policy == 'keep' or not os.path.exists(path):
+            return
+
+        if self.delete_policy == 'delete':
+            self.logger.info('Removing {}'.format(path))
+            os.remove(path)
+        else:
+            if self._trash_dir is None:
+                timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+                self._trash_dir = os.path.join(self.target_dir, '.trash', timestamp)
+
+            trash_path = os.path.join(self._trash_dir, local_path)
+            if not os.path.isdir(os.path.dirname(trash_path)):
+                os.makedirs(os.path.dirname(trash_path))
+            self.logger.info('Moving {} to {}'.format(path, trash_path))
+            shutil.move(path, trash_path)
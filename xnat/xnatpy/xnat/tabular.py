@@ -0,0 +1,214 @@
+# Copyright 2011-2015 Biomedical Imaging Group Rotterdam, Departments of
+# Medical Informatics and Radiology, Erasmus MC, Rotterdam, The Netherlands
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Helpers to parse the CSV tables returned by XNAT (searches and listings
+requested with ``format=csv``) directly from a streamed response, either
+row by row or into a columnar pandas DataFrame or Arrow Table.
+
+Columns are returned as strings unless a type is given for them in the
+``types`` mapping, which maps a column name to an XSD type (e.g.
+``{'age': 'xs:integer', 'date': 'xs:date'}``) as used in
+:mod:`xnat.datatypes`.
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import csv
+import io
+
+from . import exceptions
+from .datatypes import convert_to
+from .utils import ResponseStream
+
+try:
+    PANDAS_LOADED = True
+    import pandas
+except ImportError:
+    PANDAS_LOADED = False
+
+try:
+    PYARROW_LOADED = True
+    import pyarrow
+    import pyarrow.csv
+except ImportError:
+    PYARROW_LOADED = False
+
+
+# Mapping of XSD types to Arrow types, all other types are kept as strings
+ARROW_TYPES = {
+    'xs:boolean': lambda: pyarrow.bool_(),
+    'xs:integer': lambda: pyarrow.int64(),
+    'xs:long': lambda: pyarrow.int64(),
+    'xs:float': lambda: pyarrow.float64(),
+    'xs:double': lambda: pyarrow.float64(),
+    'xs:dateTime': lambda: pyarrow.timestamp('us'),
+    'xs:date': lambda: pyarrow.date32(),
+}
+
+# Vectorized conversions of string columns for pandas, other types fall back to convert_to per value
+PANDAS_CONVERTERS = {
+    'xs:boolean': lambda column: column.isin(['true', '1']).where(column.notna()),
+    'xs:integer': lambda column: pandas.to_numeric(column).astype('Int64'),
+    'xs:long': lambda column: pandas.to_numeric(column).astype('Int64'),
+    'xs:float': lambda column: pandas.to_numeric(column),
+    'xs:double': lambda column: pandas.to_numeric(column),
+    'xs:dateTime': lambda column: pandas.to_datetime(column.str.replace(' ', 'T', n=1)),
+    'xs:date': lambda column: pandas.to_datetime(column).dt.date,
+}
+
+
+def _open_table(response):
+    """
+    Wrap the content of a response and read the header of the table
+
+    :param response: response obtained with ``stream=True``
+    :return: tuple (header, encoding, binary stream positioned at the first row)
+    :raises XNATResponseError: if the response is not a CSV table
+    """
+    # Without an explicit charset requests falls back to latin-1 for text/*, XNAT sends utf-8
+    if 'charset' in response.headers.get('content-type', ''):
+        encoding = response.encoding
+    else:
+        encoding = 'utf-8'
+
+    stream = io.BufferedReader(ResponseStream(response))
+    header_line = stream.readline().decode(encoding)
+    if header_line.startswith(('<!DOCTYPE', '<html>', '<?xml')):
+        raise exceptions.XNATResponseError('Invalid response from XNATSession for url {} (status {}), expected a CSV table:\n{}'.format(
+            response.url, response.status_code, header_line + stream.read(1024).decode(encoding, 'replace')))
+
+    header = next(csv.reader([header_line]), [])
+    return header, encoding, stream
+
+
+def iter_csv_response(response, types=None):
+    """
+    Iterate over the rows of a CSV table in a streamed response without loading
+    the full table in memory.
+
+    :param response: response obtained with ``stream=True``
+    :param dict types: mapping of column name to XSD type for typed columns
+    :return: generator of dicts (column -> value), empty typed values are None
+    """
+    try:
+        header, encoding, stream = _open_table(response)
+        if not header:
+            return
+
+        types = types or {}
+        column_types = [types.get(column) for column in header]
+
+        text_stream = io.TextIOWrapper(stream, encoding=encoding, newline='')
+        for row in csv.reader(text_stream):
+            if not row:
+                continue
+
+            if types:
+                row = [value if type_ is None else (convert_to(value, type_) if value != '' else None)
+                       for value, type_ in zip(row, column_types)]
+
+            yield dict(zip(header, row))
+    finally:
+        response.close()
+
+
+def convert_row(row, types):
+    """
+    Convert the values of a row (as returned by :py:func:`iter_csv_response`
+    without types) to the given types
+
+    :param dict row: the row to convert, it is not changed
+    :param dict types: mapping of column name to XSD type for typed columns
+    :return: new dict with the converted row, empty typed values are None
+    """
+    return {key: value if key not in types else (convert_to(value, types[key]) if value != '' else None)
+            for key, value in row.items()}
+
+
+def csv_response_to_dataframe(response, types=None, columns=None):
+    """
+    Read a CSV table from a streamed response into a pandas DataFrame.
+
+    :param response: response obtained with ``stream=True``
+    :param dict types: mapping of column name to XSD type for typed columns
+    :param list columns: columns to retain (in this order), None for all
+    :return: table with the data
+    :rtype: pandas.DataFrame
+    """
+    if not PANDAS_LOADED:
+        raise RuntimeError('Cannot create DataFrame, missing required dependency: pandas')
+
+    try:
+        header, encoding, stream = _open_table(response)
+        data = pandas.read_csv(io.TextIOWrapper(stream, encoding=encoding, newline=''),
+                               header=None,
+                               names=header,
+                               dtype=str,
+                               keep_default_na=False,
+                               na_values=[''])
+    finally:
+        response.close()
+
+    for column, type_ in (types or {}).items():
+        if column not in data.columns:
+            continue
+
+        if type_ in PANDAS_CONVERTERS:
+            data[column] = PANDAS_CONVERTERS[type_](data[column])
+        else:
+            data[column] = data[column].map(lambda x: None if pandas.isna(x) else convert_to(x, type_))
+
+    if columns is not None:
+        data = data[[x for x in columns if x in data.columns]]
+
+    return data
+
+
+def csv_response_to_arrow(response, types=None, columns=None):
+    """
+    Read a CSV table from a streamed response into an Arrow Table.
+
+    :param response: response obtained with ``stream=True``
+    :param dict types: mapping of column name to XSD type for typed columns
+    :param list columns: columns to retain (in this order), None for all
+    :return: table with the data
+    :rtype: pyarrow.Table
+    """
+    if not PYARROW_LOADED:
+        raise RuntimeError('Cannot create Arrow Table, missing required dependency: pyarrow')
+
+    types = types or {}
+    try:
+        header, encoding, stream = _open_table(response)
+        column_types = {column: ARROW_TYPES.get(types.get(column), pyarrow.string)() for column in header}
+
+        if not stream.peek(1):
+            # Arrow refuses to read a table without any rows
+            data = pyarrow.schema([(column, column_types[column]) for column in header]).empty_table()
+        else:
+            data = pyarrow.csv.read_csv(stream,
+                                        read_options=pyarrow.csv.ReadOptions(column_names=header,
+                                                                             encoding=encoding),
+                                        convert_options=pyarrow.csv.ConvertOptions(column_types=column_types,
+                                                                                   true_values=['true', '1'],
+                                                                                   false_values=['false', '0']))
+    finally:
+        response.close()
+
+    if columns is not None:
+        data = data.select([x for x in columns if x in data.column_names])
+
+    return data
@@ -16,11 +16,22 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import io
 import re
 import keyword
+import multiprocessing
+import os
+import struct
+import threading
+import time
+import timeit
+import zlib
 from functools import update_wrapper
 
 import six
+from six.moves import queue
 
 if six.PY3:
     from io import BufferedIOBase, SEEK_SET, SEEK_END
@@ -87,6 +98,48 @@ class mixedproperty(object):
         return type(self)(self.fcget, self.fget, self.fset, fdel)
 
 
+def bounded_memo(maxsize=4096):
+    """
+    Decorator to memoize a function of a single hashable argument. The memo
+    table is bounded: when it is full it is emptied, which is cheaper than
+    tracking the least recently used entries and fine for functions that see
+    a limited vocabulary (e.g. field and type names).
+
+    :param int maxsize: maximum number of memoized results
+    """
+    def decorator(func):
+        memo = {}
+
+        def wrapper(argument):
+            try:
+                return memo[argument]
+            except KeyError:
+                pass
+
+            result = func(argument)
+            if len(memo) >= maxsize:
+                memo.clear()
+            memo[argument] = result
+            return result
+
+        wrapper.cache_clear = memo.clear
+        update_wrapper(wrapper, func)
+        return wrapper
+
+    return decorator
+
+
+CLASS_NAME_SPLIT_PATTERN = re.compile(r'[\-\_\W]+')
+NON_ALPHANUMERIC_PATTERN = re.compile(r'[^0-9a-zA-Z]+')
+UPPERCASE_PATTERN = re.compile(r'[A-Z]+')
+MULTIPLE_UNDERSCORE_PATTERN = re.compile(r'__+')
+
+
+def _lower_with_underscore(match):
+    return '_' + match.group(0).lower()
+
+
+@bounded_memo()
 def pythonize_class_name(name):
     """
     Turns string into a valid PEP8 class name, meaning camel cased
@@ -99,12 +152,13 @@ def pythonize_class_name(name):
     if ':' in name:
         name = name.split(':', 1)[-1]
 
-    parts = re.split('[\-\_\W]+', name)
+    parts = CLASS_NAME_SPLIT_PATTERN.split(name)
     parts = [x[0].upper() + x[1:] for x in parts]
     name = ''.join(parts)
     return name
 
 
+@bounded_memo()
 def pythonize_attribute_name(name):
     """
     Turns string into a valid PEP8 class name, meaning lower case with
@@ -114,16 +168,16 @@ def pythonize_attribute_name(name):
     :return: the PEP8 valid attribute name
     :rtype: str
     """
-    name = re.sub('[^0-9a-zA-Z]+', '_', name)
+    name = NON_ALPHANUMERIC_PATTERN.sub('_', name)
 
     # Change CamelCaseString to camel_case_string
     # Note that addID would become add_id
-    name = re.sub("[A-Z]+", lambda x: '_' + x.group(0).lower(), name)
+    name = UPPERCASE_PATTERN.sub(_lower_with_underscore, name)
     if name[0] == '_':
         name = name[1:]
 
     # Avoid multiple underscores (replace them by single underscore)
-    name = re.sub("__+", '_', name)
+    name = MULTIPLE_UNDERSCORE_PATTERN.sub('_', name)
 
     # Avoid overwriting keywords TODO: Do we want this, as a property it is not a huge problem?
     if keyword.iskeyword(name):
@@ -153,9 +207,10 @@ class RequestsFileLike(object):
         current_position = self._bytes.seek(0, SEEK_END)
         while current_position < goal_position:
             try:
-                current_position = self._bytes.write(next(self._iterator))
+                self._bytes.write(next(self._iterator))
             except StopIteration:
                 break
+            current_position = self._bytes.tell()
 
     def tell(self):
         return self._bytes.tell()
@@ -175,14 +230,474 @@ class RequestsFileLike(object):
     def seek(self, position, whence=SEEK_SET):
         if whence == SEEK_END:
             self._load_all()
-        else:
-            self._bytes.seek(position, whence)
+
+        return self._bytes.seek(position, whence)
 
     def close(self):
         self._bytes.close()
         self._request.close()
 
 
+class ResponseStream(io.RawIOBase):
+    """
+    Raw binary stream reading the (decoded) content of a streamed response,
+    this allows wrapping it in the buffered and text streams of :mod:`io`.
+
+    :param response: response obtained with ``stream=True``
+    :param int chunk_size: size of the chunks requested from the response
+    """
+    def __init__(self, response, chunk_size=65536):
+        super(ResponseStream, self).__init__()
+        self._iterator = response.iter_content(chunk_size)
+        self._pending = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            try:
+                self._pending = memoryview(next(self._iterator))
+            except StopIteration:
+                return 0
+
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+def open_remote_file(xnat_session, path, block_size=262144, cache_blocks=16):
+    """
+    Open a file on the server as a read-only file-like object. If the server
+    supports HTTP Range requests a :py:class:`RangeRequestFileLike` is returned,
+    otherwise this falls back to a :py:class:`RequestsFileLike` streaming the file.
+
+    :param xnat_session: the session to use
+    :param str path: the path of the file on the server
+    :param int block_size: size of the blocks that are requested from the server
+    :param int cache_blocks: number of blocks to keep in memory
+    :return: file-like object
+    """
+    response = xnat_session.get(path,
+                                headers={'Range': 'bytes=0-{}'.format(block_size - 1)},
+                                accepted_status=[200, 206, 416],
+                                stream=True)
+
+    if response.status_code == 416:
+        # Range not satisfiable, the file is empty
+        response.close()
+        return RangeRequestFileLike(xnat_session, path, size=0, block_size=block_size, cache_blocks=cache_blocks)
+
+    content_range = response.headers.get('Content-Range', '')
+    total_size = content_range.rpartition('/')[2]
+    if response.status_code != 206 or not total_size.isdigit():
+        # Server ignored the range, so stream the whole file
+        return RequestsFileLike(response)
+
+    file_like = RangeRequestFileLike(xnat_session, path, size=int(total_size), block_size=block_size, cache_blocks=cache_blocks)
+    file_like.add_blocks(0, response.content)
+    return file_like
+
+
+class RangeRequestFileLike(superclass):
+    """
+    Read-only file-like object for a file on the server that fetches the
+    data it needs using HTTP Range requests. The data is retrieved in blocks
+    of which at most cache_blocks are kept in memory (least recently used are
+    dropped). Consecutive missing blocks are requested in a single request, so
+    a seek followed by a read costs one request. Use :py:func:`open_remote_file`
+    to open a file, this checks if the server supports Range requests.
+
+    :param xnat_session: the session to use
+    :param str path: the path of the file on the server
+    :param int size: the size of the file
+    :param int block_size: size of the blocks that are requested from the server
+    :param int cache_blocks: number of blocks to keep in memory
+    """
+    def __init__(self, xnat_session, path, size, block_size=262144, cache_blocks=16):
+        super(RangeRequestFileLike, self).__init__()
+        self.xnat_session = xnat_session
+        self.path = path
+        self.size = size
+        self.block_size = block_size
+        self.cache_blocks = max(cache_blocks, 1)
+        self.requests = 0
+        self._position = 0
+        self._blocks = OrderedDict()
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, position, whence=SEEK_SET):
+        if whence == SEEK_SET:
+            new_position = position
+        elif whence == SEEK_END:
+            new_position = self.size + position
+        else:
+            new_position = self._position + position
+
+        if new_position < 0:
+            raise ValueError('Negative seek position {}'.format(new_position))
+
+        self._position = new_position
+        return self._position
+
+    def read(self, size=-1):
+        if self._closed:
+            raise ValueError('I/O operation on closed file.')
+
+        if size is None or size < 0:
+            end = self.size
+        else:
+            end = min(self._position + size, self.size)
+
+        if end <= self._position:
+            return b''
+
+        first_block = self._position // self.block_size
+        last_block = (end - 1) // self.block_size
+
+        # Request all missing blocks, grouped in runs of consecutive blocks
+        missing = [x for x in range(first_block, last_block + 1) if x not in self._blocks]
+        parts = {}
+        while missing:
+            run_start = run_end = missing.pop(0)
+            while missing and missing[0] == run_end + 1:
+                run_end = missing.pop(0)
+
+            data = self._fetch(run_start * self.block_size,
+                               min((run_end + 1) * self.block_size, self.size))
+            for index in range(run_start, run_end + 1):
+                offset = (index - run_start) * self.block_size
+                parts[index] = data[offset:offset + self.block_size]
+
+        # Assemble the result from the cache and the newly retrieved blocks
+        result = []
+        for index in range(first_block, last_block + 1):
+            block = parts[index] if index in parts else self._blocks[index]
+            start = max(self._position - index * self.block_size, 0)
+            stop = min(end - index * self.block_size, len(block))
+            result.append(block[start:stop])
+
+        # Only cache the tail of large reads, the data was returned already
+        for index in sorted(parts)[-self.cache_blocks:]:
+            self._store_block(index, parts[index])
+        for index in range(first_block, last_block + 1):
+            if index in self._blocks:
+                self._blocks[index] = self._blocks.pop(index)  # Mark as most recently used
+
+        data = b''.join(result)
+        self._position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def add_blocks(self, offset, data):
+        """
+        Add data retrieved elsewhere (starting at a block boundary) to the cache
+
+        :param int offset: the offset of the data in the file
+        :param bytes data: the data
+        """
+        first_block = offset // self.block_size
+        for index in range(0, len(data), self.block_size):
+            self._store_block(first_block + index // self.block_size, data[index:index + self.block_size])
+
+    def _store_block(self, index, data):
+        self._blocks[index] = data
+        while len(self._blocks) > self.cache_blocks:
+            self._blocks.popitem(last=False)
+
+    def _fetch(self, start, end):
+        self.requests += 1
+        response = self.xnat_session.get(self.path,
+                                         headers={'Range': 'bytes={}-{}'.format(start, end - 1)},
+                                         accepted_status=[206])
+        data = response.content
+
+        if len(data) != end - start:
+            raise IOError('Expected {} bytes from ranged request for {}, got {}'.format(end - start, self.path, len(data)))
+
+        return data
+
+    def close(self):
+        self._blocks.clear()
+        self._closed = True
+
+
+class ParallelGzipStream(object):
+    """
+    Iterable that produces a gzip stream of data written by a producer
+    function, compressing blocks of the data on multiple threads (the same
+    approach as pigz). The producer runs in a background thread and gets a
+    file-like object to write to, iterating over this object yields the
+    compressed data as it becomes available. This allows the compressed
+    data to be sent while it is still being produced, for example::
+
+        >>> def produce(fileobj):
+        ...     with TarFile(mode='w', fileobj=fileobj) as tar_file:
+        ...         tar_file.add(directory, '')
+        >>> xnat_session.upload(uri, ParallelGzipStream(produce))
+
+    Every block is compressed independently (primed with the last 32 KiB of
+    the previous block to retain most of the compression ratio) and the
+    blocks are concatenated into a single gzip member. Memory use is bounded
+    by roughly ``2 * threads`` blocks.
+
+    :param func producer: function that writes the data to the file-like object it receives
+    :param int compresslevel: zlib compression level
+    :param int block_size: size of the uncompressed blocks that are compressed in parallel
+    :param int threads: number of compression threads (defaults to the number of cpus)
+    """
+    DICTIONARY_SIZE = 32768
+
+    def __init__(self, producer, compresslevel=6, block_size=1048576, threads=None):
+        self._producer = producer
+        self.compresslevel = compresslevel
+        self.block_size = block_size
+        self.threads = threads or multiprocessing.cpu_count()
+
+    def __iter__(self):
+        executor = ThreadPoolExecutor(max_workers=self.threads)
+        blocks = queue.Queue(maxsize=2 * self.threads)
+        abort = threading.Event()
+        errors = []
+        sink = _CompressionSink(self, executor, blocks, abort)
+
+        def run_producer():
+            try:
+                self._producer(sink)
+                sink.close()
+            except Exception as exception:
+                errors.append(exception)
+            finally:
+                try:
+                    sink.put(None)
+                except IOError:
+                    pass  # The consumer stopped, nobody is waiting for the end marker
+
+        producer_thread = threading.Thread(target=run_producer)
+        producer_thread.daemon = True
+        producer_thread.start()
+
+        try:
+            # Gzip header: magic, deflate, no flags, no mtime, no extra flags, unknown OS
+            yield b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+            crc = 0
+            size = 0
+            while True:
+                item = blocks.get()
+                if item is None:
+                    break
+
+                block, future = item
+                crc = zlib.crc32(block, crc)
+                size += len(block)
+                compressed = future.result()
+                if compressed:
+                    yield compressed
+
+            if errors:
+                raise errors[0]
+
+            yield struct.pack('<II', crc & 0xffffffff, size & 0xffffffff)
+        finally:
+            abort.set()
+            # Unblock the producer if it is waiting on a full queue
+            while producer_thread.is_alive():
+                try:
+                    blocks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            executor.shutdown(wait=False)
+
+    def compress_block(self, block, dictionary, last):
+        if dictionary:
+            compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                          zlib.DEF_MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY, dictionary)
+        else:
+            compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return compressor.compress(block) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class _CompressionSink(object):
+    """
+    Write-only file-like object that cuts the data into blocks and submits
+    those for compression
+    """
+    def __init__(self, stream, executor, blocks, abort):
+        self._stream = stream
+        self._executor = executor
+        self._blocks = blocks
+        self._abort = abort
+        self._buffer = bytearray()
+        self._dictionary = b''
+        self._position = 0
+        self.closed = False
+
+    def put(self, item):
+        while True:
+            if self._abort.is_set():
+                raise IOError('Consumer of the compressed stream stopped')
+            try:
+                self._blocks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _submit(self, block, last):
+        future = self._executor.submit(self._stream.compress_block, block, self._dictionary, last)
+        self._dictionary = block[-self._stream.DICTIONARY_SIZE:]
+        self.put((block, future))
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+
+        self._buffer += data
+        self._position += len(data)
+        block_size = self._stream.block_size
+        while len(self._buffer) >= block_size:
+            block = bytes(self._buffer[:block_size])
+            del self._buffer[:block_size]
+            self._submit(block, last=False)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._submit(bytes(self._buffer), last=True)
+            self._buffer = bytearray()
+
+
+class AdaptiveChunkSize(object):
+    """
+    Chunk size for reading a stream that adapts to the measured throughput, so
+    that every chunk takes roughly ``target_time`` seconds: fast links use
+    large chunks (less per-chunk overhead), slow links small chunks (frequent
+    progress updates).
+
+    :param int initial: the initial chunk size in bytes
+    :param int minimum: the smallest chunk size in bytes
+    :param int maximum: the largest chunk size in bytes
+    :param float target_time: the desired time to read a chunk in seconds
+    """
+    def __init__(self, initial=524288, minimum=65536, maximum=16777216, target_time=0.25):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_time = target_time
+        self.size = max(minimum, min(initial, maximum))
+
+    def __int__(self):
+        return self.size
+
+    def update(self, nbytes, duration):
+        """
+        Update the chunk size after reading a chunk
+
+        :param int nbytes: number of bytes read
+        :param float duration: time it took to read them in seconds
+        :return: the new chunk size
+        """
+        # Only adapt on full chunks, the last chunk of a stream says nothing about the link
+        if nbytes >= self.size:
+            if duration < self.target_time / 2:
+                self.size = min(self.size * 2, self.maximum)
+            elif duration > self.target_time * 2:
+                self.size = max(self.size // 2, self.minimum)
+        return self.size
+
+
+class ThrottledCallback(object):
+    """
+    Wraps a progress callback ``func(nbytes, total, finished)`` so that it is
+    called at most once every ``interval`` seconds. The first call and the
+    call with ``finished=True`` are always passed on.
+
+    :param func: the callback to wrap
+    :param float interval: minimum time in seconds between calls
+    """
+    def __init__(self, func, interval=0.1):
+        self.func = func
+        self.interval = interval
+        self._last_call = None
+
+    def __call__(self, nbytes, total, finished):
+        now = timeit.default_timer()
+        if finished or self._last_call is None or now - self._last_call >= self.interval:
+            self._last_call = now
+            self.func(nbytes, total, finished)
+
+
+class BandwidthLimiter(object):
+    """
+    Limits the average transfer rate, :py:meth:`throttle` is called after
+    every chunk and sleeps long enough to stay below ``max_rate``.
+
+    :param float max_rate: maximum rate in bytes per second
+    """
+    def __init__(self, max_rate):
+        if max_rate <= 0:
+            raise ValueError('The maximum rate should be positive, found {}'.format(max_rate))
+        self.max_rate = float(max_rate)
+        self._start = None
+        self._nbytes = 0
+
+    def throttle(self, nbytes):
+        if self._start is None:
+            self._start = timeit.default_timer()
+
+        self._nbytes += nbytes
+        delay = self._nbytes / self.max_rate - (timeit.default_timer() - self._start)
+        if delay > 0:
+            time.sleep(delay)
+
+
+def atomic_replace(source, destination):
+    """
+    Move a file to the destination in one step (replacing an existing file),
+    so the destination is never partially written. On Python 2 the existing
+    file is removed first, which is not atomic.
+
+    :param str source: the path of the file to move
+    :param str destination: the path to move the file to
+    """
+    if hasattr(os, 'replace'):
+        os.replace(source, destination)
+    else:
+        if os.path.exists(destination):
+            os.remove(destination)
+        os.rename(source, destination)
+
+
 def full_class_name(cls):
     module = cls.__module__
 
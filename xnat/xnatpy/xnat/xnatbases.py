@@ -15,8 +15,11 @@
 
 from __future__ import absolute_import
 from __future__ import unicode_literals
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
 import tempfile
+import threading
+import time
 from gzip import GzipFile
 from zipfile import ZipFile
 from tarfile import TarFile
@@ -24,8 +27,11 @@ from tarfile import TarFile
 from six import BytesIO
 
 from .core import caching, XNATBaseObject, XNATListing
+from .exceptions import XNATUploadError
 from .search import SearchField
-from .utils import mixedproperty
+from .session import default_update_func
+from .sync import ProjectSync
+from .utils import mixedproperty, ParallelGzipStream, ResponseStream
 
 try:
     PYDICOM_LOADED = True
@@ -102,6 +108,21 @@ class ProjectData(XNATBaseObject):
         if verbose:
             self.logger.info('Downloaded subject to {}'.format(project_dir))
 
+    def sync_dir(self, target_dir, dry_run=False, **kwargs):
+        """
+        Mirror the files of the resources of all experiments and scans in the
+        project to a local directory (resources of the project and subjects
+        are not included). Only files that are new or changed since the previous sync are
+        downloaded, see :py:class:`xnat.sync.ProjectSync` for the layout and
+        the additional arguments (e.g. ``max_workers`` and ``delete_policy``).
+
+        :param str target_dir: directory to mirror the project to
+        :param bool dry_run: only report what would be done
+        :return: the report of the sync
+        :rtype: xnat.sync.SyncReport
+        """
+        return ProjectSync(self.xnat_session, self.id, target_dir, **kwargs).sync(dry_run=dry_run)
+
 
 class SubjectData(XNATBaseObject):
     SECONDARY_LOOKUP_FIELD = 'label'
@@ -127,8 +148,8 @@ class SubjectData(XNATBaseObject):
         # Retrieve the label the hard and costly way
         try:
             # First check if subject is shared into current project
-            sharing = next(x for x in self.fulldata['children'] if x['field'] == 'sharing/share')
-            share_info = next(x for x in sharing['items'] if x['data_fields']['project'] == self.project)
+            sharing = self.get_children('sharing/share') or []
+            share_info = next(x for x in sharing if x['data_fields']['project'] == self.project)
             label = share_info['data_fields']['label']
         except (KeyError, StopIteration):
             label = self.get('label', type_=str)
@@ -205,8 +226,8 @@ class ExperimentData(XNATBaseObject):
         # Retrieve the label the hard and costly way
         try:
             # First check if subject is shared into current project
-            sharing = next(x for x in self.fulldata['children'] if x['field'] == 'sharing/share')
-            share_info = next(x for x in sharing['items'] if x['data_fields']['project'] == self.project)
+            sharing = self.get_children('sharing/share') or []
+            share_info = next(x for x in sharing if x['data_fields']['project'] == self.project)
             label = share_info['data_fields']['label']
         except (KeyError, StopIteration):
             label = self.get('label', type_=str)
@@ -524,6 +545,38 @@ class AbstractResource(XNATBaseObject):
         if verbose:
             self.logger.info('Downloaded resource data to {}'.format(target_dir))
 
+    def copy_to(self, destination, overwrite=False, max_workers=None, **kwargs):
+        """
+        Copy the files of this resource into another resource (which can be
+        on another server). The archive of this resource is read while it is
+        downloaded, the paths of the files are made relative to the resource
+        and the files are repacked into a gzipped tar file that is uploaded
+        while it is being created, so nothing is stored on disk or in memory.
+
+        :param destination: the resource to copy the files to
+        :param bool overwrite: overwrite existing files in the destination
+        :param int max_workers: number of compression threads (default: number of cpus)
+        """
+        response = self.xnat_session.get(self.uri + '/files', format='tar.gz', stream=True)
+
+        def write_tar(fileobj):
+            try:
+                # Stream mode with automatic detection of the (optional) compression
+                with TarFile.open(fileobj=ResponseStream(response), mode='r|*') as source_tar, \
+                        TarFile(name='upload.tar', mode='w', fileobj=fileobj) as target_tar:
+                    for member in source_tar:
+                        if not member.isfile():
+                            continue
+
+                        # XNAT archives contain the full path up to the files of the resource
+                        member.name = member.name.split('/files/', 1)[-1]
+                        target_tar.addfile(member, source_tar.extractfile(member))
+            finally:
+                response.close()
+
+        stream = ParallelGzipStream(write_tar, threads=max_workers)
+        destination.upload(stream, 'upload.tar.gz', overwrite=overwrite, extract=True, **kwargs)
+
     def upload(self, data, remotepath, overwrite=False, extract=False, **kwargs):
         uri = '{}/files/{}'.format(self.uri, remotepath.lstrip('/'))
         query = {}
@@ -532,28 +585,46 @@ class AbstractResource(XNATBaseObject):
         self.xnat_session.upload(uri, data, overwrite=overwrite, query=query, **kwargs)
         self.files.clearcache()
 
-    def upload_dir(self, directory, overwrite=False, method='tgz_file', **kwargs):
+    def upload_dir(self, directory, overwrite=False, method='tgz_file', max_workers=None, verbose=False,
+                   update_func=None, **kwargs):
         """
         Upload a directory to an XNAT resource. This means that if you do
         resource.upload_dir(directory) that if there is a file directory/a.txt
         it will be uploaded to resource/files/a.txt
 
-        The method has 5 options, default is tgz_file:
+        The method has 6 options, default is tgz_file:
 
-        #. ``per_file``: Scans the directory and uploads file by file
+        #. ``per_file``: Scans the directory and uploads file by file, using
+           ``max_workers`` concurrent uploads
         #. ``tar_memory``: Create a tar archive in memory and upload it in one go
         #. ``tgz_memory``: Create a gzipped tar file in memory and upload that
         #. ``tar_file``: Create a temporary tar file and upload that
         #. ``tgz_file``: Create a temporary gzipped tar file and upload that
+        #. ``tgz_stream``: Create a gzipped tar file on ``max_workers``
+           compression threads (default: number of cpus) and upload it while
+           it is being created
 
         The considerations are that sometimes you can fit things in memory so
         you can save disk IO by putting it in memory. The per file does not
         create additional archives, but has one request per file so might be
-        slow when uploading many files.
+        slow when uploading many files. The tgz stream needs neither disk
+        space nor memory for the archive and overlaps packaging with the
+        upload, but as the stream cannot be rewound it cannot be retried.
+
+        For the ``per_file`` method it is advised to pass ``retries`` (see
+        :py:meth:`XNATSession.upload <xnat.session.XNATSession.upload>`) so
+        transient failures of single files are retried with a backoff.
 
         :param str directory: The directory to upload
         :param bool overwrite: Flag to force overwriting of files
         :param str method: The method to use
+        :param int max_workers: number of concurrent uploads for the ``per_file`` method
+                                or compression threads for the ``tgz_stream`` method
+        :param bool verbose: show a progress bar for the ``per_file`` method
+        :param func update_func: progress callback for the ``per_file`` method, it
+                                 is called with the number of bytes uploaded, the
+                                 total number of bytes and a flag that indicates
+                                 the upload is finished
         """
         if not isinstance(directory, str):
             directory = str(directory)
@@ -562,14 +633,8 @@ class AbstractResource(XNATBaseObject):
         method = method or 'tgz_file'
 
         if method == 'per_file':
-            for root, _, files in os.walk(directory):
-                for filename in files:
-                    file_path = os.path.join(root, filename)
-                    if os.path.getsize(file_path) == 0:
-                        continue
-
-                    target_path = os.path.relpath(file_path, directory)
-                    self.upload(file_path, target_path, overwrite=overwrite, **kwargs)
+            self._upload_per_file(directory, overwrite=overwrite, max_workers=max_workers,
+                                  verbose=verbose, update_func=update_func, **kwargs)
         elif method == 'tar_memory':
             fh = BytesIO()
             with TarFile(name='upload.tar', mode='w', fileobj=fh) as tar_file:
@@ -600,5 +665,65 @@ class AbstractResource(XNATBaseObject):
 
                 fh.seek(0)
                 self.upload(fh, 'upload.tar.gz', overwrite=overwrite, extract=True, **kwargs)
+        elif method == 'tgz_stream':
+            def write_tar(fileobj):
+                with TarFile(name='upload.tar', mode='w', fileobj=fileobj) as tar_file:
+                    tar_file.add(directory, '')
+
+            stream = ParallelGzipStream(write_tar, threads=max_workers)
+            self.upload(stream, 'upload.tar.gz', overwrite=overwrite, extract=True, **kwargs)
         else:
             print('Selected invalid upload directory method!')
+
+    def _upload_per_file(self, directory, overwrite=False, max_workers=1, verbose=False, update_func=None, **kwargs):
+        uploads = []
+        for root, _, files in os.walk(directory):
+            for filename in files:
+                file_path = os.path.join(root, filename)
+                file_size = os.path.getsize(file_path)
+                if file_size == 0:
+                    continue
+
+                uploads.append((file_path, os.path.relpath(file_path, directory), file_size))
+
+        total_bytes = sum(x[2] for x in uploads)
+        if verbose and update_func is None:
+            update_func = default_update_func(total_bytes)
+        if update_func is None:
+            update_func = lambda *args: None
+
+        progress_lock = threading.Lock()
+        progress = {'bytes': 0}
+
+        def upload_file(upload):
+            file_path, target_path, file_size = upload
+            self.upload(file_path, target_path, overwrite=overwrite, **kwargs)
+            with progress_lock:
+                progress['bytes'] += file_size
+                update_func(progress['bytes'], total_bytes, False)
+
+        start_time = time.time()
+        failed = []
+        update_func(0, total_bytes, False)
+        try:
+            with ThreadPoolExecutor(max_workers=max(max_workers or 1, 1)) as executor:
+                futures = {executor.submit(upload_file, x): x[1] for x in uploads}
+                for future in as_completed(futures):
+                    exception = future.exception()
+                    if exception is not None:
+                        self.logger.error('Failed to upload {}: {}'.format(futures[future], exception))
+                        failed.append(futures[future])
+        finally:
+            update_func(progress['bytes'], total_bytes, True)
+
+        duration = max(time.time() - start_time, 1e-6)
+        self.logger.info('Uploaded {} files ({:.1f} MiB) in {:.1f} seconds ({:.1f} files/s, {:.2f} MiB/s)'.format(
+            len(uploads) - len(failed),
+            progress['bytes'] / 1048576.0,
+            duration,
+            (len(uploads) - len(failed)) / duration,
+            progress['bytes'] / 1048576.0 / duration,
+        ))
+
+        if failed:
+            raise XNATUploadError('Failed to upload {} of {} files: {}'.format(len(failed), len(uploads), ', '.join(sorted(failed))))